@@ -1,24 +1,62 @@
+from __future__ import annotations
+
 import sys
 import os
 import asyncio
 import argparse
-import yaml
-import tempfile
 import shutil
-from typing import Literal
+from typing import Literal, TYPE_CHECKING
 from pathlib import Path
 from getpass import getuser
-from nginx_install.config import Config
-from nginx_install.context import Context
-from nginx_install.utils import model_dump_yaml
 from subprocess import CalledProcessError
+if TYPE_CHECKING:
+    from nginx_install.context import Context
+    from nginx_install.builddir import BuildDir
+    from nginx_install.plan import Plan
+
+# Heavy modules (pydantic models, httpx, rich...) are imported inside `main`
+# only once they are needed, so `--help`, `-V` and the unprivileged run that
+# re-executes itself under sudo stay fast.
+
+
+def print_plan(plan: Plan):
+    if plan.changes:
+        print("Changes to the installed nginx:")
+        print(*plan.changes, sep='\n')
+    else:
+        print("No changes, installed nginx matches the config "
+              "(use --force to install anyway)")
+    for note in plan.notes:
+        print(f"Note: {note}")
+
+
+def parse_libs(specs: list[str]) -> dict[str, Path]:
+    """`[name=]path` arguments, named after the library's dir by default"""
+    ret = dict[str, Path]()
+    for spec in specs:
+        name, _, path = spec.rpartition('=')
+        ret[name or Path(path).parent.name] = Path(path)
+    return ret
+
+
+def write_metrics(ctx: Context):
+    cfg = ctx.cfg.metrics
+    record = ctx.metrics.record()
+    try:
+        ctx.metrics.write_jsonl(cfg.jsonl_path, record)
+        if cfg.prometheus_path is not None:
+            ctx.metrics.write_prometheus(cfg.prometheus_path, record)
+    except OSError as e:
+        ctx.logger.warning("Failed to write metrics: %s", e)
 
 
 async def main() -> int:  # skipcq: PY-R1000
     parser = argparse.ArgumentParser(
         "nginx_install", description="nginx installation script")
     parser.add_argument("action", type=str, help="Action to perform", choices=[
-                        "prepare", "build", "install", "uninstall", "clean"])
+                        "prepare", "build", "install", "uninstall", "clean",
+                        "plan", "conf", "precompress", "luac",
+                        "comp-bench", "regex-bench", "geoip-update"])
     parser.add_argument("build_dir", type=str,
                         help="Directory to build in", nargs="?", default=None)
     parser.add_argument("-V", "--version", action="version", version="0.0.1")
@@ -34,21 +72,46 @@ async def main() -> int:  # skipcq: PY-R1000
                         help="Keep build directory after completion")
     parser.add_argument("--no-build", action="store_true",
                         help="Skip build step in install action")
+    parser.add_argument("--tmpfs", action="store_true",
+                        help="Build in RAM if no build_dir is given")
+    parser.add_argument("--force", action="store_true",
+                        help="Install even if the installed nginx matches the config")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Ignore persistent configure caches")
+    parser.add_argument("--sample", type=str, default=None,
+                        help="comp-bench: directory or file of sample responses")
+    parser.add_argument("--zlib-lib", type=str, action="append", default=[],
+                        help="comp-bench: [NAME=]path of another libz.so to "
+                        "compare, e.g. ng=zlib-ng/libz.so, repeatable")
+    parser.add_argument("--brotli-lib", type=str, action="append", default=[],
+                        help="comp-bench: [NAME=]path of a libbrotlienc.so to "
+                        "compare at levels 4-11, e.g. native=out/libbrotlienc.so, "
+                        "repeatable")
+    parser.add_argument("--write", action="store_true",
+                        help="comp-bench: save the recommended levels to the config")
+    parser.add_argument("--uris", type=str, default=None,
+                        help="regex-bench: file of URIs or an access log, "
+                        "defaults to core.http_log_path")
+    parser.add_argument("--pcre-lib", type=str, default=None,
+                        help="regex-bench: libpcre2-8.so to use instead of the system one")
+    parser.add_argument("--sysctl", action="store_true",
+                        help="conf: print the sysctl.d settings the config needs")
+    parser.add_argument("--systemd", action="store_true",
+                        help="conf: print the systemd unit settings the config "
+                        "gives nginx, as a drop-in or a whole unit")
     parser.add_argument("--dry", action="store_true",
                         help="Dry run, print commands that would be executed")
     parser.add_argument("--verbose", action="store_true",
                         help="Print debug information")
     args = parser.parse_args()
 
-    action: Literal["install", "uninstall", "build", "clean"] = args.action
+    action: Literal["install", "uninstall", "build", "clean", "plan",
+                    "conf", "precompress", "luac", "comp-bench",
+                    "regex-bench", "geoip-update"] = args.action
 
-    if args.build_dir is None:
-        if action == "clean":
-            sys.stderr.write("No build directory specified")
-            return 1
-        build_dir = Path(tempfile.mkdtemp())
-    else:
-        build_dir = Path(args.build_dir)
+    if args.build_dir is None and action == "clean":
+        sys.stderr.write("No build directory specified")
+        return 1
 
     config_path = Path(args.config)
     if not config_path.exists():
@@ -58,53 +121,217 @@ async def main() -> int:  # skipcq: PY-R1000
         user_input = input("Do you want to create it? [Y/n] ").strip() or 'y'
         if user_input.lower() != 'y':
             return 1
+        from nginx_install.config import Config
+        from nginx_install.utils import model_dump_yaml
         config = Config()
         config_path.write_text(model_dump_yaml(config))
         print(f"Config file {config_path} created")
         return 0
 
+    if action == "conf":
+        import yaml
+        from nginx_install.config import Config
+        from nginx_install.ngx_conf import generate, sysctl_conf
+        config = Config.model_validate(yaml.safe_load(config_path.read_text()))
+        if args.systemd:
+            from nginx_install import systemd
+            print(systemd.dropin(config) if config.systemd.dropin
+                  else systemd.unit(config))
+        else:
+            print(sysctl_conf(config) if args.sysctl else generate(config))
+        return 0
+
+    if action == "comp-bench":
+        import yaml
+        from nginx_install.config import Config
+        from nginx_install.utils import model_dump_yaml
+        from nginx_install import comp_bench
+        config = Config.model_validate(yaml.safe_load(config_path.read_text()))
+        sample = Path(args.sample) if args.sample else config.nginx_conf.root
+        bodies = comp_bench.load_sample(sample)
+        if not bodies:
+            sys.stderr.write(f"No compressible sample responses in {sample}")
+            return 1
+        results = comp_bench.run(
+            bodies, parse_libs(args.zlib_lib), parse_libs(args.brotli_lib),
+            config.nginx_conf.brotli_window)
+        advice = comp_bench.advise(bodies, results)
+        if not args.quiet:
+            print(*results, sep='\n')
+            level = config.nginx_conf.gzip_comp_level
+            print(f"At the configured gzip_comp_level {level}:")
+            print(*comp_bench.compare_zlibs(results, level), sep='\n')
+            if args.brotli_lib:
+                print("brotli builds at levels 4-11:")
+                print(*comp_bench.compare_brotlis(results), sep='\n')
+            print(*advice.why, sep='\n')
+        if args.write:
+            comp_bench.apply(config, advice)
+            config_path.write_text(model_dump_yaml(config))
+            print(f"Updated nginx_conf in {config_path}")
+        return 0
+
+    if action == "regex-bench":
+        import yaml
+        from nginx_install.config import Config
+        from nginx_install import regex_bench
+        config = Config.model_validate(yaml.safe_load(config_path.read_text()))
+        core = config.core
+        regexes = regex_bench.extract(core.config_prefix / core.config_name)
+        uris = regex_bench.load_uris(
+            Path(args.uris) if args.uris else core.http_log_path)
+        if not regexes or not uris:
+            sys.stderr.write(f"Found {len(regexes)} regexes and {len(uris)} URIs")
+            return 1
+        results = regex_bench.PCRE2(args.pcre_lib).run(regexes, uris)
+        if not args.quiet:
+            results.sort(key=lambda r: r.interp_seconds, reverse=True)
+            print(*results, sep='\n')
+            print(*regex_bench.summary(results, uris), sep='\n')
+        return 0
+
     euid = os.geteuid()
+    if action == "plan" or (
+        action == "install" and not args.no_build and not args.force
+    ):
+        import yaml
+        from nginx_install.config import Config
+        from nginx_install.plan import make_plan
+        config = Config.model_validate(yaml.safe_load(config_path.read_text()))
+        try:
+            plan = await make_plan(config)
+        except Exception as e:  # pylint: disable=broad-except
+            if action == "plan":
+                sys.stderr.write(f"Failed to make a plan: {e}")
+                return 1
+            print(f"Failed to make a plan, installing anyway: {e}")
+        else:
+            if not args.quiet:
+                print_plan(plan)
+            if action == "plan" or not plan.changes:
+                return 0
+        if euid != 0:
+            # The privileged run need not plan again
+            sys.argv.append("--force")
+
     if euid != 0:
         fwd_args = ["sudo", "-E", sys.executable, *sys.argv, "-u", args.user]
         os.execlpe("/usr/bin/sudo", *fwd_args, os.environ)
 
+    import yaml
+    from nginx_install.config import Config
+    from nginx_install.context import Context
+    from nginx_install.builddir import make_build_dir, save_artifacts
+
+    config = Config.model_validate(yaml.safe_load(config_path.read_text()))
+    if args.tmpfs:
+        config.build.placement = "tmpfs"
+    if args.no_cache:
+        config.cache.enabled = False
+
+    if action == "precompress":
+        import logging
+        from nginx_install.precompress import precompress
+        logging.basicConfig(
+            level=logging.DEBUG if args.verbose else logging.INFO)
+        stats = precompress(config, args.dry)
+        if not args.quiet:
+            print(stats)
+        return 0
+
+    if action == "luac":
+        import logging
+        from nginx_install.luac import luac
+        logging.basicConfig(
+            level=logging.DEBUG if args.verbose else logging.INFO)
+        stats = luac(config, args.dry)
+        if not args.quiet:
+            print(stats)
+        return 1 if stats.failed else 0
+
+    placed: BuildDir | None = None
+    if args.build_dir is None:
+        placed = make_build_dir(config, args.dry)
+        build_dir = placed.path
+    else:
+        build_dir = Path(args.build_dir)
+
     if build_dir.exists() and (not args.no_build or args.keep_build):
         shutil.rmtree(build_dir)
     build_dir.mkdir(exist_ok=True)
 
-    config = Config.model_validate(yaml.safe_load(config_path.read_text()))
-    ctx = Context(config, build_dir, args.dry,
-                  args.verbose, args.quiet, args.user)
+    ctx = Context(config, build_dir, args.dry, args.verbose, args.quiet,
+                  args.user, config_path, fixed_build_dir=placed is None)
     logger = ctx.logger
+    if placed is not None and placed.note:
+        logger.info(placed.note)
     logger.debug("All extra installers in config: %s", config.installers)
     config.installers = [i for i in config.installers if i.enabled]
     installers = config.installers
     logger.info("Enabled extra installers %s", installers)
 
+    metrics = ctx.metrics
+    metrics.labels.update(
+        action=action, flavor=config.core.flavor,
+        nginx_version=config.core.nginx_version)
+
     try:
+        if action == "geoip-update":
+            geoip = next((i for i in installers
+                          if i.classname == "GeoIP2Installer"), None)
+            if geoip is None:
+                raise RuntimeError("GeoIP2Installer is not enabled")
+            with metrics.phase("geoip-update"):
+                await metrics.measure(geoip, "geoip-update", geoip.refresh(ctx))
+
         if action in ("prepare", "install", "build"):
-            await config.core.prepare(ctx)
-            await asyncio.gather(*(i.prepare(ctx) for i in installers))
+            with metrics.phase("prepare"):
+                await metrics.measure(
+                    config.core, "prepare", config.core.prepare(ctx))
+                await asyncio.gather(*(
+                    metrics.measure(i, "prepare", i.prepare(ctx))
+                    for i in installers))
 
         if action in ("install", "build") and not args.no_build:
-            await config.core.build(ctx)
-            await asyncio.gather(*(i.build(ctx) for i in installers))
+            with metrics.phase("build"):
+                await metrics.measure(
+                    config.core, "build", config.core.build(ctx))
+                await asyncio.gather(*(
+                    metrics.measure(i, "build", i.build(ctx))
+                    for i in installers))
 
         if action == "install":
-            await config.core.install(ctx)
-            await asyncio.gather(*(i.install(ctx) for i in installers))
+            with metrics.phase("install"):
+                await metrics.measure(
+                    config.core, "install", config.core.install(ctx))
+                await asyncio.gather(*(
+                    metrics.measure(i, "install", i.install(ctx))
+                    for i in installers))
 
         if action == "uninstall":
-            await config.core.uninstall(ctx)
-            await asyncio.gather(*(i.uninstall(ctx) for i in config.installers))
+            with metrics.phase("uninstall"):
+                await metrics.measure(
+                    config.core, "uninstall", config.core.uninstall(ctx))
+                await asyncio.gather(*(
+                    metrics.measure(i, "uninstall", i.uninstall(ctx))
+                    for i in config.installers))
+
+        if (
+            placed is not None and placed.tmpfs
+            and config.build.artifacts_dir is not None
+        ):
+            await save_artifacts(ctx, config.build.artifacts_dir)
 
         if action in ("clean", "install", "uninstall") and not args.keep_build:
-            await config.core.clean(ctx)
-            await asyncio.gather(*(i.clean(ctx) for i in config.installers))
+            with metrics.phase("clean"):
+                await config.core.clean(ctx)
+                await asyncio.gather(*(i.clean(ctx) for i in config.installers))
 
         ctx.print(f"Completed {action} action")
+        metrics.outcome = "success"
 
     except CalledProcessError as e:
+        metrics.outcome = "failed"
         err_msg = f"Command {e.cmd} returned status {e.returncode}, error: {e.stderr}"
         logger.critical(err_msg)
         sys.stderr.write(err_msg)
@@ -113,6 +340,7 @@ async def main() -> int:  # skipcq: PY-R1000
         return 1
 
     except Exception as e:
+        metrics.outcome = "failed"
         err_msg = f"An error occurred: {e}"
         logger.critical(err_msg)
         sys.stderr.write(err_msg)
@@ -123,21 +351,50 @@ async def main() -> int:  # skipcq: PY-R1000
         if action == "install" and args.reload:
             rs = await ctx.run_cmd("nginx -t")
             if rs.failed:
+                metrics.outcome = "failed"
                 sys.stderr.write("Nginx configuration test failed")
                 sys.stderr.write(rs.get_error_str())
                 return 1
 
+            from nginx_install import health
+            if config.health.enabled and \
+                    health.read_pid(config.core.pid_path) is not None:
+                try:
+                    kept = await health.gate(ctx)
+                except (OSError, RuntimeError) as e:
+                    # E.g. the old master died before or during the switch
+                    metrics.outcome = "failed"
+                    err_msg = f"Health gate failed: {e}"
+                    logger.critical(err_msg)
+                    sys.stderr.write(err_msg)
+                    logger.exception(e)
+                    return 1
+                if not kept:
+                    metrics.outcome = "rolled_back"
+                    sys.stderr.write(
+                        "New nginx regressed, rolled back to the previous one\n")
+                    return 1
+                return 0
+
             rs = await ctx.run_cmd("nginx -s reload")
             if rs.failed:
+                metrics.outcome = "failed"
                 sys.stderr.write("Failed to reload Nginx")
                 sys.stderr.write(rs.get_error_str())
                 return 1
 
     finally:
         ctx.progress.refresh()
+        if config.metrics.enabled and not ctx.dry_run:
+            write_metrics(ctx)
         if build_dir.exists():
             rs = await ctx.run_cmd(
                 f"chown -R {ctx.user}:{ctx.user} {build_dir}")
+        if placed is not None and not args.keep_build:
+            if action == "geoip-update":
+                # Only downloads and logs, and no `clean` to remove them
+                shutil.rmtree(build_dir, ignore_errors=True)
+            placed.release()
 
     return 0
 
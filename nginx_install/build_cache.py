@@ -0,0 +1,128 @@
+import os
+import hashlib
+import platform
+from pathlib import Path
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from .context import Context
+else:
+    Context = None
+
+STAMP_NAME = ".nginx_install_configured"
+
+
+class BuildCache:
+    """
+    Persistent cache of configured source trees and autoconf caches
+
+    Everything is keyed by the compiler version and host, so a compiler
+     upgrade or a copied cache directory never reuses stale probes.
+    Configured autotools and cmake trees embed their absolute path in
+     Makefiles, libtool and `CMakeCache.txt`, so unless `relocatable`,
+     trees are also keyed by where they live and only come back there.
+    Such trees are neither stored nor looked up in a temporary
+     `build_dir`, which is new on every run.
+    """
+
+    keep: int = 3
+    """Cached trees kept per name, oldest are pruned first"""
+
+    def __init__(self, ctx: Context, root: Path, enabled: bool = True,
+                 fixed_build_dir: bool = True):
+        self.ctx = ctx
+        self.root = root
+        self.enabled = enabled and not ctx.dry_run
+        self.fixed_build_dir = fixed_build_dir
+        """Whether `build_dir` is the same on every run"""
+        self._host_key: str | None = None
+
+    async def host_key(self) -> str:
+        """Hash of the compiler version and host"""
+        if self._host_key is None:
+            rs = await self.ctx.run_cmd("cc --version", run_in_dry=True)
+            cc_version = rs.get_output_str().partition('\n')[0]
+            uname = platform.uname()
+            raw = f"{cc_version}|{uname.machine}|{uname.node}|{uname.system}"
+            self._host_key = hashlib.sha256(raw.encode()).hexdigest()[:16]
+        return self._host_key
+
+    async def key(self, *parts: str) -> str:
+        h = hashlib.sha256((await self.host_key()).encode())
+        for p in parts:
+            h.update(b'\0')
+            h.update(p.encode())
+        return h.hexdigest()[:24]
+
+    @staticmethod
+    def entry(key: str, tree: Path, relocatable: bool = False) -> str:
+        """Name of the cached copy of `tree` under `key`"""
+        if relocatable:
+            return key
+        where = hashlib.sha256(str(tree.absolute()).encode()).hexdigest()
+        return f"{key}-{where[:8]}"
+
+    async def autoconf_cache_file(self, name: str) -> Path | None:
+        """`--cache-file` for an autoconf `configure`, `None` if disabled"""
+        if not self.enabled:
+            return None
+        d = self.root / "autoconf" / await self.host_key()
+        d.mkdir(parents=True, exist_ok=True)
+        return d / f"{name}.cache"
+
+    @staticmethod
+    def is_configured(tree: Path, key: str) -> bool:
+        """Whether `tree` was configured with inputs hashing to `key`"""
+        try:
+            return (tree / STAMP_NAME).read_text().strip() == key
+        except OSError:
+            return False
+
+    def mark_configured(self, tree: Path, key: str):
+        if not self.ctx.dry_run:
+            (tree / STAMP_NAME).write_text(key)
+
+    async def restore_tree(self, name: str, key: str, dest: Path,
+                           relocatable: bool = False) -> bool:
+        """Copy a cached tree to `dest`, return `False` on a miss"""
+        if not self.enabled or not (relocatable or self.fixed_build_dir):
+            return False
+        src = self.root / "trees" / name / self.entry(key, dest, relocatable)
+        if not src.is_dir():
+            self.ctx.metrics.incr("cache_misses")
+            self.ctx.logger.debug("Cache miss for %s (%s)", name, key)
+            return False
+
+        self.ctx.logger.info("Reusing cached %s tree %s", name, key)
+        rs = await self.ctx.run_cmd(f"rm -rf '{dest}' && cp -a '{src}' '{dest}'")
+        rs.raise_for_returncode()
+        os.utime(src)
+        self.ctx.metrics.incr("cache_hits")
+        return True
+
+    async def store_tree(self, name: str, key: str, src: Path,
+                         relocatable: bool = False):
+        """Copy `src` into the cache under `key`, pruning old entries"""
+        if not self.enabled:
+            return
+        if not (relocatable or self.fixed_build_dir):
+            self.ctx.logger.debug(
+                "Not caching %s tree, %s is temporary", name, self.ctx.build_dir)
+            return
+        d = self.root / "trees" / name
+        key = self.entry(key, src, relocatable)
+        d.mkdir(parents=True, exist_ok=True)
+        tmp = d / f".{key}.{os.getpid()}"
+        rs = await self.ctx.run_cmd(
+            f"rm -rf '{tmp}' && cp -a '{src}' '{tmp}' "
+            f"&& rm -rf '{d / key}' && mv '{tmp}' '{d / key}'")
+        if rs.failed:
+            self.ctx.logger.warning(
+                "Failed to cache %s tree: %s", name, rs.get_error_str())
+            return
+
+        entries = sorted(
+            (p for p in d.iterdir() if not p.name.startswith('.')),
+            key=lambda p: p.stat().st_mtime, reverse=True)
+        for old in entries[self.keep:]:
+            self.ctx.logger.debug("Pruning cached %s tree %s", name, old.name)
+            await self.ctx.run_cmd(f"rm -rf '{old}'")
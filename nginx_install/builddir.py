@@ -0,0 +1,178 @@
+import os
+import subprocess
+import tempfile
+from pathlib import Path
+from typing import TYPE_CHECKING
+from .utils import MiB
+if TYPE_CHECKING:
+    from .config import Config
+    from .context import Context
+else:
+    Config = None
+    Context = None
+
+TMPFS_HEADROOM = 1.25
+"""Multiplier applied to the estimated build size when sizing a tmpfs"""
+
+
+def estimate_build_size(cfg: Config) -> int:
+    """Estimate the peak size of `build_dir` from the enabled installers"""
+    return cfg.core.build_size + sum(
+        i.build_size for i in cfg.installers if i.enabled)
+
+
+def mem_available() -> int:
+    """`MemAvailable` in bytes, 0 if unknown"""
+    try:
+        with open("/proc/meminfo", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return 0
+
+
+def fs_type(path: Path) -> str:
+    """Filesystem type of the mount containing `path`, empty if unknown"""
+    target = str(path.resolve())
+    mountpoint, fstype = '', ''
+    try:
+        with open("/proc/mounts", encoding="utf-8") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) < 3:
+                    continue
+                mnt = parts[1].replace("\\040", ' ')
+                if (
+                    (target == mnt or target.startswith(mnt.rstrip('/') + '/'))
+                    and len(mnt) >= len(mountpoint)
+                ):
+                    mountpoint, fstype = mnt, parts[2]
+    except OSError:
+        pass
+    return fstype
+
+
+def fs_free(path: Path) -> int:
+    st = os.statvfs(path)
+    return st.f_bavail * st.f_frsize
+
+
+class BuildDir:
+    """
+    A build directory picked by `make_build_dir`
+
+    `path` is the directory to build in, `mountpoint` is set
+     when a dedicated tmpfs was mounted for it.
+    """
+
+    def __init__(
+            self,
+            path: Path,
+            placement: str,
+            mountpoint: Path | None = None,
+            note: str = '',
+    ):
+        self.path = path
+        self.placement = placement
+        self.mountpoint = mountpoint
+        self.note = note
+
+    @property
+    def tmpfs(self) -> bool:
+        return self.placement == "tmpfs"
+
+    def release(self):
+        """Unmount the dedicated tmpfs, if any"""
+        if self.mountpoint is None:
+            return
+        subprocess.run(
+            ["umount", "-l", str(self.mountpoint)],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            check=False,
+        )
+        try:
+            self.mountpoint.rmdir()
+        except OSError:
+            pass
+        self.mountpoint = None
+
+
+def _on_disk(note: str) -> BuildDir:
+    return BuildDir(Path(tempfile.mkdtemp()), "disk", note=note)
+
+
+def make_build_dir(cfg: Config, dry_run: bool = False) -> BuildDir:
+    """
+    Create a temporary build directory according to `cfg.build.placement`
+
+    For `tmpfs`, an existing tmpfs at `tmpfs_root` is used if it has room,
+     otherwise a dedicated one sized from the enabled installers is mounted.
+    Falls back to disk when available RAM is short or mounting fails.
+    """
+    if cfg.build.placement == "disk":
+        return _on_disk('')
+
+    need = int(estimate_build_size(cfg) * TMPFS_HEADROOM)
+    avail = mem_available()
+    reserve = cfg.build.ram_reserve * MiB
+    if avail - reserve < need:
+        return _on_disk(
+            f"Need {need // MiB} MiB of RAM for a tmpfs build_dir but only "
+            f"{max(avail - reserve, 0) // MiB} MiB can be spared, using disk")
+
+    root = cfg.build.tmpfs_root
+    if root.is_dir() and fs_type(root) == "tmpfs" and fs_free(root) >= need:
+        path = Path(tempfile.mkdtemp(prefix="nginx_install-", dir=root))
+        return BuildDir(path, "tmpfs",
+                        note=f"Building in tmpfs {root} ({need // MiB} MiB)")
+
+    if dry_run:
+        return _on_disk("Not mounting a tmpfs in dry run, using disk")
+
+    mountpoint = Path(tempfile.mkdtemp(prefix="nginx_install-"))
+    rs = subprocess.run(
+        ["mount", "-t", "tmpfs", "-o", f"size={need // MiB}m,mode=0755",
+         "nginx_install", str(mountpoint)],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        text=True, check=False,
+    )
+    if rs.returncode != 0:
+        mountpoint.rmdir()
+        return _on_disk(
+            f"Failed to mount tmpfs: {rs.stderr.strip()}, using disk")
+
+    # Build in a subdirectory so `clean` can remove it without
+    # touching the mountpoint itself
+    path = mountpoint / "build"
+    path.mkdir()
+    return BuildDir(path, "tmpfs", mountpoint,
+                    note=f"Mounted a {need // MiB} MiB tmpfs at {mountpoint}")
+
+
+async def save_artifacts(ctx: Context, dest: Path):
+    """Copy the built binaries and logs out of `build_dir` into `dest`"""
+    src = ctx.nginx_src_dir
+    objs_dirs = [src / "objs", *src.glob("build/nginx-*/objs")]
+    files = list[Path]()
+    for objs in objs_dirs:
+        if (objs / "nginx").is_file():
+            files.append(objs / "nginx")
+        files.extend(objs.glob("*.so"))
+    # `core.march_variants` staged with their modules and libraries,
+    # to install on hosts with other CPUs
+    variants = ctx.build_dir / "variants"
+    if variants.is_dir():
+        files.append(variants)
+
+    ctx.logger.info("Saving %d artifacts to %s", len(files), dest)
+    rs = await ctx.run_cmd(f"mkdir -p '{dest}'")
+    rs.raise_for_returncode()
+    for f in files:
+        rs = await ctx.run_cmd(f"cp -a '{f}' '{dest}'")
+        rs.raise_for_returncode()
+    logs = ctx.build_dir / "logs"
+    if logs.exists():
+        rs = await ctx.run_cmd(f"cp -a '{logs}' '{dest}'")
+        rs.raise_for_returncode()
@@ -0,0 +1,271 @@
+"""
+Measure gzip/brotli levels on sample responses and recommend settings
+
+Dynamic compression costs CPU on every response, so the level worth
+ paying for is the fastest one that stays close to the best ratio.
+"""
+from __future__ import annotations
+
+import time
+import zlib
+import ctypes
+import mimetypes
+from pathlib import Path
+from typing import Callable, Iterable, NamedTuple, TYPE_CHECKING
+from .ngx_conf import STATIC_TYPES
+if TYPE_CHECKING:
+    from .config import Config
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+GZIP_WINDOWS = {15: "32k", 14: "16k", 13: "8k"}
+"""`wbits` -> `gzip_window`"""
+BROTLI_WINDOWS = {24: "16m", 22: "4m", 20: "1m", 18: "256k"}
+"""`lgwin` -> `brotli_window`"""
+BROTLI_LIB_LEVELS = range(4, 12)
+"""Levels measured for other brotli builds, where the encoder dominates"""
+MTU_PAYLOAD = 1400
+"""Responses below this fit one packet, compressing them rarely pays off"""
+
+
+class Result(NamedTuple):
+    codec: str
+    """
+    `gzip`, `brotli` or `gzip-<name>`/`brotli-<name>` for another zlib
+     or libbrotlienc build, e.g. `gzip-ng` or `brotli-native`
+    """
+    level: int
+    window: str
+    bytes_in: int
+    bytes_out: int
+    seconds: float
+
+    @property
+    def ratio(self) -> float:
+        return self.bytes_out / self.bytes_in if self.bytes_in else 1.0
+
+    @property
+    def mbps(self) -> float:
+        return self.bytes_in / self.seconds / 1e6 if self.seconds else float("inf")
+
+    def __str__(self) -> str:
+        return (f"{self.codec:8} level {self.level:2} window {self.window:4} "
+                f"ratio {self.ratio:.4f} {self.mbps:9.1f} MB/s")
+
+
+class Advice(NamedTuple):
+    gzip_comp_level: int
+    gzip_min_length: int
+    brotli_comp_level: int | None
+    brotli_window: str | None
+    brotli_min_length: int | None
+    why: list[str]
+
+
+def load_sample(path: Path) -> list[bytes]:
+    """Bodies of compressible files under `path`, or `path` itself"""
+    if path.is_file():
+        return [path.read_bytes()]
+    types = frozenset(STATIC_TYPES)
+    bodies = list[bytes]()
+    for p in sorted(path.rglob('*')):
+        if not p.is_file() or p.name.endswith((".gz", ".br")):
+            continue
+        mime, _ = mimetypes.guess_type(p.name, strict=False)
+        # Captured bodies often have no extension
+        if mime in types or (mime is None and not p.suffix):
+            bodies.append(p.read_bytes())
+    return bodies
+
+
+def load_zlib(lib: Path) -> Callable[[bytes, int], bytes]:
+    """`compress2` of another zlib build, e.g. cloudflare's or zlib-ng's `libz.so`"""
+    z = ctypes.CDLL(str(lib))
+    z.compressBound.restype = ctypes.c_ulong
+    z.compress2.argtypes = [
+        ctypes.c_char_p, ctypes.POINTER(ctypes.c_ulong),
+        ctypes.c_char_p, ctypes.c_ulong, ctypes.c_int]
+
+    def compress(data: bytes, level: int) -> bytes:
+        size = ctypes.c_ulong(z.compressBound(len(data)))
+        buf = ctypes.create_string_buffer(size.value)
+        if z.compress2(buf, ctypes.byref(size), data, len(data), level) != 0:
+            raise RuntimeError(f"compress2 failed in {lib}")
+        return buf.raw[:size.value]
+    return compress
+
+
+def load_brotli(lib: Path) -> Callable[[bytes, int, int], bytes]:
+    """`BrotliEncoderCompress` of a `libbrotlienc` build"""
+    b = ctypes.CDLL(str(lib))
+    b.BrotliEncoderMaxCompressedSize.restype = ctypes.c_size_t
+    b.BrotliEncoderMaxCompressedSize.argtypes = [ctypes.c_size_t]
+    b.BrotliEncoderCompress.argtypes = [
+        ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_size_t,
+        ctypes.c_char_p, ctypes.POINTER(ctypes.c_size_t), ctypes.c_char_p]
+
+    def compress(data: bytes, quality: int, lgwin: int) -> bytes:
+        size = ctypes.c_size_t(b.BrotliEncoderMaxCompressedSize(len(data)))
+        buf = ctypes.create_string_buffer(size.value)
+        # Mode 0 is BROTLI_MODE_GENERIC, as used by ngx_brotli
+        if not b.BrotliEncoderCompress(
+                quality, lgwin, 0, len(data), data, ctypes.byref(size), buf):
+            raise RuntimeError(f"BrotliEncoderCompress failed in {lib}")
+        return buf.raw[:size.value]
+    return compress
+
+
+def _time(fn: Callable[[bytes], bytes], bodies: list[bytes]) -> tuple[int, float]:
+    """Total output size and best-of-several compression time"""
+    best = float("inf")
+    out = 0
+    for _ in range(5):
+        start = time.perf_counter()
+        out = sum(len(fn(b)) for b in bodies)
+        elapsed = time.perf_counter() - start
+        best = min(best, elapsed)
+        if elapsed > 0.5:
+            break
+    return out, best
+
+
+def _deflate(level: int, wbits: int) -> Callable[[bytes], bytes]:
+    def fn(data: bytes) -> bytes:
+        c = zlib.compressobj(level, zlib.DEFLATED, wbits)
+        return c.compress(data) + c.flush()
+    return fn
+
+
+def _lgwin(window: str) -> int:
+    """`brotli_window` such as `4m` -> `lgwin`, within brotli's 10..24"""
+    units = {'k': 1 << 10, 'm': 1 << 20}
+    size = int(window[:-1]) * units[window[-1].lower()] \
+        if window[-1].lower() in units else int(window)
+    return min(max(size.bit_length() - 1, 10), 24)
+
+
+def run(bodies: list[bytes],
+        zlib_libs: dict[str, Path] | None = None,
+        brotli_libs: dict[str, Path] | None = None,
+        brotli_window: str = "4m") -> list[Result]:
+    """
+    Measure every level and window
+
+    :param zlib_libs: Name -> `libz.so` of other zlib builds to measure
+        against the stock zlib, e.g. `{"cf": ..., "ng": ...}`
+    :param brotli_libs: Name -> `libbrotlienc.so` of brotli builds to
+        measure at `BROTLI_LIB_LEVELS` and `brotli_window`,
+        e.g. `{"distro": ..., "native": ...}`
+    """
+    total = sum(len(b) for b in bodies)
+    results = list[Result]()
+    for level in range(1, 10):
+        for wbits, window in GZIP_WINDOWS.items():
+            out, secs = _time(_deflate(level, wbits), bodies)
+            results.append(Result("gzip", level, window, total, out, secs))
+    for name, lib in (zlib_libs or {}).items():
+        compress = load_zlib(lib)
+        for level in range(1, 10):
+            out, secs = _time(lambda b, lv=level, c=compress: c(b, lv), bodies)
+            results.append(Result(f"gzip-{name}", level, "32k", total, out, secs))
+    lgwin = _lgwin(brotli_window)
+    for name, lib in (brotli_libs or {}).items():
+        compress_br = load_brotli(lib)
+        for level in BROTLI_LIB_LEVELS:
+            out, secs = _time(
+                lambda b, q=level, c=compress_br: c(b, q, lgwin), bodies)
+            results.append(
+                Result(f"brotli-{name}", level, brotli_window, total, out, secs))
+    if brotli is not None:
+        for level in range(0, 12):
+            for lgwin, window in BROTLI_WINDOWS.items():
+                out, secs = _time(
+                    lambda b, q=level, w=lgwin: brotli.compress(b, quality=q, lgwin=w),
+                    bodies)
+                results.append(Result("brotli", level, window, total, out, secs))
+    return results
+
+
+def _pick(results: Iterable[Result], tolerance: float) -> Result:
+    """Fastest result within `tolerance` of the best ratio"""
+    results = list(results)
+    best = min(r.ratio for r in results)
+    good = [r for r in results if r.ratio <= best * (1 + tolerance)]
+    return max(good, key=lambda r: r.mbps)
+
+
+def _min_length(bodies: list[bytes], fn: Callable[[bytes], bytes],
+                min_saving: float) -> int:
+    """Largest small body that saves less than `min_saving`, plus one"""
+    length = 20
+    for b in bodies:
+        if len(b) < MTU_PAYLOAD and len(b) - len(fn(b)) < len(b) * min_saving:
+            length = max(length, len(b) + 1)
+    return length
+
+
+def advise(bodies: list[bytes], results: list[Result],
+           tolerance: float = 0.02, min_saving: float = 0.1) -> Advice:
+    why = list[str]()
+    gz = _pick((r for r in results if r.codec == "gzip" and r.window == "32k"),
+               tolerance)
+    why.append(f"gzip level {gz.level}: fastest within {tolerance:.0%} "
+               f"of the best gzip ratio ({gz})")
+    for r in results:
+        if r.codec.startswith("gzip-") and r.level == gz.level:
+            why.append(f"{r.codec} at that level: {r.mbps / gz.mbps:.2f}x "
+                       "the throughput of stock zlib")
+    gz_min = _min_length(bodies, _deflate(gz.level, 15), min_saving)
+    why.append(f"gzip_min_length {gz_min}: smaller sample bodies saved "
+               f"less than {min_saving:.0%}")
+
+    br_level = br_window = br_min = None
+    br_results = [r for r in results if r.codec == "brotli"]
+    if br_results:
+        br = _pick(br_results, tolerance)
+        br_level, br_window = br.level, br.window
+        why.append(f"brotli level {br.level} window {br.window}: fastest within "
+                   f"{tolerance:.0%} of the best brotli ratio ({br})")
+        lgwin = next(k for k, v in BROTLI_WINDOWS.items() if v == br.window)
+        br_min = _min_length(
+            bodies, lambda b: brotli.compress(b, quality=br.level, lgwin=lgwin),
+            min_saving)
+        why.append(f"brotli_min_length {br_min}")
+    else:
+        why.append("Python module `brotli` not found, brotli not measured")
+
+    return Advice(gz.level, gz_min, br_level, br_window, br_min, why)
+
+
+def compare_zlibs(results: list[Result], level: int) -> list[str]:
+    """Stock zlib and the other builds side by side at one gzip level"""
+    rows = [r for r in results
+            if r.codec.startswith("gzip") and r.level == level and r.window == "32k"]
+    stock = next(r for r in rows if r.codec == "gzip")
+    return [f"{r} {r.mbps / stock.mbps:5.2f}x" for r in rows]
+
+
+def compare_brotlis(results: list[Result]) -> list[str]:
+    """The `brotli-<name>` builds side by side per level, relative to the first"""
+    ret = list[str]()
+    for level in BROTLI_LIB_LEVELS:
+        rows = [r for r in results
+                if r.codec.startswith("brotli-") and r.level == level]
+        if rows:
+            ret.extend(f"{r} {r.mbps / rows[0].mbps:5.2f}x" for r in rows)
+    return ret
+
+
+def apply(cfg: Config, advice: Advice):
+    conf = cfg.nginx_conf
+    conf.gzip_comp_level = advice.gzip_comp_level
+    conf.gzip_min_length = advice.gzip_min_length
+    if advice.brotli_comp_level is not None:
+        conf.brotli_comp_level = advice.brotli_comp_level
+    if advice.brotli_window is not None:
+        conf.brotli_window = advice.brotli_window
+    if advice.brotli_min_length is not None:
+        conf.brotli_min_length = advice.brotli_min_length
@@ -1,11 +1,12 @@
 import sys
-from typing import Any
+from typing import Any, Literal
 from pydantic import BaseModel, Field, field_validator, ConfigDict
 from pydantic import field_serializer, SerializationInfo
 from pathlib import Path
 from warnings import warn
-from .installers import BaseInstaller, NginxInstaller
-from .installers import _non_core_installer_types, from_dict
+from . import installers as installer_pkg
+from .installers import BaseInstaller, NginxInstaller, from_dict
+from .utils import MiB
 
 
 class BaseConfig(BaseModel):
@@ -23,13 +24,157 @@ class Config(BaseConfig):
         user_agent: str = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36"
         extra: dict[str, Any] = Field(default_factory=dict)
 
+    class BuildConfig(BaseConfig):
+        placement: Literal["disk", "tmpfs"] = "disk"
+        """Where to put a temporary `build_dir`, ignored if one is given"""
+        tmpfs_root: Path = Path("/dev/shm")
+        """Existing tmpfs to use before mounting a dedicated one"""
+        ram_reserve: int = 512
+        """MiB of available RAM to leave untouched, fall back to disk otherwise"""
+        artifacts_dir: Path | None = None
+        """Where to copy binaries and logs out of a tmpfs `build_dir` before `clean`"""
+
+    class CacheConfig(BaseConfig):
+        enabled: bool = True
+        dir: Path = Path("/var/cache/nginx_install")
+        """Persistent configure caches and configured trees, kept across runs"""
+
+    class MetricsConfig(BaseConfig):
+        enabled: bool = True
+        jsonl_path: Path = Path("/var/log/nginx_install/metrics.jsonl")
+        """One JSON record appended per run"""
+        prometheus_path: Path | None = None
+        """node_exporter textfile collector file, e.g.
+        `/var/lib/node_exporter/textfile_collector/nginx_install.prom`"""
+
+    class NginxConfConfig(BaseConfig):
+        worker_processes: int | None = None
+        """`None` for one per usable CPU"""
+        worker_connections: int | None = None
+        """`None` to derive from `fs.file-max` and memory"""
+        ssl_session_cache: int | None = None
+        """MiB, `None` to size for `worker_connections`"""
+        reuseport: bool = True
+        backlog: int | None = None
+        """Accept queue of the TCP listeners, `None` for `worker_connections`
+        up to 65535, see `conf --sysctl` for the matching `net.core.somaxconn`"""
+        fastopen: int | None = 256
+        """TCP Fast Open queue of the listeners, `None` to turn it off,
+        needs the server bit of `net.ipv4.tcp_fastopen`"""
+        http_port: int = 80
+        https_port: int = 443
+        """Also the UDP port for HTTP/3"""
+        server_name: str = "sample.com"
+        root: Path = Path("/var/www/sample")
+        ssl_certificate: Path = Path("/usr/local/tls/sample.pem")
+        ssl_certificate_key: Path = Path("/usr/local/tls/sample.key")
+        ssl_dhparam: Path | None = Path("/usr/local/tls/dhparam.pem")
+        gzip_comp_level: int = 9
+        gzip_min_length: int = 20
+        brotli_comp_level: int = 11
+        brotli_window: str = "4m"
+        brotli_min_length: int = 20
+        """See the `comp-bench` action for values fitting your responses"""
+        stub_status_path: str | None = "/nginx_status"
+        """Loopback-only `stub_status` location when built with it, for `health`"""
+        http3: bool = True
+        """Listen for QUIC when built `--with-http_v3_module`"""
+        quic_gso: bool = True
+        """Send UDP segments in batches, needs Linux 4.18+"""
+        quic_retry: bool = False
+        """Validate client addresses first, costs one round trip"""
+        quic_bpf: bool = False
+        """Route QUIC packets to the worker owning the connection
+        across reloads, needs nginx built with BPF support on Linux 5.7+"""
+        http3_stream_buffer_size: str = "1m"
+        alt_svc_max_age: int = 86400
+        udp_buffer_size: int = 8 * MiB
+        """`rcvbuf`/`sndbuf` of the QUIC sockets, see `conf --sysctl`"""
+
+    class PrecompressConfig(BaseConfig):
+        roots: list[Path] = []
+        """Web roots to walk, `nginx_conf.root` if empty"""
+        gzip_level: int = 9
+        brotli_level: int = 11
+        """Only used if the `brotli` Python module is installed"""
+        min_size: int = 256
+        """Bytes, smaller files are not worth a compressed sibling"""
+        jobs: int | None = None
+        """Worker processes, `None` for one per CPU"""
+
+    class LuacConfig(BaseConfig):
+        package_dirs: list[Path] = []
+        """Lua package roots, each compiled to `out_dir/<its name>`"""
+        out_dir: Path = Path("/usr/local/share/nginx/luac")
+        """Put `<out_dir>/<name>/?.lua` first in `lua_package_path`"""
+        luajit: Path | None = None
+        """`None` for OpenResty's `luajit` under `core.config_prefix`"""
+        debug_info: bool = False
+        """Keep line numbers in tracebacks, at the cost of larger files"""
+        jobs: int | None = None
+        """Concurrent `luajit -b` runs, `None` for a few per CPU"""
+
+    class SystemdConfig(BaseConfig):
+        unit_dir: Path = Path("/etc/systemd/system")
+        dropin: bool = True
+        """Put the settings below in `nginx.service.d/`, leaving an
+        existing `nginx.service` and its local edits alone"""
+        limit_nofile: int | None = None
+        """`None` for `worker_rlimit_nofile` plus headroom, within `fs.nr_open`"""
+        limit_memlock: str | None = None
+        """`None` for `infinity` with `nginx_conf.quic_bpf`, unset otherwise"""
+        cpu_affinity: str | None = None
+        """e.g. `0-7`, `None` to leave placement to `worker_cpu_affinity`"""
+        nice: int | None = None
+        io_scheduling_class: Literal["realtime", "best-effort", "idle"] | None = None
+        io_scheduling_priority: int | None = None
+        tasks_max: int | str | None = None
+        """`None` for the workers and their `aio threads` pools plus headroom"""
+        oom_score_adjust: int | None = -500
+        """Make the OOM killer pick other processes first"""
+        extra: dict[str, str] = {}
+        """More `[Service]` settings, e.g. `{"LimitCORE": "infinity"}`"""
+
+    class HealthConfig(BaseConfig):
+        enabled: bool = False
+        """Gate `install --reload`: upgrade the running nginx in place and
+        roll back on regressions, instead of a plain `nginx -s reload`"""
+        stub_status_url: str | None = None
+        """`None` for `nginx_conf.stub_status_path` on `http_port` of localhost"""
+        probes: list[str] = []
+        """Loopback URLs timed every `interval`, `/` on `http_port` if empty"""
+        window: float = 30
+        """Seconds sampled before and after the switch"""
+        interval: float = 1
+        max_latency_ratio: float = 1.5
+        """Largest allowed p99 probe latency, after / before"""
+        latency_slack: float = 0.005
+        """Seconds of p99 growth never counted as a regression"""
+        max_error_rate: float = 0.01
+        """Largest allowed rise of the failed probe fraction"""
+        min_throughput_ratio: float = 0.7
+        """Smallest allowed `stub_status` requests/s, after / before"""
+        min_requests_per_second: float = 5
+        """Less traffic than this before the switch is too little to compare"""
+        backup_dir: Path = Path("/var/lib/nginx_install/previous")
+        """Where install keeps the previous binary and modules"""
+
     version: str = "0.0.1"
     network: NetworkConfig = Field(default_factory=NetworkConfig)
     logging: LoggingConfig = Field(default_factory=LoggingConfig)
+    build: BuildConfig = Field(default_factory=BuildConfig)
+    cache: CacheConfig = Field(default_factory=CacheConfig)
+    metrics: MetricsConfig = Field(default_factory=MetricsConfig)
+    nginx_conf: NginxConfConfig = Field(default_factory=NginxConfConfig)
+    precompress: PrecompressConfig = Field(default_factory=PrecompressConfig)
+    luac: LuacConfig = Field(default_factory=LuacConfig)
+    systemd: SystemdConfig = Field(default_factory=SystemdConfig)
+    health: HealthConfig = Field(default_factory=HealthConfig)
     pymodule_paths: list[Path] = []
     core: NginxInstaller = Field(default_factory=NginxInstaller)
     installers: list[BaseInstaller] = Field(
-        default_factory=lambda: [t() for t in _non_core_installer_types])
+        default_factory=lambda: [
+            t() for t in installer_pkg._non_core_installer_types])
 
     @field_validator("pymodule_paths", mode="after")
     def add_pymodule_paths(cls, v: list[Path]):
@@ -1,22 +1,46 @@
-import httpx
+from __future__ import annotations
+
 import io
 import subprocess
 import logging
 import asyncio
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Callable
 from pathlib import Path
 from getpass import getuser
 from concurrent.futures import ThreadPoolExecutor
 from urllib.request import getproxies
 from rich.progress import Progress
-from vermils.io import aio
 from vermils.gadgets.monologger import MonoLogger
+from .build_cache import BuildCache
+from .metrics import Metrics
 if TYPE_CHECKING:
+    import httpx
     from .config import Config
 else:
     Config = None
 
 
+def make_client(cfg: Config) -> httpx.AsyncClient:
+    """HTTP client honouring `cfg.network` and the system proxies"""
+    import httpx
+    proxy = cfg.network.proxy
+    sys_proxies = getproxies()
+    if proxy is None:
+        if "http" in sys_proxies:
+            proxy = sys_proxies["http"]
+        if "https" in sys_proxies:
+            proxy = sys_proxies["https"]
+    elif proxy.strip() == '':
+        proxy = None
+
+    return httpx.AsyncClient(
+        headers={"User-Agent": cfg.network.user_agent},
+        trust_env=False,
+        proxy=proxy,
+        **cfg.network.extra
+    )
+
+
 class Result:
     def __init__(
             self,
@@ -70,6 +94,8 @@ class Context:
             verbose: bool,
             quiet: bool,
             user: str,
+            config_path: Path | None = None,
+            fixed_build_dir: bool = True,
     ):
         self.cfg = cfg
         self.core = cfg.core
@@ -80,23 +106,10 @@ class Context:
         self.quiet = quiet
         self.user = user
         """User who runs the script"""
+        self.config_path = config_path
+        """Where `cfg` was loaded from, `None` if built in code"""
 
-        proxy = cfg.network.proxy
-        sys_proxies = getproxies()
-        if proxy is None:
-            if "http" in sys_proxies:
-                proxy = sys_proxies["http"]
-            if "https" in sys_proxies:
-                proxy = sys_proxies["https"]
-        elif proxy.strip() == '':
-            proxy = None
-
-        self.client = httpx.AsyncClient(
-            headers={"User-Agent": cfg.network.user_agent},
-            trust_env=False,
-            proxy=proxy,
-            **cfg.network.extra
-        )
+        self._client: httpx.AsyncClient | None = None
 
         log_level = "DEBUG" if verbose else cfg.logging.level
         formatter = logging.Formatter(cfg.logging.format)
@@ -115,6 +128,24 @@ class Context:
 
         self._executor = ThreadPoolExecutor(max_workers=32)
 
+        self.metrics = Metrics()
+        """Structured measurements of this run, written out by `__main__`"""
+
+        self.cache = BuildCache(
+            self, cfg.cache.dir, cfg.cache.enabled, fixed_build_dir)
+        """Persistent configure caches, see `BuildCache`"""
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """HTTP client, created (and `httpx` imported) on first use"""
+        if self._client is None:
+            self._client = make_client(self.cfg)
+        return self._client
+
+    @client.setter
+    def client(self, client: httpx.AsyncClient):
+        self._client = client
+
     @property
     def nginx_src_dir(self) -> Path:
         return self.build_dir / "nginx"
@@ -131,6 +162,7 @@ class Context:
         shell: bool = True,
         run_in_dry: bool = False,
         user: str | None = None,
+        on_line: Callable[[str], None] | None = None,
         **kw
     ):
         """
@@ -139,6 +171,8 @@ class Context:
         :param cmds: Command to run
         :param cwd: Current working directory
         :param shell: Run command in shell
+        :param on_line: Called with every stdout line as it arrives,
+            from a worker thread
         :param kw: Additional keyword arguments to pass to subprocess.Popen
 
         :return: Result
@@ -149,7 +183,7 @@ class Context:
             lambda: self.sync_run_cmd(
                 cmds, cwd,
                 shell=shell, run_in_dry=run_in_dry, user=user,
-                **kw
+                on_line=on_line, **kw
             )
         )
 
@@ -161,6 +195,7 @@ class Context:
         shell: bool = True,
         run_in_dry: bool = False,
         user: str | None = None,
+        on_line: Callable[[str], None] | None = None,
         **kw
     ):
         if isinstance(cwd, Path):
@@ -178,6 +213,7 @@ class Context:
         if self.dry_run and not run_in_dry:
             return Result(0, None, None, cmds)
 
+        self.metrics.incr("commands")
         stdout = subprocess.PIPE
         stderr = subprocess.PIPE
         if shell:
@@ -195,6 +231,8 @@ class Context:
             if isinstance(val, bytes):
                 val = val.decode()
             out_io.write(val)
+            if on_line is not None:
+                on_line(val)
             if not self.quiet and self.verbose:
                 print(val, end='')
 
@@ -212,17 +250,28 @@ class Context:
             path: Path | str,
             *,
             title: str = "Downloading",
+            headers: dict[str, str] | None = None,
             run_in_dry: bool = True
-    ):
+    ) -> httpx.Headers | None:
+        """
+        Stream `url` into `path`, return the response headers
+
+        With conditional `headers` such as `If-Modified-Since`, a
+         `304 Not Modified` leaves `path` untouched and returns `None`.
+        """
         if self.dry_run and not run_in_dry:
             self.print(f"Download {url} to {path}")
-            return
+            return None
+
+        from vermils.io import aio
 
         task = self.progress.add_task(title, total=100000)
-        async with (
-            self.client.stream("GET", url, follow_redirects=True) as r,
-            aio.open(str(path), "wb") as f
-        ):
+        async with self.client.stream(
+            "GET", url, headers=headers, follow_redirects=True
+        ) as r:
+            if r.status_code == 304:
+                self.progress.remove_task(task)
+                return None
             if r.status_code != 200:
                 info = await r.aread()
                 self.logger.error(
@@ -233,15 +282,19 @@ class Context:
             self.progress.update(
                 task, total=int(r.headers.get("content-length", 100000)))
 
-            async for chunk in r.aiter_bytes():
-                await f.write(chunk)
-                self.progress.update(task, advance=len(chunk))
+            self.metrics.incr("downloads")
+            async with aio.open(str(path), "wb") as f:
+                async for chunk in r.aiter_bytes():
+                    await f.write(chunk)
+                    self.progress.update(task, advance=len(chunk))
+                    self.metrics.incr("downloaded_bytes", len(chunk))
 
             async def delay_delete(task):
                 await asyncio.sleep(1)
                 self.progress.remove_task(task)
             asyncio.get_running_loop().create_task(  # type: ignore[unused-awaitable]
                 delay_delete(task))
+            return r.headers
 
     async def git_clone(
             self,
@@ -252,6 +305,7 @@ class Context:
             run_in_dry: bool = True
     ):
         _ = title  # avoid unused variable warning
+        from vermils.io import aio
         if await aio.path.exists(path):
             self.logger.debug("%s: Already cloned", path)
             if not allow_existing:
@@ -265,6 +319,7 @@ class Context:
         rs.raise_for_returncode()
 
     async def has_core_built(self):
+        from vermils.io import aio
         if self.core.flavor == "openresty":
             return await aio.path.exists(self.nginx_src_dir / "build")
         return await aio.path.exists(self.nginx_src_dir / "objs" / "nginx")
@@ -0,0 +1,287 @@
+"""
+Health gate around switching the running nginx to a new binary
+
+`install --reload` samples `stub_status` and probe URLs on loopback for
+ `health.window` seconds, upgrades the running master in place (`USR2`,
+ then `WINCH` to retire the old workers) and samples again. If
+ throughput, probe errors or p99 latency regress past the `health`
+ thresholds, the previous binary and modules are put back on disk, the
+ old master, still running, starts its workers again and the new one
+ quits. Otherwise the old master quits.
+"""
+from __future__ import annotations
+
+import os
+import re
+import time
+import shutil
+import signal
+import asyncio
+from pathlib import Path
+from typing import NamedTuple, TYPE_CHECKING
+from .utils import replace_atomic
+if TYPE_CHECKING:
+    import httpx
+    from .config import Config
+    from .context import Context
+
+stub_re = re.compile(
+    r"Active connections:\s*(\d+).*?\n\s*(\d+)\s+(\d+)\s+(\d+)", re.S)
+
+
+class StubStatus(NamedTuple):
+    active: int
+    accepts: int
+    handled: int
+    requests: int
+
+
+def parse_stub_status(text: str) -> StubStatus:
+    m = stub_re.search(text)
+    if m is None:
+        raise ValueError(f"Not a stub_status page: {text[:80]!r}")
+    return StubStatus(*map(int, m.groups()))
+
+
+def _percentile(values: list[float], q: float) -> float:
+    """Nearest-rank percentile, 0 for no values"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Window(NamedTuple):
+    seconds: float
+    requests: int
+    """`stub_status` requests handled meanwhile, probes included"""
+    probes: int
+    errors: int
+    """Probes failing to connect or answered with 4xx/5xx"""
+    latencies: list[float]
+
+    @property
+    def rps(self) -> float:
+        return self.requests / self.seconds if self.seconds else 0.0
+
+    @property
+    def error_rate(self) -> float:
+        return self.errors / self.probes if self.probes else 0.0
+
+    @property
+    def p50(self) -> float:
+        return _percentile(self.latencies, 0.5)
+
+    @property
+    def p99(self) -> float:
+        return _percentile(self.latencies, 0.99)
+
+    def __str__(self) -> str:
+        return (f"{self.rps:.1f} req/s, {self.errors}/{self.probes} probes "
+                f"failed, p50 {self.p50 * 1000:.1f} ms, "
+                f"p99 {self.p99 * 1000:.1f} ms")
+
+
+def urls(cfg: Config) -> tuple[str | None, list[str]]:
+    """The `stub_status` URL, if any, and the probe URLs"""
+    conf = cfg.nginx_conf
+    base = f"http://127.0.0.1:{conf.http_port}"
+    status = cfg.health.stub_status_url
+    if status is None and conf.stub_status_path and \
+            "--with-http_stub_status_module" in cfg.core.configure_opts:
+        status = base + conf.stub_status_path
+    return status, cfg.health.probes or [base + '/']
+
+
+async def sample(client: httpx.AsyncClient, status_url: str | None,
+                 probes: list[str], window: float, interval: float) -> Window:
+    """Time every probe and read `stub_status` each `interval` for `window`"""
+    import httpx
+    first = last = None
+    latencies = list[float]()
+    count = errors = 0
+    start = time.monotonic()
+    while True:
+        tick = time.monotonic()
+        for url in probes:
+            count += 1
+            t0 = time.perf_counter()
+            try:
+                r = await client.get(url)
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - t0)
+            if r.status_code >= 400:
+                errors += 1
+        if status_url is not None:
+            try:
+                r = await client.get(status_url)
+                st = parse_stub_status(r.text)
+                first = first or (time.monotonic(), st)
+                last = (time.monotonic(), st)
+            except (httpx.HTTPError, ValueError):
+                pass
+        if time.monotonic() - start >= window:
+            break
+        await asyncio.sleep(max(0.0, interval - (time.monotonic() - tick)))
+
+    seconds = time.monotonic() - start
+    requests = 0
+    if first is not None and last is not None and last[0] > first[0]:
+        seconds = last[0] - first[0]
+        requests = last[1].requests - first[1].requests
+    return Window(seconds, requests, count, errors, latencies)
+
+
+def compare(before: Window, after: Window, cfg: Config) -> list[str]:
+    """Regressions past the `health` thresholds, empty if none"""
+    h = cfg.health
+    ret = list[str]()
+    if after.error_rate - before.error_rate > h.max_error_rate:
+        ret.append(f"probe error rate {before.error_rate:.1%} -> "
+                   f"{after.error_rate:.1%}")
+    if before.latencies and after.latencies and \
+            after.p99 > before.p99 * h.max_latency_ratio and \
+            after.p99 - before.p99 > h.latency_slack:
+        ret.append(f"p99 latency {before.p99 * 1000:.1f} -> "
+                   f"{after.p99 * 1000:.1f} ms")
+    if before.rps >= h.min_requests_per_second and \
+            after.rps < before.rps * h.min_throughput_ratio:
+        ret.append(f"throughput {before.rps:.1f} -> {after.rps:.1f} req/s")
+    return ret
+
+
+def backup(cfg: Config) -> bool:
+    """Keep the installed binary and modules in `health.backup_dir`"""
+    core = cfg.core
+    if not core.sbin_path.is_file():
+        return False
+    d = cfg.health.backup_dir
+    shutil.rmtree(d, ignore_errors=True)
+    (d / "modules").mkdir(parents=True)
+    shutil.copy2(core.sbin_path, d / "nginx")
+    for so in core.modules_path.glob("*.so"):
+        shutil.copy2(so, d / "modules" / so.name)
+    return True
+
+
+def restore(cfg: Config) -> bool:
+    """Put the binary and modules `backup` kept back in place"""
+    core = cfg.core
+    d = cfg.health.backup_dir
+    if not (d / "nginx").is_file():
+        return False
+    replace_atomic(d / "nginx", core.sbin_path, 0o755)
+    for so in (d / "modules").glob("*.so"):
+        replace_atomic(so, core.modules_path / so.name)
+    # Modules the failed install added, the previous config loads none
+    for so in core.modules_path.glob("*.so"):
+        if not (d / "modules" / so.name).exists():
+            so.unlink()
+    return True
+
+
+def read_pid(path: Path) -> int | None:
+    """PID in `path` if that process is alive"""
+    try:
+        pid = int(path.read_text().split()[0])
+        os.kill(pid, 0)
+    except (OSError, ValueError, IndexError):
+        return None
+    return pid
+
+
+async def _upgrade(cfg: Config, old: int, timeout: float = 10) -> int:
+    """Start a master with the installed binary, retire the old workers"""
+    os.kill(old, signal.SIGUSR2)
+    deadline = time.monotonic() + timeout
+    while (new := read_pid(cfg.core.pid_path)) in (None, old):
+        if time.monotonic() > deadline:
+            raise RuntimeError(
+                f"No new master within {timeout}s, see {cfg.core.error_log_path}")
+        await asyncio.sleep(0.1)
+    os.kill(old, signal.SIGWINCH)
+    return new
+
+
+async def _abort_upgrade(cfg: Config, old: int,
+                         timeout: float = 10) -> int | None:
+    """
+    Put the previous build back after `_upgrade` timed out, and quit the
+     new master if it starts late after all; returns its pid. The old
+     workers never stopped.
+    """
+    restore(cfg)
+    # Renamed by the old master on `USR2`, and back once the new one exits
+    oldbin = Path(f"{cfg.core.pid_path}.oldbin")
+    deadline = time.monotonic() + timeout
+    while time.monotonic() <= deadline:
+        pid = read_pid(cfg.core.pid_path)
+        if pid not in (None, old):
+            os.kill(pid, signal.SIGQUIT)
+            return pid
+        if pid == old and not oldbin.exists():
+            return None
+        await asyncio.sleep(0.1)
+    return None
+
+
+async def _rollback(cfg: Config, old: int, new: int):
+    # The old master still runs the previous build, this is for its next
+    # start. After `WINCH`, `HUP` starts its workers again without
+    # re-reading the config.
+    restore(cfg)
+    os.kill(old, signal.SIGHUP)
+    os.kill(new, signal.SIGQUIT)
+
+
+async def gate(ctx: Context) -> bool:
+    """
+    Switch the running nginx to the installed binary under watch
+
+    Returns whether it stays, after rolling back if not.
+    """
+    import httpx
+    cfg = ctx.cfg
+    h = cfg.health
+    old = read_pid(cfg.core.pid_path)
+    if old is None:
+        raise RuntimeError(f"nginx is not running ({cfg.core.pid_path})")
+    if ctx.dry_run:
+        ctx.print(f"Would upgrade nginx master {old} in place under watch")
+        return True
+
+    status_url, probes = urls(cfg)
+    async with httpx.AsyncClient(
+            timeout=5, verify=False, trust_env=False) as client:
+        ctx.logger.info("Sampling %s for %ss before the switch", probes, h.window)
+        before = await sample(client, status_url, probes, h.window, h.interval)
+        ctx.print(f"Before: {before}")
+        try:
+            new = await _upgrade(cfg, old)
+        except RuntimeError as e:
+            ctx.print(f"Upgrade failed, rolling back: {e}")
+            late = await _abort_upgrade(cfg, old)
+            if late is not None:
+                ctx.logger.warning("Quit new master %d, it started late", late)
+            return False
+        ctx.logger.info("Master %d replaced %d, sampling for %ss",
+                        new, old, h.window)
+        after = await sample(client, status_url, probes, h.window, h.interval)
+        ctx.print(f"After:  {after}")
+
+    for name, w in (("before", before), ("after", after)):
+        ctx.metrics.observe("health_requests_per_second", w.rps, window=name)
+        ctx.metrics.observe("health_error_rate", w.error_rate, window=name)
+        ctx.metrics.observe("health_p99_seconds", w.p99, window=name)
+
+    regressions = compare(before, after, cfg)
+    if not regressions:
+        os.kill(old, signal.SIGQUIT)
+        return True
+    for r in regressions:
+        ctx.print(f"Regression: {r}")
+    ctx.print("Rolling back to the previous binary and modules")
+    await _rollback(cfg, old, new)
+    return False
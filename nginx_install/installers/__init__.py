@@ -1,29 +1,76 @@
-from .base import BaseInstaller, BuiltinInstaller, from_dict
-from .core import NginxInstaller
-from .openssl import OpenSSLInstaller
-from .zlib_cf import ZlibCFInstaller
-from .headers_more import HeadersMoreInstaller
-from .fancyindex import FancyIndexInstaller
-from .http_tls_dyn_size import DynamicResizeTLSInstaller
-from .brotli import BrotliInstaller
-from .geoip2 import GeoIP2Installer
-from .general_git import GeneralGitInstaller
-from .subfilter import SubFilterInstaller
-from .ndk import NginxDevKitInstaller
+from importlib import import_module
+from typing import TYPE_CHECKING
+from .base import BaseInstaller, BuiltinInstaller, from_dict, get_cls_from_dict
 
-_non_core_installer_types: list[type] = [
-    OpenSSLInstaller,
-    HeadersMoreInstaller,
-    FancyIndexInstaller,
-    DynamicResizeTLSInstaller,
-    BrotliInstaller,
-    GeoIP2Installer,
-    ZlibCFInstaller,
-    GeneralGitInstaller,
-    SubFilterInstaller,
-    NginxDevKitInstaller,
+if TYPE_CHECKING:
+    from .core import NginxInstaller
+    from .openssl import OpenSSLInstaller
+    from .zlib_cf import ZlibCFInstaller
+    from .headers_more import HeadersMoreInstaller
+    from .fancyindex import FancyIndexInstaller
+    from .http_tls_dyn_size import DynamicResizeTLSInstaller
+    from .brotli import BrotliInstaller
+    from .geoip2 import GeoIP2Installer
+    from .general_git import GeneralGitInstaller
+    from .subfilter import SubFilterInstaller
+    from .ndk import NginxDevKitInstaller
+    from .tls_lib import TLSLibInstaller
+    from .allocator import AllocatorInstaller
+    from .zlib_ng import ZlibNgInstaller
+    from .pcre2 import PCRE2Installer
+    from .sysctl_tuning import SysctlTuningInstaller
+
+# Installer modules are only imported when their class is first looked up,
+# so loading a config pulls in just the installers it names.
+_installer_modules = {
+    "NginxInstaller": "core",
+    "OpenSSLInstaller": "openssl",
+    "ZlibCFInstaller": "zlib_cf",
+    "HeadersMoreInstaller": "headers_more",
+    "FancyIndexInstaller": "fancyindex",
+    "DynamicResizeTLSInstaller": "http_tls_dyn_size",
+    "BrotliInstaller": "brotli",
+    "GeoIP2Installer": "geoip2",
+    "GeneralGitInstaller": "general_git",
+    "SubFilterInstaller": "subfilter",
+    "NginxDevKitInstaller": "ndk",
+    "TLSLibInstaller": "tls_lib",
+    "AllocatorInstaller": "allocator",
+    "ZlibNgInstaller": "zlib_ng",
+    "PCRE2Installer": "pcre2",
+    "SysctlTuningInstaller": "sysctl_tuning",
+}
+
+_non_core_installer_names = [
+    "OpenSSLInstaller",
+    "HeadersMoreInstaller",
+    "FancyIndexInstaller",
+    "DynamicResizeTLSInstaller",
+    "BrotliInstaller",
+    "GeoIP2Installer",
+    "ZlibCFInstaller",
+    "GeneralGitInstaller",
+    "SubFilterInstaller",
+    "NginxDevKitInstaller",
+    "TLSLibInstaller",
+    "AllocatorInstaller",
+    "ZlibNgInstaller",
+    "PCRE2Installer",
+    "SysctlTuningInstaller",
 ]
 
+
+def __getattr__(name: str):
+    if name == "_non_core_installer_types":
+        return [__getattr__(n) for n in _non_core_installer_names]
+    modname = _installer_modules.get(name)
+    if modname is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    cls = getattr(import_module(f".{modname}", __name__), name)
+    globals()[name] = cls
+    return cls
+
+
 __all__ = [
     "BaseInstaller",
     "BuiltinInstaller",
@@ -38,6 +85,12 @@ __all__ = [
     "GeneralGitInstaller",
     "SubFilterInstaller",
     "NginxDevKitInstaller",
+    "TLSLibInstaller",
+    "AllocatorInstaller",
+    "ZlibNgInstaller",
+    "PCRE2Installer",
+    "SysctlTuningInstaller",
     "from_dict",
+    "get_cls_from_dict",
     "_non_core_installer_types",
 ]
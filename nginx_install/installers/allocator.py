@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+from pathlib import Path
+from multiprocessing import cpu_count
+from typing import Literal, TYPE_CHECKING
+from .base import BuiltinInstaller
+from ..utils import MiB
+if TYPE_CHECKING:
+    from ..context import Context
+
+VERSIONS = {"jemalloc": "5.3.0", "mimalloc": "2.1.7"}
+PACKAGES = {"jemalloc": "libjemalloc-dev", "mimalloc": "libmimalloc-dev"}
+
+
+class AllocatorInstaller(BuiltinInstaller):
+    """
+    Link nginx against jemalloc or mimalloc instead of glibc malloc
+
+    Long-lived workers doing brotli, Lua or big `proxy_buffers` fragment
+     glibc's arenas and their RSS creeps up, see `scripts/alloc_soak.py`.
+    """
+    enabled: bool = False
+    library: Literal["jemalloc", "mimalloc"] = "jemalloc"
+    version: str = ''
+    """Release to build into `/usr/local`, empty for `VERSIONS[library]`"""
+    system: bool = False
+    """Install the distribution's package instead of building"""
+
+    @property
+    def build_size(self) -> int:
+        return 64 * MiB
+
+    def expected_ld_opts(self) -> list[str]:
+        lib = f"-l{self.library}"
+        if self.system:
+            return [lib]
+        return ["-L/usr/local/lib", lib]
+
+    async def _build(self, ctx: Context):
+        v = self.version or VERSIONS[self.library]
+        src = ctx.build_dir / f"{self.library}-{v}"
+        if self.library == "jemalloc":
+            url = ("https://github.com/jemalloc/jemalloc/releases/download/"
+                   f"{v}/jemalloc-{v}.tar.bz2")
+            tar_flags = "-xjf"
+            build_cmd = ("./configure --prefix=/usr/local --disable-doc "
+                         "&& make -j {jobs}")
+        else:
+            url = f"https://github.com/microsoft/mimalloc/archive/refs/tags/v{v}.tar.gz"
+            tar_flags = "-xzf"
+            build_cmd = ("cmake -B out -DCMAKE_BUILD_TYPE=Release "
+                         "-DCMAKE_INSTALL_PREFIX=/usr/local -DMI_BUILD_TESTS=OFF "
+                         "-DMI_BUILD_STATIC=OFF -DMI_BUILD_OBJECT=OFF "
+                         "&& make -C out -j {jobs}")
+
+        # Any job count builds the same tree
+        key = await ctx.cache.key(self.library, v, build_cmd)
+        if not await ctx.cache.restore_tree(self.library, key, src):
+            tar_path = ctx.build_dir / Path(url).name
+            await ctx.download(url, tar_path, title=f"Get {self.library} source")
+            rs = await ctx.run_cmd(
+                f"tar {tar_flags} '{tar_path}' -C '{ctx.build_dir}' "
+                f"&& cd '{src}' && {build_cmd.format(jobs=cpu_count())}")
+            rs.raise_for_returncode()
+            # The built tree, so a cache hit only needs `make install`
+            await ctx.cache.store_tree(self.library, key, src)
+
+        install_dir = src if self.library == "jemalloc" else src / "out"
+        rs = await ctx.run_cmd(f"make -C '{install_dir}' install && ldconfig")
+        rs.raise_for_returncode()
+
+    async def verify(self, ctx: Context, binary: Path):
+        """Raise if `binary` does not load the allocator"""
+        if ctx.dry_run:
+            return
+        rs = await ctx.run_cmd(f"ldd '{binary}'", run_in_dry=True)
+        rs.raise_for_returncode()
+        if f"lib{self.library}" not in rs.get_output_str():
+            raise RuntimeError(
+                f"{self}: {binary} does not link lib{self.library}, "
+                "check `ldd` and the --with-ld-opt in `nginx -V`")
+
+        rs = await ctx.run_cmd(f"'{binary}' -V 2>&1", run_in_dry=True)
+        rs.raise_for_returncode()
+        if f"-l{self.library}" not in rs.get_output_str():
+            raise RuntimeError(f"{self}: `{binary} -V` lacks -l{self.library}")
+        ctx.logger.info("%s: nginx is linked against %s", self, self.library)
+
+    async def prepare(self, ctx):
+        logger = ctx.logger
+        logger.debug("%s: Preparing %s", self, self.library)
+        task = ctx.progress.add_task(f"Prepare {self.library}", total=2)
+
+        if self.system:
+            rs = await ctx.run_cmd(
+                f"apt-get install -y {PACKAGES[self.library]}")
+            rs.raise_for_returncode()
+        else:
+            await self._build(ctx)
+        ctx.progress.update(task, advance=1)
+
+        ctx.core.ld_opts.extend(self.expected_ld_opts())
+        ctx.progress.update(task, advance=1)
+
+    async def build(self, ctx):
+        # `-V` runs it, so not a `march_variants` entry this CPU lacks
+        binary = ctx.core.runnable_binary(ctx)
+        if binary is not None:
+            await self.verify(ctx, binary)
+
+    async def install(self, ctx):
+        await self.verify(ctx, ctx.core.sbin_path)
+
+    async def uninstall(self, ctx):
+        # Other programs may link the library too, leave it installed
+        ...
+
+    async def clean(self, ctx):
+        ...
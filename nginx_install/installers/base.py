@@ -3,9 +3,13 @@ from __future__ import annotations
 import inspect
 from abc import ABC, abstractmethod
 from importlib import import_module
+from typing import TYPE_CHECKING
 from pydantic import BaseModel, ConfigDict
 from pydantic import model_serializer, computed_field
-from ..context import Context
+from ..utils import MiB
+if TYPE_CHECKING:
+    from ..context import Context
+    from ..config import Config
 
 
 def get_cls_from_dict(data: dict) -> type[BaseInstaller]:
@@ -36,6 +40,35 @@ class BaseInstaller(ABC, BaseModel):
             return None
         return mod.__name__
 
+    @property
+    def build_size(self) -> int:
+        """Rough peak size in bytes this installer adds to `build_dir`"""
+        return 32 * MiB
+
+    def expected_opts(self) -> list[str] | None:
+        """
+        `configure` options this installer adds to the core, with paths
+         relative to the nginx source dir. Used by `plan` to compare with
+         `nginx -V`, `None` if the installer's effect can't be seen there.
+        """
+        return None
+
+    def expected_cc_opts(self) -> list[str]:
+        """Flags this installer adds to `NginxInstaller.cc_opts`, for `plan`"""
+        return []
+
+    def expected_ld_opts(self) -> list[str]:
+        """Flags this installer adds to `NginxInstaller.ld_opts`, for `plan`"""
+        return []
+
+    def drift(self, cfg: Config) -> list[str]:
+        """
+        What `install` would change besides the binary and its modules,
+         e.g. files generated from the config. Used by `plan`, so an
+         unchanged binary doesn't leave them stale.
+        """
+        return []
+
     @abstractmethod
     async def prepare(self, ctx: Context):
         ...
@@ -1,26 +1,40 @@
+import shlex
 from os.path import relpath
+from multiprocessing import cpu_count
 from .base import BuiltinInstaller
+from ..utils import MiB
 
 
 class BrotliInstaller(BuiltinInstaller):
     enabled: bool = False
     dynamic: bool = False
+    native: bool = False
+    """Link static libs of the vendored brotli built with the core's
+    `cc_opts` instead of the distribution's `libbrotli-dev`"""
+
+    @property
+    def build_size(self) -> int:
+        return 96 * MiB
 
     @property
     def ngx_modulenames(self) -> tuple[str, ...]:
         return ("ngx_http_brotli_filter_module",
                 "ngx_http_brotli_static_module")
 
+    def expected_opts(self) -> list[str]:
+        return [f"--add{'-dynamic' if self.dynamic else ''}-module=../ngx_brotli"]
+
     async def prepare(self, ctx):
         logger = ctx.logger
         path = ctx.build_dir / "ngx_brotli"
         logger.debug("%s: Cloning Brotli into %s", self, path)
         task = ctx.progress.add_task("Prepare Brotli", total=2)
 
-        rs = await ctx.run_cmd(
-            "apt-get install -y libbrotli-dev"
-        )
-        rs.raise_for_returncode()
+        if not self.native:
+            rs = await ctx.run_cmd(
+                "apt-get install -y libbrotli-dev"
+            )
+            rs.raise_for_returncode()
 
         ctx.progress.update(task, advance=1)
 
@@ -42,6 +56,9 @@ class BrotliInstaller(BuiltinInstaller):
             )
             rs.raise_for_returncode()
 
+        if self.native:
+            await self._build_native(ctx, path / "deps" / "brotli")
+
         ctx.core.configure_opts.append(
             f"--add{'-dynamic' if self.dynamic else ''}-module="
             f"{relpath(path, ctx.nginx_src_dir)}"
@@ -49,6 +66,33 @@ class BrotliInstaller(BuiltinInstaller):
 
         ctx.progress.update(task, advance=1)
 
+    async def _build_native(self, ctx, src):
+        """
+        Static `libbrotlienc`/`libbrotlicommon` in `deps/brotli/out`,
+         where ngx_brotli's `config` links them from before the system ones
+        """
+        out = src / "out"
+        rs = await ctx.run_cmd("git rev-parse HEAD", cwd=src, run_in_dry=True)
+        head = rs.get_output_str().strip()
+        # Built once, so for the most compatible of any `march_variants`
+        cflags = ' '.join(ctx.core.portable_cc_opts)
+        key = await ctx.cache.key("brotli", head, cflags)
+        if head and await ctx.cache.restore_tree("brotli", key, out):
+            return
+
+        ctx.logger.debug("%s: Building brotli with %s", self, cflags)
+        rs = await ctx.run_cmd(
+            "cmake -B out -DCMAKE_BUILD_TYPE=Release -DBUILD_SHARED_LIBS=OFF "
+            "-DCMAKE_POSITION_INDEPENDENT_CODE=ON "
+            f"-DCMAKE_C_FLAGS={shlex.quote(cflags)} "
+            f"&& cmake --build out -j {cpu_count()} --target brotlienc",
+            cwd=src)
+        rs.raise_for_returncode()
+        if not ctx.dry_run and not (out / "libbrotlienc.a").is_file():
+            raise RuntimeError(f"{self}: {out} has no libbrotlienc.a")
+        if head:
+            await ctx.cache.store_tree("brotli", key, out)
+
     async def build(self, ctx):
         ...
 
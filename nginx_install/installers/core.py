@@ -1,14 +1,21 @@
-import httpx
-import bs4
+from __future__ import annotations
+
+import shlex
+import asyncio
+import hashlib
 import re
 import multiprocessing as mp
-from typing import Literal
-from semantic_version import Version, SimpleSpec
+from typing import Literal, TYPE_CHECKING
 from pydantic import Field
 from pathlib import Path
-from vermils.io import aio
 from .base import BuiltinInstaller
-from ..context import Context, Result
+from ..make_progress import ConfigureProgress, MakeProgress, count_units
+from ..utils import MiB
+if TYPE_CHECKING:
+    import httpx
+    from semantic_version import Version, SimpleSpec
+    from ..context import Context, Result
+    from ..config import Config
 
 
 ver_re = re.compile(r".*?\-(\d+\.\d+\.\d+)(\.\d+)?(?:\.tar\.gz)?$")
@@ -43,6 +50,7 @@ class VersionSheet:
             case "stable":
                 return v_sheet.stable
             case _:
+                from semantic_version import SimpleSpec
                 v_spec = SimpleSpec(v_spec_str)
                 return v_sheet.get_latest_matching(v_spec)
 
@@ -120,16 +128,63 @@ class NginxInstaller(BuiltinInstaller):
             "-Wl,--gc-sections"
         ]
     )
+    ld_opts: list[str] = Field(default_factory=list)
+    luajit_xcflags: list[str] = Field(
+        default_factory=lambda: ["-DLUAJIT_ENABLE_GC64", "-march=native"])
+    """OpenResty only, extra `CFLAGS` for its bundled LuaJIT"""
+    march_variants: list[str] = []
+    """
+    `-march` targets to build one binary each for, from the most
+     compatible to the most specific, e.g. `[x86-64-v2, x86-64-v3,
+     x86-64-v4]` or named ones like `skylake`. Install picks the last one
+     the host CPU supports. Empty to build for `cc_opts` as is
+    """
+
+    @property
+    def build_size(self) -> int:
+        if self.flavor == "openresty":
+            return 384 * MiB
+        return 128 * MiB
 
     @property
     def config_path(self) -> Path:
         return self.config_prefix / self.config_name
 
+    @property
+    def portable_cc_opts(self) -> list[str]:
+        """`cc_opts` for libraries built once for all `march_variants`"""
+        if not self.march_variants:
+            return self.cc_opts
+        return self.for_march(self.march_variants[0]).cc_opts
+
+    def for_march(self, march: str) -> NginxInstaller:
+        """A copy building for `-march=<march>`, library options included"""
+        from ..march import march_re, with_march
+        return self.model_copy(update={
+            "cc_opts": with_march(self.cc_opts, march),
+            "luajit_xcflags": with_march(self.luajit_xcflags, march),
+            "configure_opts": [march_re.sub(f"-march={march}", o)
+                               for o in self.configure_opts],
+        })
+
+    def variant_root(self, ctx: Context, march: str) -> Path:
+        """`DESTDIR` the `march` variant is staged in by `make install`"""
+        return ctx.build_dir / "variants" / march
+
+    def variant_binary(self, ctx: Context, march: str) -> Path:
+        return self.variant_root(ctx, march) / self.sbin_path.relative_to('/')
+
     @property
     def build_options(self) -> list[str]:
         ret = self.configure_opts.copy()
-        for copt in self.cc_opts:
-            ret.append(f"--with-cc-opt={copt}")
+        if self.cc_opts:
+            # nginx keeps only the last `--with-cc-opt`, pass them all in one
+            ret.append(f"--with-cc-opt={' '.join(self.cc_opts)}")
+        if self.ld_opts:
+            ret.append(f"--with-ld-opt={' '.join(self.ld_opts)}")
+        if self.flavor == "openresty" and self.luajit_xcflags:
+            ret.append(
+                f"--with-luajit-xcflags={' '.join(self.luajit_xcflags)}")
         ret.append(f"--prefix={self.config_prefix}")
         ret.append(f"--sbin-path={self.sbin_path}")
         ret.append(f"--conf-path={self.config_path}")
@@ -153,8 +208,11 @@ class NginxInstaller(BuiltinInstaller):
 
     @staticmethod
     async def get_openresty_versions(client: httpx.AsyncClient | None = None):
+        import bs4
+        from semantic_version import Version
         openresty_release_page = "https://openresty.org/en/download.html"
         if client is None:
+            import httpx
             client = httpx.AsyncClient()
         r = await client.get(openresty_release_page, follow_redirects=True)
         r.raise_for_status()
@@ -188,8 +246,11 @@ class NginxInstaller(BuiltinInstaller):
 
     @staticmethod
     async def get_vanilla_versions(client: httpx.AsyncClient | None = None):
+        import bs4
+        from semantic_version import Version
         nginx_release_page = "https://nginx.org/en/download.html"
         if client is None:
+            import httpx
             client = httpx.AsyncClient()
         r = await client.get(nginx_release_page, follow_redirects=True)
         r.raise_for_status()
@@ -259,6 +320,14 @@ WantedBy=multi-user.target
             self._forbid_ndk(ctx, "OpenResty already has one")
             self._forbid_headers_more(ctx, "OpenResty already has one")
 
+        if any(i.enabled and i.classname == "TLSLibInstaller"
+               for i in ctx.cfg.installers):
+            self._forbid_openssl(ctx, "TLSLibInstaller provides the TLS library")
+
+        if any(i.enabled and i.classname == "ZlibNgInstaller"
+               for i in ctx.cfg.installers):
+            self._forbid_zlib_cf(ctx, "ZlibNgInstaller provides zlib")
+
         v_sheet = await self.get_versions(ctx.client)
         ctx.logger.debug(
             "Versions: %s (mainline), %s (stable), %s (legacies)",
@@ -271,6 +340,7 @@ WantedBy=multi-user.target
             download_url = f"https://nginx.org/download/nginx-{semversion}.tar.gz"
             nginx_version = f"nginx-{semversion}"
         elif self.flavor == "openresty":
+            from semantic_version import Version
             ver_str = str(semversion).replace("-", ".")
             if semversion <= Version("1.9.7-2"):
                 nginx_version = f"ngx_openresty-{ver_str}"
@@ -297,6 +367,12 @@ WantedBy=multi-user.target
             "libgeoip-dev", "cmake", "libperl-dev"
         ]
 
+        if any(i.enabled and i.classname == "PCRE2Installer"
+               for i in ctx.cfg.installers):
+            # PCRE2 is compiled into nginx from source
+            packages.remove("libpcre3")
+            packages.remove("libpcre3-dev")
+
         ctx.logger.debug("%s: Installing packages: %s", self, packages)
         rs = await ctx.run_cmd(f"apt-get install -y {' '.join(packages)}")
 
@@ -325,36 +401,269 @@ WantedBy=multi-user.target
         ctx.logger.info("Nginx preparation completed")
         ctx.progress.update(task, advance=1)
 
+    def built_binary(self, ctx: Context) -> Path | None:
+        """The compiled nginx binary in `build_dir`, if any"""
+        src = ctx.nginx_src_dir
+        for p in (src / "objs" / "nginx", *src.glob("build/nginx-*/objs/nginx")):
+            if p.is_file():
+                return p
+        return None
+
+    def runnable_binary(self, ctx: Context) -> Path | None:
+        """
+        A compiled binary this CPU can run, if any
+
+        With `march_variants`, `built_binary` is the last, most specific
+         variant, so this is the variant install would pick instead.
+        """
+        if not self.march_variants:
+            return self.built_binary(ctx)
+        from ..march import host_flags, select
+        march = select(self.march_variants, host_flags())
+        if march is None:
+            return None
+        binary = self.variant_binary(ctx, march)
+        return binary if binary.is_file() else None
+
+    def unit_makefiles(self, ctx: Context) -> list[Path]:
+        """Makefiles whose object targets the core build compiles"""
+        src = ctx.nginx_src_dir
+        ret = [src / "objs" / "Makefile", *src.glob("build/nginx-*/objs/Makefile")]
+        for opt in self.configure_opts:
+            if opt.startswith("--with-openssl="):
+                ret.append(src / opt.split('=', 1)[1] / "Makefile")
+        return ret
+
+    async def configure_key(self, ctx: Context) -> str:
+        """
+        Cache key of `./configure` inputs: options, the (patched) source
+         and the `config` scripts of added modules
+        """
+        src = ctx.nginx_src_dir
+        h = hashlib.sha256()
+        files = sorted(f for f in (src / "src").rglob("*") if f.is_file())
+        for opt in self.configure_opts:
+            if opt.startswith(("--add-module=", "--add-dynamic-module=")):
+                files.append(src / opt.split('=', 1)[1] / "config")
+        for f in files:
+            h.update(str(f.relative_to(src) if f.is_relative_to(src) else f).encode())
+            try:
+                h.update(f.read_bytes())
+            except OSError:
+                pass
+        return await ctx.cache.key(
+            "nginx", self.flavor, h.hexdigest(), *self.build_options)
+
     async def build(self, ctx: Context):
         ctx.logger.info("Start building nginx")
-        task = ctx.progress.add_task("Build core", total=2)
+        variants = self.march_variants
+        task = ctx.progress.add_task(
+            "Build core", total=2 * max(len(variants), 1))
+
+        if not variants:
+            await self._compile(ctx, task)
+        # One after another in the same tree: nginx rebuilds bundled
+        # libraries such as PCRE2 in place whenever objs/Makefile changes
+        for march in variants:
+            ctx.logger.info("%s: Building the %s variant", self, march)
+            await self.for_march(march)._compile(ctx, task)
+            # Dynamic modules and OpenResty's LuaJIT are built for `march`
+            # too, stage everything `make install` would put in place
+            root = self.variant_root(ctx, march)
+            rs = await ctx.run_cmd(
+                f"make install DESTDIR='{root}'", cwd=str(ctx.nginx_src_dir))
+            rs.raise_for_returncode()
+
+        binary = self.built_binary(ctx)
+        if binary is not None:
+            ctx.metrics.set("binary_size_bytes", binary.stat().st_size)
+        if "--with-pcre-jit" in self.configure_opts and not ctx.dry_run:
+            binary = self.runnable_binary(ctx)
+            if binary is None:
+                ctx.logger.warning(
+                    "%s: This CPU runs none of %s, PCRE JIT is unchecked",
+                    self, variants)
+            else:
+                await self.verify_pcre_jit(ctx, binary)
+        if variants and not ctx.dry_run:
+            await self.bench_variants(ctx)
+
+        ctx.logger.info("Nginx build completed")
+
+    async def _compile(self, ctx: Context, task):
+        # OpenResty's configure also builds LuaJIT and friends, always rerun it.
+        # A restored tree would make bundled libraries of the previous
+        # variant look up to date, so variants always configure too.
+        reuse = False
+        key = ''
+        if (
+            self.flavor == "vanilla" and not self.march_variants
+            and not ctx.dry_run
+        ):
+            key = await self.configure_key(ctx)
+            reuse = (
+                ctx.cache.is_configured(ctx.nginx_src_dir, key)
+                or await ctx.cache.restore_tree("nginx", key, ctx.nginx_src_dir)
+            )
+
+        if reuse:
+            ctx.logger.info("%s: Inputs unchanged, skipping configure", self)
+        else:
+            rs = await ctx.run_cmd(
+                f"./configure {' '.join(map(shlex.quote, self.build_options))}",
+                cwd=str(ctx.nginx_src_dir),
+                on_line=ConfigureProgress(ctx, task, "Build core").feed,
+            )
+            rs.raise_for_returncode()
+            if key:
+                ctx.cache.mark_configured(ctx.nginx_src_dir, key)
+                await ctx.cache.store_tree("nginx", key, ctx.nginx_src_dir)
+
+        ctx.progress.update(task, description="Build core", advance=1)
+
+        jobs = mp.cpu_count()
+        make_progress = MakeProgress(
+            ctx, "Compile core",
+            count_units(self.unit_makefiles(ctx)), jobs)
         rs = await ctx.run_cmd(
-            f"./configure {' '.join(self.build_options)}",
-            cwd=str(ctx.nginx_src_dir)
+            f"make -j {jobs}", cwd=str(ctx.nginx_src_dir),
+            on_line=make_progress.feed,
         )
-
+        make_progress.finish()
+        rs.raise_for_returncode()
         ctx.progress.update(task, advance=1)
 
-        rs.raise_for_returncode()
-        rs = await ctx.run_cmd(f"make -j {mp.cpu_count()}", cwd=str(ctx.nginx_src_dir))
-        rs.raise_for_returncode()
+    async def bench_variants(self, ctx: Context):
+        """Smoke bench the variants this CPU runs, relative to the first"""
+        from ..march import host_flags, smoke_bench, supports
+        flags = host_flags()
+        results = []
+        for march in self.march_variants:
+            binary = self.variant_binary(ctx, march)
+            if not binary.is_file():
+                continue
+            if not supports(march, flags):
+                ctx.logger.info(
+                    "%s: Not benching %s, this CPU can't run it", self, march)
+                continue
+            try:
+                bench = await asyncio.to_thread(
+                    smoke_bench, binary, ctx.build_dir / "bench" / march, march)
+            except (OSError, RuntimeError) as e:
+                ctx.logger.warning(
+                    "%s: Smoke bench of %s failed: %s", self, march, e)
+                continue
+            ctx.metrics.observe("variant_requests_per_second", bench.rps,
+                                march=march)
+            base = results[0] if results else bench
+            gain = bench.rps / base.rps if base.rps else 1.0
+            ctx.logger.info("%s: %s %.2fx", self, bench, gain)
+            if results and gain < 1.02:
+                ctx.logger.warning(
+                    "%s: %s is no faster than %s here, "
+                    "consider dropping the variant", self, march, base.march)
+            results.append(bench)
+
+    async def install_variant(self, ctx: Context):
+        """
+        Put the compiled files of the best variant for this CPU in place
+
+        `make install` installed the last variant. The binary, dynamic
+         modules and any shared libraries of the chosen one replace its
+         files; the rest, e.g. configs and Lua sources, is the same for all.
+        """
+        from ..march import host_flags, select, staged_elf_files
+        from ..utils import replace_atomic
+        march = select(self.march_variants, host_flags())
+        if march is None:
+            raise RuntimeError(
+                f"{self}: This CPU runs none of {self.march_variants}")
+        ctx.logger.info("%s: Installing the %s variant", self, march)
+        ctx.metrics.labels["march"] = march
+        if ctx.dry_run:
+            return
+        root = self.variant_root(ctx, march)
+        files = staged_elf_files(root)
+        if self.variant_binary(ctx, march) not in files:
+            raise RuntimeError(f"{self}: {root} has no staged nginx")
+        for f in files:
+            dest = Path('/') / f.relative_to(root)
+            ctx.logger.debug("%s: Installing %s", self, dest)
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            replace_atomic(f, dest, f.stat().st_mode & 0o7777)
+
+    async def verify_pcre_jit(self, ctx: Context, binary: Path):
+        """
+        Raise if `binary` ignores `pcre_jit on`
+
+        nginx only warns when it was built without JIT support or the
+         PCRE library it links lacks it, so test a minimal config.
+        """
+        if ctx.dry_run:
+            return
+        prefix = ctx.build_dir / "pcre-jit-check"
+        prefix.mkdir(exist_ok=True)
+        conf = prefix / "nginx.conf"
+        conf.write_text(
+            "user root;\npid nginx.pid;\npcre_jit on;\nevents {}\n")
+        rs = await ctx.run_cmd(
+            f"'{binary}' -t -q -e stderr -p '{prefix}' -c '{conf}' 2>&1",
+            run_in_dry=True)
+        out = rs.get_output_str()
+        if rs.failed:
+            raise RuntimeError(f"{self}: `{binary} -t` failed: {out.strip()}")
+        if "JIT" in out:
+            raise RuntimeError(f"{self}: PCRE JIT is not available: {out.strip()}")
+        ctx.logger.info("%s: PCRE JIT is enabled", self)
+
+    def drift(self, cfg: Config) -> list[str]:
+        from .. import systemd
+        ret = [f"systemd {p}" for p in systemd.stale(cfg)]
+        if self.flavor == "openresty" and cfg.luac.package_dirs:
+            from ..luac import find_luajit, luac
+            luajit = find_luajit(cfg)
+            # Without OpenResty's `luajit` the binary is missing too
+            if luajit is not None and luajit.is_file():
+                stats = luac(cfg, dry_run=True)
+                if stats.unchanged < stats.scanned or stats.removed:
+                    ret.append(f"Lua bytecode in {cfg.luac.out_dir}")
+        return ret
 
-        ctx.logger.info("Nginx build completed")
-        ctx.progress.update(task, advance=1)
+    async def write_unit(self, ctx: Context):
+        """Write the systemd unit or its drop-in and check them"""
+        from shutil import which
+        from .. import systemd
+        for p in systemd.write(ctx.cfg):
+            ctx.logger.debug("%s: Wrote %s", self, p)
+        unit_path = systemd.paths(ctx.cfg)[0]
+        if which("systemd-analyze") is None:
+            ctx.logger.warning(
+                "%s: systemd-analyze not found, %s is unchecked", self, unit_path)
+            return
+        # Also reads the unit's drop-ins
+        rs = await ctx.run_cmd(f"systemd-analyze verify '{unit_path}' 2>&1")
+        out = rs.get_output_str()
+        bad = systemd.problems(ctx.cfg, out)
+        if rs.failed or bad:
+            raise RuntimeError(f"{self}: {unit_path} is invalid: "
+                               f"{'; '.join(bad) or out.strip()}")
 
     async def install(self, ctx: Context):
+        from vermils.io import aio
         ctx.logger.info("Start installing nginx")
         task = ctx.progress.add_task("Install core", total=3)
+        if not ctx.dry_run and ctx.cfg.health.enabled:
+            from .. import health
+            if await asyncio.to_thread(health.backup, ctx.cfg):
+                ctx.logger.debug("%s: Kept the previous binary and modules "
+                                 "in %s", self, ctx.cfg.health.backup_dir)
         rs = await ctx.run_cmd("make install", cwd=str(ctx.nginx_src_dir))
         rs.raise_for_returncode()
+        if self.march_variants:
+            await self.install_variant(ctx)
 
         if not ctx.dry_run:
-            init_script_path = "/etc/systemd/system/nginx.service"
-            ctx.logger.debug("%s: Creating init script at %s",
-                             self, init_script_path)
-            init_script = self.get_init_script()
-            async with aio.open(init_script_path, "w") as f:
-                await f.write(init_script)
+            await self.write_unit(ctx)
 
             ctx.logger.debug(
                 "Creating modules directory at %s", self.modules_path)
@@ -396,6 +705,8 @@ WantedBy=multi-user.target
         ctx.progress.update(task, advance=1)
 
         ctx.logger.debug("Enabling nginx service")
+        rs = await ctx.run_cmd("systemctl daemon-reload")
+        rs.raise_for_returncode()
         rs = await ctx.run_cmd("systemctl enable nginx")
         rs.raise_for_returncode()
 
@@ -411,12 +722,21 @@ WantedBy=multi-user.target
             rs = await ctx.run_cmd(f"chown {self.user}:{self.group} {p}")
             rs.raise_for_returncode()
 
+        if (
+            self.flavor == "openresty" and ctx.cfg.luac.package_dirs
+            and not ctx.dry_run
+        ):
+            from ..luac import luac
+            # Now that OpenResty's own `luajit` is installed
+            stats = await asyncio.to_thread(luac, ctx.cfg, False, ctx.logger)
+            ctx.logger.info("%s: %s", self, stats)
+
         ctx.logger.info("Nginx installation completed")
         ctx.progress.update(task, advance=1)
 
     async def uninstall(self, ctx: Context):
         ctx.logger.info("Start uninstalling nginx")
-        rs = list[Result]()
+        rs: list[Result] = []
         paths = (
             self.sbin_path, self.modules_path, self.cache_path,
             self.error_log_path, self.http_log_path,
@@ -455,6 +775,24 @@ WantedBy=multi-user.target
                 mod.enabled = False
                 del ctx.cfg.installers[i]
 
+    def _forbid_openssl(self, ctx: Context, reason):
+        for i, mod in enumerate(ctx.cfg.installers.copy()):
+            if mod.enabled and mod.classname == "OpenSSLInstaller":
+                ctx.logger.warning(
+                    "%s: OpenSSLInstaller is disabled because %s", self, reason
+                )
+                mod.enabled = False
+                del ctx.cfg.installers[i]
+
+    def _forbid_zlib_cf(self, ctx: Context, reason):
+        for i, mod in enumerate(ctx.cfg.installers.copy()):
+            if mod.enabled and mod.classname == "ZlibCFInstaller":
+                ctx.logger.warning(
+                    "%s: ZlibCFInstaller is disabled because %s", self, reason
+                )
+                mod.enabled = False
+                del ctx.cfg.installers[i]
+
     def _forbid_headers_more(self, ctx: Context, reason):
         for i, mod in enumerate(ctx.cfg.installers.copy()):
             if mod.enabled and mod.classname == "HeadersMoreInstaller":
@@ -33,6 +33,9 @@ class GeneralGitInstaller(BuiltinInstaller):
             return Path(quote(self.name))
         return Path(quote(urlparse(self.url).netloc))
 
+    def expected_opts(self) -> list[str]:
+        return [f"--add{'-dynamic' if self.dynamic else ''}-module=../{self.git_dest}"]
+
     async def prepare(self, ctx):
         logger = ctx.logger
         if not self.url.strip():
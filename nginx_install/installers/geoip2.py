@@ -1,7 +1,11 @@
-import shutil
-import bs4
 import re
+import sys
+import json
+import time
+import shutil
 import asyncio
+import subprocess
+import ctypes.util
 import os
 from os.path import relpath
 from multiprocessing import cpu_count
@@ -10,9 +14,51 @@ from vermils.io import aio
 from pydantic import Field
 from ..context import Context
 from .base import BuiltinInstaller
+from ..utils import MiB, md5_file, replace_atomic
 
 ver_re = re.compile(r"^(\d+\.\d+\.\d+)$")
 
+MMDB_METADATA_MARKER = b"\xab\xcd\xefMaxMind.com"
+TEST_IPS = ("1.1.1.1", "8.8.8.8", "81.2.69.142")
+TIMER_NAME = "nginx-geoip-update"
+
+
+def verify_mmdb(path: Path):
+    """
+    Open `path` and look up a few addresses, raise `ValueError` if unusable
+
+    Uses the `maxminddb` module or `mmdblookup` when available, otherwise
+     only checks for the metadata section every MaxMind DB ends with.
+    """
+    size = path.stat().st_size
+    with open(path, "rb") as f:
+        f.seek(max(0, size - 128 * 1024))
+        if MMDB_METADATA_MARKER not in f.read():
+            raise ValueError(f"{path} is not a MaxMind DB")
+
+    try:
+        import maxminddb
+    except ImportError:
+        maxminddb = None
+    if maxminddb is not None:
+        try:
+            with maxminddb.open_database(str(path)) as db:
+                for ip in TEST_IPS:
+                    db.get(ip)
+        except maxminddb.InvalidDatabaseError as e:
+            raise ValueError(f"{path}: {e}") from e
+        return
+
+    mmdblookup = shutil.which("mmdblookup")
+    if mmdblookup is None:
+        return
+    for ip in TEST_IPS:
+        rs = subprocess.run(
+            [mmdblookup, "--file", str(path), "--ip", ip],
+            capture_output=True, text=True, timeout=30, check=False)
+        if "Can't open" in rs.stderr or "Error" in rs.stderr:
+            raise ValueError(f"{path}: {rs.stderr.strip()}")
+
 
 class GeoIP2Installer(BuiltinInstaller):
     enabled: bool = False
@@ -23,16 +69,50 @@ class GeoIP2Installer(BuiltinInstaller):
         default_factory=lambda:
         ["GeoLite2-ASN", "GeoLite2-City", "GeoLite2-Country"]
     )
-    conf_path: Path = Path("/usr/local/etc/GeoIP.conf")
     database_dir: Path = Path("/usr/local/share/GeoIP")
     enable_auto_update: bool = True
-    auto_update_cron: str = "0 0 * * 0"
+    auto_update_calendar: str = "Sun *-*-* 00:00:00"
+    """systemd `OnCalendar` of the `geoip-update` timer"""
     configure_opts: list[str] = Field(default_factory=list)
+    """Extra `./configure` options of libmaxminddb"""
+    run_tests: bool = False
+    """Run libmaxminddb's `make check` after building it"""
+
+    @property
+    def build_size(self) -> int:
+        # libmaxminddb build plus downloaded databases
+        return 160 * MiB
 
     @property
     def ngx_modulenames(self) -> tuple[str, ...]:
         return ("ngx_http_geoip2_module",)
 
+    def expected_opts(self) -> list[str]:
+        return [
+            f"--add{'-dynamic' if self.dynamic else ''}-module="
+            "../ngx_http_geoip2_module"
+        ]
+
+    async def _installed_maxminddb(self, ctx: Context) -> str | None:
+        """Version of the installed libmaxminddb, `None` if there is none"""
+        rs = await ctx.run_cmd(
+            "PKG_CONFIG_PATH=/usr/local/lib/pkgconfig:$PKG_CONFIG_PATH "
+            "pkg-config --modversion libmaxminddb",
+            run_in_dry=True)
+        if rs.ok and rs.get_output_str().strip():
+            return rs.get_output_str().strip()
+
+        # No .pc file, ask the library itself
+        lib = ctypes.util.find_library("maxminddb")
+        if lib is None:
+            return None
+        try:
+            mmdb = ctypes.CDLL(lib)
+            mmdb.MMDB_lib_version.restype = ctypes.c_char_p
+            return mmdb.MMDB_lib_version().decode()
+        except (OSError, AttributeError):
+            return None
+
     async def _build_maxminddb(self, ctx: Context):  # skipcq: PY-R1000
         logger = ctx.logger
         client = ctx.client
@@ -42,6 +122,7 @@ class GeoIP2Installer(BuiltinInstaller):
         )
         r.raise_for_status()
 
+        import bs4
         soup = bs4.BeautifulSoup(r.content, "lxml")
         v = ''
         for h1 in soup.find_all("h1"):
@@ -53,22 +134,37 @@ class GeoIP2Installer(BuiltinInstaller):
             raise RuntimeError(f"{self}: Failed to find latest version")
 
         logger.debug("%s: Latest libmaxminddb version: %s", self, v)
-        tar_path = ctx.build_dir / f"libmaxminddb-{v}.tar.gz"
-        await ctx.download(
-            "https://github.com/maxmind/libmaxminddb/releases/download/"
-            f"{v}/libmaxminddb-{v}.tar.gz",
-            tar_path,
-            title="Get libmaxminddb source",
-        )
-        rs = await ctx.run_cmd(
-            f"tar -xzf '{tar_path}' -C '{ctx.build_dir}' "
-            f"&& cd '{ctx.build_dir}/libmaxminddb-{v}' "
-            f"&& ./configure {' '.join(self.configure_opts)} "
-            f"&& make -j {cpu_count()} "
-            "&& make check "
-            "&& make install "
-            "&& cd - "
-        )
+        installed = await self._installed_maxminddb(ctx)
+        if installed == v:
+            logger.info("%s: libmaxminddb %s is already installed", self, v)
+            return
+
+        src = ctx.build_dir / f"libmaxminddb-{v}"
+        key = await ctx.cache.key(
+            "libmaxminddb", v, str(self.run_tests), *self.configure_opts)
+        if not await ctx.cache.restore_tree("libmaxminddb", key, src):
+            tar_path = ctx.build_dir / f"libmaxminddb-{v}.tar.gz"
+            await ctx.download(
+                "https://github.com/maxmind/libmaxminddb/releases/download/"
+                f"{v}/libmaxminddb-{v}.tar.gz",
+                tar_path,
+                title="Get libmaxminddb source",
+            )
+            cache_file = await ctx.cache.autoconf_cache_file("libmaxminddb")
+            cache_opt = '' if cache_file is None else f"--cache-file='{cache_file}' "
+            rs = await ctx.run_cmd(
+                f"tar -xzf '{tar_path}' -C '{ctx.build_dir}' "
+                f"&& cd '{src}' "
+                f"&& ./configure {cache_opt}{' '.join(self.configure_opts)} "
+                f"&& make -j {cpu_count()} "
+                + ("&& make check " if self.run_tests else '')
+            )
+            rs.raise_for_returncode()
+            ctx.cache.mark_configured(src, key)
+            # The built tree, so a cache hit only needs `make install`
+            await ctx.cache.store_tree("libmaxminddb", key, src)
+
+        rs = await ctx.run_cmd(f"cd '{src}' && make install")
         rs.raise_for_returncode()
 
         rs = await ctx.run_cmd("ldconfig")
@@ -84,6 +180,134 @@ class GeoIP2Installer(BuiltinInstaller):
             rs = await ctx.run_cmd("ldconfig")
             rs.raise_for_returncode()
 
+    @staticmethod
+    def _edition_url(eid: str, license_key: str, suffix: str) -> str:
+        return ("https://download.maxmind.com/app/geoip_download?"
+                f"edition_id={eid}&license_key={license_key}&suffix={suffix}")
+
+    def _stamp_path(self, eid: str) -> Path:
+        """`Last-Modified` and MD5 of the tarball the live database came from"""
+        return self.database_dir / f".{eid}.stamp"
+
+    def _read_stamp(self, eid: str) -> dict[str, str]:
+        try:
+            return json.loads(self._stamp_path(eid).read_text())
+        except (OSError, ValueError):
+            return {}
+
+    async def _remote_md5(self, ctx: Context, eid: str, license_key: str) -> str:
+        r = await ctx.client.get(
+            self._edition_url(eid, license_key, "tar.gz.md5"),
+            follow_redirects=True)
+        return r.text.strip() if r.status_code == 200 else ''
+
+    async def _fetch_edition(
+            self, ctx: Context, eid: str, license_key: str, work: Path
+    ) -> tuple[Path, dict[str, str]] | None:
+        """
+        Download, extract and verify one edition, `None` if unchanged
+
+        An unchanged edition costs one conditional request, or one MD5
+         request if the server sent no `Last-Modified` last time.
+        """
+        logger = ctx.logger
+        stamp = self._read_stamp(eid) \
+            if (self.database_dir / f"{eid}.mmdb").exists() else {}
+        headers = {}
+        if stamp.get("last_modified"):
+            headers["If-Modified-Since"] = stamp["last_modified"]
+        elif stamp.get("md5"):
+            if await self._remote_md5(ctx, eid, license_key) == stamp["md5"]:
+                logger.info("%s: %s is up to date", self, eid)
+                return None
+
+        tar_path = work / f"{eid}.tar.gz"
+        start = time.monotonic()
+        got = await ctx.download(
+            self._edition_url(eid, license_key, "tar.gz"),
+            tar_path, title=f"Get {eid}", headers=headers)
+        if got is None:
+            logger.info("%s: %s is up to date", self, eid)
+            return None
+        ctx.metrics.observe(
+            "geoip_download_seconds", time.monotonic() - start, edition=eid)
+        ctx.metrics.observe(
+            "geoip_download_bytes", tar_path.stat().st_size, edition=eid)
+
+        remote = await self._remote_md5(ctx, eid, license_key)
+        if remote and md5_file(tar_path) != remote:
+            raise RuntimeError(f"{self}: {eid} download does not match its MD5")
+
+        dest = work / eid
+        dest.mkdir(exist_ok=True)
+        rs = await ctx.run_cmd(f"tar -xzf '{tar_path}' -C '{dest}'")
+        rs.raise_for_returncode()
+        found = sorted(dest.glob(f"*/{eid}.mmdb"))
+        if not found:
+            logger.warning(
+                "%s: Cannot extract %s database file from decompressed content",
+                self, eid)
+            return None
+        await asyncio.to_thread(verify_mmdb, found[-1])
+        return found[-1], {
+            "last_modified": got.get("last-modified", ''), "md5": remote}
+
+    def _install_edition(
+            self, eid: str, mmdb: Path, stamp: dict[str, str]) -> bool:
+        """Swap in `mmdb` atomically, return whether the content changed"""
+        live = self.database_dir / f"{eid}.mmdb"
+        changed = not live.exists() or md5_file(live) != md5_file(mmdb)
+        if changed:
+            replace_atomic(mmdb, live)
+        self._stamp_path(eid).write_text(json.dumps(stamp))
+        return changed
+
+    async def _reload_nginx(self, ctx: Context):
+        core = ctx.core
+        if not core.pid_path.exists():
+            ctx.logger.debug("%s: nginx is not running, no reload", self)
+            return
+        rs = await ctx.run_cmd(
+            f"{core.sbin_path} -t && {core.sbin_path} -s reload")
+        rs.raise_for_returncode()
+
+    async def update_databases(
+            self, ctx: Context, license_key: str, reload: bool = False
+    ) -> list[str]:
+        """
+        Refresh all editions, return the ones whose content changed
+
+        Editions are downloaded, extracted and verified concurrently.
+         Each live `.mmdb` is replaced by a rename, so a running nginx never
+         maps a missing or half-written file. nginx is reloaded only if
+         `reload` is set and something changed.
+        """
+        logger = ctx.logger
+        work = ctx.build_dir / "geoip"
+        work.mkdir(exist_ok=True)
+        fetched = await asyncio.gather(*(
+            self._fetch_edition(ctx, eid, license_key, work)
+            for eid in self.edition_ids))
+
+        todo = [(eid, *f) for eid, f in zip(self.edition_ids, fetched) if f]
+        for eid, mmdb, _ in todo:
+            ctx.metrics.observe(
+                "geoip_database_bytes", mmdb.stat().st_size, edition=eid)
+        if ctx.dry_run:
+            for eid, mmdb, _ in todo:
+                ctx.print(f"Install {mmdb} as {self.database_dir / eid}.mmdb")
+            return []
+
+        self.database_dir.mkdir(parents=True, exist_ok=True)
+        results = await asyncio.gather(*(
+            asyncio.to_thread(self._install_edition, eid, mmdb, stamp)
+            for eid, mmdb, stamp in todo))
+        changed = [eid for (eid, *_), ok in zip(todo, results) if ok]
+        logger.info("%s: Updated GeoIP2 databases: %s", self, changed or "none")
+        if changed and reload:
+            await self._reload_nginx(ctx)
+        return changed
+
     async def _get_db(
             self, ctx: Context, account_id: str, license_key: str) -> list[str]:
         logger = ctx.logger
@@ -94,105 +318,68 @@ class GeoIP2Installer(BuiltinInstaller):
             return []
 
         logger.debug("%s: Downloading GeoIP2 databases", self)
-        edition_ids = self.edition_ids
-        downloads = list[asyncio.Task]()
-        for eid in edition_ids:
-            loop = asyncio.get_running_loop()
-            downloads.append(
-                loop.create_task(
-                    ctx.download(
-                        "https://download.maxmind.com/app/geoip_download?"
-                        f"edition_id={eid}&license_key={license_key}"
-                        "&suffix=tar.gz",
-                        ctx.build_dir / f"{eid}.tar.gz",
-                        title=f"Get {eid}"
-                    ))
-            )
-        await asyncio.gather(*downloads)
+        await self.update_databases(ctx, license_key)
+        return self.edition_ids
 
-        for eid in edition_ids:
-            path_prefix = ctx.build_dir / eid
-            rs = await ctx.run_cmd(
-                f"tar -xzf '{path_prefix}.tar.gz' -C '{ctx.build_dir}' "
-                f"&& cp -rf '{path_prefix}_'* {self.database_dir} "
+    def get_update_units(self, config_path: Path) -> tuple[str, str]:
+        """systemd service and timer running the `geoip-update` action"""
+        service = f"""
+[Unit]
+Description=Update GeoIP2 databases for nginx
+After=network-online.target
+Wants=network-online.target
 
-            )
-            rs.raise_for_returncode()
+[Service]
+Type=oneshot
+EnvironmentFile=-/etc/default/{TIMER_NAME}
+ExecStart={sys.executable} -m nginx_install geoip-update -q -c {config_path}
+Nice=10
+IOSchedulingClass=idle
+"""
+        timer = f"""
+[Unit]
+Description=Update GeoIP2 databases for nginx
+
+[Timer]
+OnCalendar={self.auto_update_calendar}
+RandomizedDelaySec=1h
+Persistent=true
 
-            newest = ''
-            for folder in os.listdir(self.database_dir):
-                if not os.path.isdir(self.database_dir / folder):
-                    continue
-                if folder.startswith(eid) and folder > newest:
-                    newest = folder
-            newest_dir = self.database_dir / newest
-            newest_file = newest_dir / f"{eid}.mmdb"
-            linkdest = self.database_dir / f"{eid}.mmdb"
-            if not newest or not newest_file.exists():
-                logger.warning(
-                    "%s: Cannot extract %s database file from decompressed content",
-                    self, eid
-                )
-                continue
-            if linkdest.exists():
-                os.remove(linkdest)
-            shutil.copy(newest_file, linkdest)
-
-            for folder in os.listdir(self.database_dir):
-                if not os.path.isdir(self.database_dir / folder):
-                    continue
-                if folder.startswith(eid):
-                    shutil.rmtree(self.database_dir / folder)
-
-        return edition_ids
-
-    async def _enable_auto_update(
-            self, ctx: Context, account_id: str,
-            license_key: str, edition_ids: list[str]
-    ):
+[Install]
+WantedBy=timers.target
+"""
+        return service, timer
+
+    async def _enable_auto_update(self, ctx: Context):
         logger = ctx.logger
-        logger.debug("%s: Installing geoipupdate", self)
-        # if system flavor is debian
-        if os.path.exists("/etc/debian_version"):
-            arch = os.uname().machine
-            if arch == "x86_64":
-                arch = "amd64"
-            elif arch == "aarch64":
-                arch = "arm64"
-            else:
-                raise RuntimeError(f"{self}: Unknown architecture {arch}")
-            rs = await ctx.run_cmd(
-                "wget -qO geoipupdate.deb "
-                "https://github.com/maxmind/geoipupdate/releases/download/v7.0.1/"
-                f"geoipupdate_7.0.1_linux_{arch}.deb"
-                "&& dpkg -i geoipupdate.deb && rm geoipupdate.deb"
-            )
-        else:
-            rs = await ctx.run_cmd(
-                "apt-get update "
-                "&& apt-get install -y software-properties-common python3-launchpadlib"
-                "&& add-apt-repository ppa:maxmind/ppa "
-                "&& apt-get update && apt-get install -y geoipupdate"
-            )
-        rs.raise_for_returncode()
+        if ctx.config_path is None:
+            logger.warning(
+                "%s: No config file to run geoip-update with, "
+                "skipping the update timer", self)
+            return
 
-        conf = (
-            f"AccountID {account_id}\n"
-            f"LicenseKey {license_key}\n"
-            f"EditionIDs {' '.join(edition_ids)}\n"
-            f"DatabaseDirectory {self.database_dir}\n"
-        )
-        logger.debug("%s: Writing GeoIP2.conf", self)
+        service, timer = self.get_update_units(ctx.config_path.resolve())
+        unit_dir = Path("/etc/systemd/system")
+        logger.debug("%s: Writing %s units", self, TIMER_NAME)
         if not ctx.dry_run:
-            async with aio.open(self.conf_path, "w") as f:
-                await f.write(conf)
+            async with aio.open(unit_dir / f"{TIMER_NAME}.service", "w") as f:
+                await f.write(service)
+            async with aio.open(unit_dir / f"{TIMER_NAME}.timer", "w") as f:
+                await f.write(timer)
         rs = await ctx.run_cmd(
-            f"echo \"{self.auto_update_cron} "
-            f"`which geoipupdate` -f \"{self.conf_path}\"\" "
-            "> /etc/cron.d/geoipupdate"
-        )
+            "systemctl daemon-reload "
+            f"&& systemctl enable --now {TIMER_NAME}.timer "
+            # Replaced by the timer
+            "&& rm -f /etc/cron.d/geoipupdate")
         rs.raise_for_returncode()
 
+    async def refresh(self, ctx: Context) -> list[str]:
+        """The `geoip-update` action, reloads nginx if anything changed"""
+        license_key = os.environ.get("MAXMIND_KEY", self.license_key)
+        if not license_key:
+            raise RuntimeError(f"{self}: License Key is not set")
+        return await self.update_databases(ctx, license_key, reload=True)
+
     async def prepare(self, ctx):
         logger = ctx.logger
         logger.debug("%s: Preparing GeoIP2 installer", self)
@@ -207,8 +394,7 @@ class GeoIP2Installer(BuiltinInstaller):
         ctx.progress.update(task, advance=1)
 
         if edition_ids and self.enable_auto_update:
-            await self._enable_auto_update(
-                ctx, account_id, license_key, edition_ids)
+            await self._enable_auto_update(ctx)
 
         ctx.progress.update(task, advance=1)
 
@@ -238,8 +424,8 @@ class GeoIP2Installer(BuiltinInstaller):
         task = ctx.progress.add_task("Uninstall GeoIP2", total=1)
         ctx.print(f"{self}: Cannot determine dependencies to clean. "
                   "You may need to mannually remove "
-                  f"{self.database_dir}, /etc/cron.d/geoipupdate, {self.conf_path}, "
-                  "geoipupdate and /usr/local/lib/libmaxminddb.so")
+                  f"{self.database_dir}, the {TIMER_NAME} systemd timer "
+                  "and /usr/local/lib/libmaxminddb.so")
         ctx.progress.update(task, advance=1)
 
     async def clean(self, ctx):
@@ -10,6 +10,12 @@ class HeadersMoreInstaller(BuiltinInstaller):
     def ngx_modulenames(self) -> tuple[str, ...]:
         return ("ngx_http_headers_more_filter_module",)
 
+    def expected_opts(self) -> list[str]:
+        return [
+            f"--add{'-dynamic' if self.dynamic else ''}-module="
+            "../headers-more-nginx-module"
+        ]
+
     async def prepare(self, ctx):
         logger = ctx.logger
         path = ctx.build_dir / "headers-more-nginx-module"
@@ -1,71 +1,133 @@
-import bs4
 import re
 from os.path import relpath
+from pathlib import Path
+from pydantic import Field
 from .base import BuiltinInstaller
+from ..utils import MiB
 
 ver_re = re.compile(r".*?(\d+\.\d+\.\d+)$")
+ULP_PATH = Path("/proc/sys/net/ipv4/tcp_available_ulp")
 
 
 class OpenSSLInstaller(BuiltinInstaller):
     enabled: bool = False
-
-    async def prepare(self, ctx):
-        logger = ctx.logger
-        logger.debug("%s: Preparing OpenSSL installer", self)
-        client = ctx.client
-        task = ctx.progress.add_task("Prepare OpenSSL", total=4)
-
-        r = await client.get(
+    version: str = "latest"
+    """`latest` or an exact release such as `3.3.2`"""
+    ktls: bool = False
+    """Build with `enable-ktls` so `sendfile` works over TLS"""
+    no_tests: bool = True
+    no_docs: bool = True
+    """Only passed to OpenSSL 3.2 and later"""
+    extra_opts: list[str] = Field(default_factory=list)
+    """More OpenSSL `Configure` options, e.g. `no-legacy`"""
+
+    @property
+    def build_size(self) -> int:
+        # Source tree plus the objects nginx's make builds inside it
+        return 768 * MiB
+
+    def openssl_opts(self, version: str | None = None) -> list[str]:
+        """
+        Options nginx passes to OpenSSL's `config` on top of its own
+         `no-shared no-threads`, assembly stays enabled
+        """
+        v = version or (None if self.version == "latest" else self.version)
+        ret = list[str]()
+        if self.ktls:
+            ret.append("enable-ktls")
+        if self.no_tests:
+            ret.append("no-tests")
+        if self.no_docs and (
+            v is None or tuple(map(int, v.split('.')[:2])) >= (3, 2)
+        ):
+            ret.append("no-docs")
+        ret.extend(self.extra_opts)
+        return ret
+
+    def expected_opts(self) -> list[str]:
+        v = '' if self.version == "latest" else f"-{self.version}"
+        ret = [f"--with-openssl=../openssl{v}"]
+        opts = self.openssl_opts()
+        if opts:
+            ret.append(f"--with-openssl-opt={' '.join(opts)}")
+        return ret
+
+    async def _latest_version(self, ctx) -> str:
+        r = await ctx.client.get(
             "https://github.com/openssl/openssl/releases/latest",
             follow_redirects=True,
         )
         r.raise_for_status()
 
-        ctx.progress.update(task, advance=1)
-
+        import bs4
         soup = bs4.BeautifulSoup(r.content, "lxml")
-        v = ''
         for h1 in soup.find_all("h1"):
             m = ver_re.match(h1.text.strip())
             if m:
-                v = m.group(1)
-                break
-        if not v:
-            raise RuntimeError(f"{self}: Failed to find latest version")
-
-        logger.debug("%s: Latest OpenSSL release version: %s", self, v)
-        fpath = ctx.build_dir / f"openssl-{v}.tar.gz"
-        await ctx.download(
-            "https://github.com/openssl/openssl/releases/download/"
-            f"openssl-{v}/openssl-{v}.tar.gz",
-            fpath,
-            title="Get openssl source",
-        )
+                return m.group(1)
+        raise RuntimeError(f"{self}: Failed to find latest version")
 
-        ctx.progress.update(task, advance=1)
+    async def prepare(self, ctx):
+        logger = ctx.logger
+        logger.debug("%s: Preparing OpenSSL installer", self)
+        task = ctx.progress.add_task("Prepare OpenSSL", total=3)
 
-        rs = await ctx.run_cmd(
-            f"tar -xzf '{fpath}' -C '{ctx.build_dir}'",
-        )
-        rs.raise_for_returncode()
+        if self.version == "latest":
+            v = await self._latest_version(ctx)
+            logger.debug("%s: Latest OpenSSL release version: %s", self, v)
+        else:
+            v = self.version
 
         ctx.progress.update(task, advance=1)
 
+        # nginx's make runs OpenSSL's `config` itself with `--with-openssl-opt`,
+        # so only the extracted source is prepared and cached here
         dpath = ctx.build_dir / f"openssl-{v}"
-        rs = await ctx.run_cmd(
-            f"cd '{dpath}' && ./config",
-        )
-        rs.raise_for_returncode()
+        key = await ctx.cache.key("openssl", v, "source")
+        if not await ctx.cache.restore_tree("openssl", key, dpath, relocatable=True):
+            fpath = ctx.build_dir / f"openssl-{v}.tar.gz"
+            await ctx.download(
+                "https://github.com/openssl/openssl/releases/download/"
+                f"openssl-{v}/openssl-{v}.tar.gz",
+                fpath,
+                title="Get openssl source",
+            )
+            rs = await ctx.run_cmd(
+                f"tar -xzf '{fpath}' -C '{ctx.build_dir}'",
+            )
+            rs.raise_for_returncode()
+            await ctx.cache.store_tree("openssl", key, dpath, relocatable=True)
+
+        ctx.progress.update(task, advance=1)
 
         ctx.core.configure_opts.append(
             f"--with-openssl={relpath(dpath, ctx.nginx_src_dir)}")
+        opts = self.openssl_opts(v)
+        if opts:
+            ctx.core.configure_opts.append(
+                f"--with-openssl-opt={' '.join(opts)}")
         ctx.progress.update(task, advance=1)
 
     async def build(self, ctx):
         ...
 
     async def install(self, ctx):
-        ...
+        if not self.ktls:
+            return
+        logger = ctx.logger
+        rs = await ctx.run_cmd("modprobe tls")
+        if rs.failed:
+            logger.debug("%s: modprobe tls failed: %s", self, rs.get_error_str())
+        try:
+            ulps = ULP_PATH.read_text().split()
+        except OSError:
+            ulps = []
+        if "tls" not in ulps:
+            logger.warning(
+                "%s: The running kernel does not offer the `tls` ULP, "
+                "nginx falls back to user-space TLS and no sendfile", self)
+        else:
+            logger.info("%s: Kernel TLS is available", self)
 
     async def uninstall(self, ctx):
         ...
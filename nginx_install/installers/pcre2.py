@@ -0,0 +1,69 @@
+from os.path import relpath
+from .base import BuiltinInstaller
+from ..utils import MiB
+
+
+class PCRE2Installer(BuiltinInstaller):
+    """
+    PCRE2 from source, compiled into nginx with JIT
+
+    nginx compiles the PCRE2 sources itself with `--with-pcre-opt`, which
+     is set to the core's `cc_opts`, so regexes get the same `-O3
+     -march=native` as nginx. The PCRE1 apt packages are then not installed.
+    """
+    enabled: bool = False
+    version: str = "10.44"
+    jit: bool = True
+    """Add `--with-pcre-jit` if the core options lack it"""
+
+    @property
+    def build_size(self) -> int:
+        return 32 * MiB
+
+    def expected_opts(self) -> list[str]:
+        # `plan` compares `--with-pcre-opt` by name only, its value is
+        # always the core's `cc_opts` which `--with-cc-opt` already covers
+        ret = [f"--with-pcre=../pcre2-{self.version}", "--with-pcre-opt="]
+        if self.jit:
+            ret.append("--with-pcre-jit")
+        return ret
+
+    async def prepare(self, ctx):
+        logger = ctx.logger
+        logger.debug("%s: Preparing PCRE2 installer", self)
+        task = ctx.progress.add_task("Prepare PCRE2", total=2)
+
+        v = self.version
+        path = ctx.build_dir / f"pcre2-{v}"
+        key = await ctx.cache.key("pcre2", v, "source")
+        if not await ctx.cache.restore_tree("pcre2", key, path, relocatable=True):
+            tar_path = ctx.build_dir / f"pcre2-{v}.tar.gz"
+            await ctx.download(
+                "https://github.com/PCRE2Project/pcre2/releases/download/"
+                f"pcre2-{v}/pcre2-{v}.tar.gz",
+                tar_path, title="Get PCRE2 source")
+            rs = await ctx.run_cmd(
+                f"tar -xzf '{tar_path}' -C '{ctx.build_dir}'")
+            rs.raise_for_returncode()
+            await ctx.cache.store_tree("pcre2", key, path, relocatable=True)
+        ctx.progress.update(task, advance=1)
+
+        core = ctx.core
+        core.configure_opts.append(
+            f"--with-pcre={relpath(path, ctx.nginx_src_dir)}")
+        core.configure_opts.append(f"--with-pcre-opt={' '.join(core.cc_opts)}")
+        if self.jit and "--with-pcre-jit" not in core.configure_opts:
+            core.configure_opts.append("--with-pcre-jit")
+        ctx.progress.update(task, advance=1)
+
+    async def build(self, ctx):
+        ...
+
+    async def install(self, ctx):
+        ...
+
+    async def uninstall(self, ctx):
+        ...
+
+    async def clean(self, ctx):
+        ...
@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import NamedTuple, TYPE_CHECKING
+from .base import BuiltinInstaller
+if TYPE_CHECKING:
+    from ..config import Config
+    from ..context import Context
+    from ..ngx_conf import HostInfo
+
+PROC_SYS = Path("/proc/sys")
+RAISE_ONLY = (
+    "net.core.somaxconn",
+    "net.ipv4.tcp_max_syn_backlog",
+    "net.core.rmem_max",
+    "net.core.wmem_max",
+    "fs.file-max",
+)
+"""Minimums, a host already tuned higher keeps its value"""
+BITMASKS = ("net.ipv4.tcp_fastopen",)
+"""Flags added to the current value"""
+
+
+def read_sysctl(key: str, proc_sys: Path = PROC_SYS) -> str | None:
+    try:
+        return ' '.join((proc_sys / key.replace('.', '/')).read_text().split())
+    except OSError:
+        return None
+
+
+class Row(NamedTuple):
+    key: str
+    current: str | None
+    value: str
+
+    @property
+    def changed(self) -> bool:
+        return self.current != self.value
+
+    def __str__(self) -> str:
+        if not self.changed:
+            return f"  = {self.key} = {self.value}"
+        return f"  ~ {self.key}: {self.current} -> {self.value}"
+
+
+class SysctlTuningInstaller(BuiltinInstaller):
+    """
+    Kernel network settings matching the generated nginx config
+
+    Listen backlogs, Fast Open, QUIC socket buffers, the ephemeral port
+     range and `fs.file-max` come from `ngx_conf.sysctls`. Install writes
+     them to `path`, applies them live and logs what changed; uninstall
+     removes the file, the running values stay until reboot.
+    """
+    enabled: bool = False
+    path: Path = Path("/etc/sysctl.d/90-nginx.conf")
+    apply: bool = True
+    """Also load the file right away with `sysctl -p`"""
+    extra: dict[str, int | str] = {}
+    """More settings, or overrides of the computed ones"""
+
+    @property
+    def build_size(self) -> int:
+        return 0
+
+    def expected_opts(self) -> list[str]:
+        return []
+
+    def rows(self, cfg: Config, host: HostInfo | None = None,
+             proc_sys: Path = PROC_SYS) -> list[Row]:
+        """The profile next to the current values"""
+        from ..ngx_conf import sysctls
+        wanted = {**sysctls(cfg, host), **self.extra}
+        ret = list[Row]()
+        for key, value in wanted.items():
+            current = read_sysctl(key, proc_sys)
+            value = ' '.join(str(value).split())
+            if key not in self.extra and current is not None \
+                    and current.isdigit() and value.isdigit():
+                if key in RAISE_ONLY:
+                    value = str(max(int(current), int(value)))
+                elif key in BITMASKS:
+                    value = str(int(current) | int(value))
+            ret.append(Row(key, current, value))
+        return ret
+
+    @staticmethod
+    def render(rows: list[Row]) -> str:
+        return "# Generated by nginx_install, see SysctlTuningInstaller\n" + \
+            ''.join(f"{r.key} = {r.value}\n" for r in rows)
+
+    def drift(self, cfg: Config) -> list[str]:
+        rows = self.rows(cfg)
+        try:
+            profile = self.path.read_text()
+        except OSError:
+            profile = None
+        ret = [] if profile == self.render(rows) else [f"sysctl profile {self.path}"]
+        if self.apply:
+            ret.extend(f"sysctl {r.key}: {r.current} -> {r.value}"
+                       for r in rows if r.changed)
+        return ret
+
+    async def prepare(self, ctx):
+        ...
+
+    async def build(self, ctx):
+        ...
+
+    async def install(self, ctx: Context):
+        logger = ctx.logger
+        task = ctx.progress.add_task("Install sysctl profile", total=2)
+        rows = self.rows(ctx.cfg)
+        changed = [r for r in rows if r.changed]
+        logger.info("%s: %d of %d kernel settings change", self,
+                    len(changed), len(rows))
+        for r in rows:
+            logger.info("%s:%s", self, r)
+
+        if not ctx.dry_run:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.path.write_text(self.render(rows))
+            logger.debug("%s: Wrote %s", self, self.path)
+        ctx.progress.update(task, advance=1)
+
+        if self.apply:
+            rs = await ctx.run_cmd(f"sysctl -p '{self.path}'")
+            if rs.failed:
+                # E.g. in a container with a read-only /proc/sys, the file
+                # still applies at the next boot
+                logger.warning("%s: Could not apply %s live: %s", self,
+                               self.path, rs.get_error_str().strip())
+        ctx.progress.update(task, advance=1)
+
+    async def uninstall(self, ctx: Context):
+        if self.path.exists():
+            ctx.logger.debug("%s: Removing %s", self, self.path)
+            rs = await ctx.run_cmd(f"rm -f '{self.path}'")
+            rs.raise_for_returncode()
+            ctx.logger.info(
+                "%s: Removed %s, running values stay until reboot",
+                self, self.path)
+
+    async def clean(self, ctx):
+        ...
@@ -0,0 +1,158 @@
+from os.path import relpath
+from multiprocessing import cpu_count
+from typing import Literal
+from .base import BuiltinInstaller
+from ..utils import MiB
+
+GIT_URLS = {
+    "quictls": "https://github.com/quictls/openssl.git",
+    "boringssl": "https://boringssl.googlesource.com/boringssl",
+    "aws-lc": "https://github.com/aws/aws-lc.git",
+}
+LIBRESSL_VERSION = "4.0.0"
+
+
+class TLSLibInstaller(BuiltinInstaller):
+    """
+    TLS library with a native QUIC API for `--with-http_v3_module`
+
+    With system OpenSSL or `OpenSSLInstaller`, nginx runs QUIC on its
+     OpenSSL compatibility layer, which has no 0-RTT. quictls is built by
+     nginx like OpenSSL; BoringSSL, AWS-LC and LibreSSL are built here and
+     linked through `--with-cc-opt`/`--with-ld-opt`.
+    """
+    enabled: bool = False
+    library: Literal["quictls", "boringssl", "aws-lc", "libressl"] = "quictls"
+    version: str = ''
+    """Git ref for quictls, BoringSSL and AWS-LC, release for LibreSSL;
+    empty for the default branch or `LIBRESSL_VERSION`"""
+
+    @property
+    def build_size(self) -> int:
+        return 768 * MiB
+
+    @property
+    def dir_name(self) -> str:
+        """Source dir in `build_dir`, named after the version if pinned so
+        `plan` sees a new one in `nginx -V`"""
+        if self.library == "libressl":
+            return f"libressl-{self.version or LIBRESSL_VERSION}"
+        if self.version:
+            return f"{self.library}-{self.version.replace('/', '_')}"
+        return self.library
+
+    @property
+    def rel_dir(self) -> str:
+        """Source dir relative to the nginx source dir"""
+        return f"../{self.dir_name}"
+
+    def expected_opts(self) -> list[str]:
+        if self.library == "quictls":
+            return [f"--with-openssl={self.rel_dir}",
+                    "--with-openssl-opt=no-tests"]
+        return []
+
+    def expected_cc_opts(self) -> list[str]:
+        d = self.rel_dir
+        match self.library:
+            case "boringssl" | "aws-lc":
+                return [f"-I{d}/include"]
+            case "libressl":
+                return [f"-I{d}/.openssl/include"]
+        return []
+
+    def expected_ld_opts(self) -> list[str]:
+        d = self.rel_dir
+        match self.library:
+            case "boringssl":
+                return [f"-L{d}/build", f"-L{d}/build/ssl",
+                        f"-L{d}/build/crypto", "-lstdc++"]
+            case "aws-lc":
+                return [f"-L{d}/build/ssl", f"-L{d}/build/crypto"]
+            case "libressl":
+                return [f"-L{d}/.openssl/lib"]
+        return []
+
+    async def _get_source(self, ctx) -> str:
+        """Fetch the source into `build_dir / dir_name`, return its version"""
+        path = ctx.build_dir / self.dir_name
+        if self.library == "libressl":
+            v = self.version or LIBRESSL_VERSION
+            tar_path = ctx.build_dir / f"libressl-{v}.tar.gz"
+            await ctx.download(
+                "https://ftp.openbsd.org/pub/OpenBSD/LibreSSL/"
+                f"libressl-{v}.tar.gz",
+                tar_path, title="Get LibreSSL source")
+            # Unpacks to `dir_name`
+            rs = await ctx.run_cmd(
+                f"rm -rf '{path}' && tar -xzf '{tar_path}' -C '{ctx.build_dir}'")
+            rs.raise_for_returncode()
+            return v
+
+        url = GIT_URLS[self.library]
+        await ctx.git_clone(url, path, title=f"Clone {self.library}")
+        if self.version:
+            rs = await ctx.run_cmd(
+                f"git checkout '{self.version}'", cwd=path)
+            rs.raise_for_returncode()
+        rs = await ctx.run_cmd("git rev-parse HEAD", cwd=path, run_in_dry=True)
+        return rs.get_output_str().strip() or self.version
+
+    def _build_cmd(self) -> str | None:
+        """Build command with a `{jobs}` placeholder, left out of cache keys"""
+        match self.library:
+            case "boringssl":
+                return ("cmake -B build -DCMAKE_BUILD_TYPE=Release "
+                        "&& make -C build -j {jobs} ssl crypto")
+            case "aws-lc":
+                return ("cmake -B build -DCMAKE_BUILD_TYPE=Release "
+                        "-DBUILD_TESTING=OFF -DDISABLE_GO=ON "
+                        "&& make -C build -j {jobs} ssl crypto")
+            case "libressl":
+                return ("./configure --disable-shared --disable-tests "
+                        "--prefix=\"$PWD/.openssl\" "
+                        "&& make -j {jobs} && make install")
+        return None
+
+    async def prepare(self, ctx):
+        logger = ctx.logger
+        logger.debug("%s: Preparing %s", self, self.library)
+        # `NginxInstaller.prepare` already disabled `OpenSSLInstaller`
+        task = ctx.progress.add_task(f"Prepare {self.library}", total=3)
+
+        path = ctx.build_dir / self.dir_name
+        v = await self._get_source(ctx)
+        ctx.progress.update(task, advance=1)
+
+        build_cmd = self._build_cmd()
+        if build_cmd is not None:
+            key = await ctx.cache.key(self.library, v, build_cmd)
+            if not (v and await ctx.cache.restore_tree(self.library, key, path)):
+                rs = await ctx.run_cmd(
+                    build_cmd.format(jobs=cpu_count()), cwd=path)
+                rs.raise_for_returncode()
+                if v:
+                    await ctx.cache.store_tree(self.library, key, path)
+        ctx.progress.update(task, advance=1)
+
+        # Paths relative to where nginx's configure runs
+        rel = relpath(path, ctx.nginx_src_dir)
+        replace = (lambda o: o.replace(self.rel_dir, rel, 1))
+        if self.library == "quictls":
+            ctx.core.configure_opts.extend(
+                replace(o) for o in self.expected_opts())
+        ctx.core.cc_opts.extend(map(replace, self.expected_cc_opts()))
+        ctx.core.ld_opts.extend(map(replace, self.expected_ld_opts()))
+        ctx.progress.update(task, advance=1)
+
+    async def build(self, ctx):
+        ...
+
+    async def install(self, ctx):
+        ...
+
+    async def uninstall(self, ctx):
+        ...
+
+    async def clean(self, ctx):
+        ...
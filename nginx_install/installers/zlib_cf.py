@@ -1,29 +1,44 @@
 from os.path import relpath
 from .base import BuiltinInstaller
+from ..utils import MiB
 
 
 class ZlibCFInstaller(BuiltinInstaller):
     enabled: bool = False
 
+    @property
+    def build_size(self) -> int:
+        return 16 * MiB
+
+    def expected_opts(self) -> list[str]:
+        return ["--with-zlib=../cloudflare-zlib"]
+
     async def prepare(self, ctx):
         logger = ctx.logger
         logger.debug("%s: Preparing Zlib Cloudflare installer", self)
         task = ctx.progress.add_task("Prepare Zlib Cloudflare", total=2)
 
         path = ctx.build_dir / "cloudflare-zlib"
-
-        await ctx.git_clone(
-            "https://github.com/cloudflare/zlib.git",
-            path,
-        )
-
-        ctx.progress.update(task, advance=1)
-
-        rs = await ctx.run_cmd(
-            "./configure",
-            cwd=path.resolve(),
-        )
-        rs.raise_for_returncode()
+        url = "https://github.com/cloudflare/zlib.git"
+
+        rs = await ctx.run_cmd(f"git ls-remote {url} HEAD", run_in_dry=True)
+        head = rs.get_output_str().split('\t', 1)[0].strip()
+        key = await ctx.cache.key("cloudflare-zlib", head)
+        if head and await ctx.cache.restore_tree("cloudflare-zlib", key, path):
+            ctx.progress.update(task, advance=1)
+        else:
+            await ctx.git_clone(url, path)
+
+            ctx.progress.update(task, advance=1)
+
+            rs = await ctx.run_cmd(
+                "./configure",
+                cwd=path.resolve(),
+            )
+            rs.raise_for_returncode()
+            if head:
+                ctx.cache.mark_configured(path, key)
+                await ctx.cache.store_tree("cloudflare-zlib", key, path)
 
         ctx.core.configure_opts.append(
             f"--with-zlib={relpath(path, ctx.nginx_src_dir)}")
@@ -0,0 +1,75 @@
+from os.path import relpath
+from .base import BuiltinInstaller
+from ..utils import MiB
+
+# nginx rebuilds zlib with a bare `./configure`, keep it in zlib-compat mode
+CONFIGURE_WRAPPER = """#!/bin/sh
+exec "$(dirname "$0")/configure.ng" --zlib-compat "$@"
+"""
+
+
+class ZlibNgInstaller(BuiltinInstaller):
+    """
+    zlib-ng in zlib-compat mode, statically linked via `--with-zlib`
+
+    Its SIMD code paths are picked at runtime from the CPU features,
+     so the same binary is safe to copy between hosts.
+    """
+    enabled: bool = False
+    version: str = "2.2.2"
+    """Release tag"""
+
+    @property
+    def build_size(self) -> int:
+        return 16 * MiB
+
+    def expected_opts(self) -> list[str]:
+        return [f"--with-zlib=../zlib-ng-{self.version}"]
+
+    async def prepare(self, ctx):
+        logger = ctx.logger
+        logger.debug("%s: Preparing zlib-ng installer", self)
+        # `NginxInstaller.prepare` already disabled `ZlibCFInstaller`
+        task = ctx.progress.add_task("Prepare zlib-ng", total=2)
+
+        v = self.version
+        path = ctx.build_dir / f"zlib-ng-{v}"
+        key = await ctx.cache.key("zlib-ng", v)
+        if await ctx.cache.restore_tree("zlib-ng", key, path):
+            ctx.progress.update(task, advance=1)
+        else:
+            tar_path = ctx.build_dir / f"zlib-ng-{v}.tar.gz"
+            await ctx.download(
+                f"https://github.com/zlib-ng/zlib-ng/archive/refs/tags/{v}.tar.gz",
+                tar_path, title="Get zlib-ng source")
+            rs = await ctx.run_cmd(
+                f"tar -xzf '{tar_path}' -C '{ctx.build_dir}'")
+            rs.raise_for_returncode()
+
+            ctx.progress.update(task, advance=1)
+
+            if not ctx.dry_run:
+                (path / "configure").rename(path / "configure.ng")
+                wrapper = path / "configure"
+                wrapper.write_text(CONFIGURE_WRAPPER)
+                wrapper.chmod(0o755)
+            # nginx starts with `make distclean`, which needs a Makefile
+            rs = await ctx.run_cmd("./configure", cwd=path.resolve())
+            rs.raise_for_returncode()
+            await ctx.cache.store_tree("zlib-ng", key, path)
+
+        ctx.core.configure_opts.append(
+            f"--with-zlib={relpath(path, ctx.nginx_src_dir)}")
+        ctx.progress.update(task, advance=1)
+
+    async def build(self, ctx):
+        ...
+
+    async def install(self, ctx):
+        ...
+
+    async def uninstall(self, ctx):
+        ...
+
+    async def clean(self, ctx):
+        ...
@@ -0,0 +1,152 @@
+"""
+Precompile Lua packages to LuaJIT bytecode for OpenResty
+
+Every `.lua` file of a package directory is compiled with `luajit -b`
+ into a mirror tree under `luac.out_dir`, keeping its name, since LuaJIT
+ loads bytecode from any file `require` finds. An mtime/size index per
+ package directory lets reruns compile only changed files and remove the
+ outputs of deleted ones.
+
+Bytecode is tied to the LuaJIT build, GC64 or not, so the compiler is
+ the `luajit` OpenResty installed and its stat is part of the index name,
+ as is `luac.debug_info`.
+"""
+from __future__ import annotations
+
+import os
+import shutil
+import hashlib
+import logging
+import subprocess
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple, TYPE_CHECKING
+from .utils import FileIndex
+if TYPE_CHECKING:
+    from .config import Config
+
+
+class Stats(NamedTuple):
+    scanned: int = 0
+    compiled: int = 0
+    unchanged: int = 0
+    failed: int = 0
+    removed: int = 0
+
+    def __add__(self, other):  # type: ignore[override]
+        return Stats(*(a + b for a, b in zip(self, other)))
+
+    def __str__(self) -> str:
+        return (
+            f"{self.scanned} Lua files: {self.compiled} compiled, "
+            f"{self.unchanged} unchanged, {self.failed} failed, "
+            f"{self.removed} stale outputs removed")
+
+
+def find_luajit(cfg: Config) -> Path | None:
+    """`luac.luajit`, else the one under the core's prefix, else `PATH`'s"""
+    if cfg.luac.luajit is not None:
+        return cfg.luac.luajit
+    bundled = cfg.core.config_prefix / "luajit" / "bin" / "luajit"
+    if bundled.is_file():
+        return bundled
+    found = shutil.which("luajit")
+    return Path(found) if found else None
+
+
+def index_path(cfg: Config, pkg: Path, luajit: Path) -> Path:
+    st = luajit.stat()
+    key = (f"{pkg.resolve()}\0{luajit.resolve()}\0{st.st_mtime_ns}\0{st.st_size}"
+           f"\0{cfg.luac.debug_info}")
+    digest = hashlib.sha256(key.encode()).hexdigest()[:16]
+    return cfg.cache.dir / "luac" / f"{digest}.json"
+
+
+def compile_file(luajit: Path, src: Path, dest: Path,
+                 debug_info: bool) -> str | None:
+    """Compile one file, returns `luajit`'s error or `None`"""
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dest.with_name(f".{dest.name}.{os.getpid()}.tmp")
+    cmd = [str(luajit), "-b", "-t", "raw", "-g" if debug_info else "-s",
+           str(src), str(tmp)]
+    try:
+        rs = subprocess.run(cmd, capture_output=True, text=True, check=False)
+        if rs.returncode != 0:
+            return (rs.stderr or rs.stdout).strip()
+        st = src.stat()
+        os.chmod(tmp, st.st_mode & 0o777)
+        os.replace(tmp, dest)
+    finally:
+        tmp.unlink(missing_ok=True)
+    return None
+
+
+def compile_package(cfg: Config, pkg: Path, luajit: Path,
+                    pool: ThreadPoolExecutor | None, dry_run: bool = False,
+                    logger: logging.Logger | None = None) -> Stats:
+    logger = logger or logging.getLogger(__name__)
+    out = cfg.luac.out_dir / pkg.name
+    index = FileIndex(index_path(cfg, pkg, luajit))
+
+    seen = set[str]()
+    todo = list[str]()
+    unchanged = 0
+    for dirpath, _, filenames in os.walk(pkg):
+        for name in filenames:
+            if not name.endswith(".lua") or name.startswith('.'):
+                continue
+            path = Path(dirpath) / name
+            rel = str(path.relative_to(pkg))
+            seen.add(rel)
+            if index.changed(rel, path.stat()) or not (out / rel).is_file():
+                todo.append(rel)
+            else:
+                unchanged += 1
+
+    removed = 0
+    for rel in index.prune(seen):
+        if (out / rel).exists():
+            logger.debug("Removing stale %s", out / rel)
+            if not dry_run:
+                (out / rel).unlink()
+            removed += 1
+
+    stats = Stats(scanned=len(seen), unchanged=unchanged, removed=removed)
+    if dry_run:
+        for rel in todo:
+            logger.info("Would compile %s", pkg / rel)
+        return stats
+
+    def job(rel: str) -> str | None:
+        return compile_file(luajit, pkg / rel, out / rel, cfg.luac.debug_info)
+
+    results = pool.map(job, todo) if pool else map(job, todo)
+    for rel, err in zip(todo, results):
+        if err is not None:
+            # Left out of the index, so the next run tries again
+            logger.warning("Failed to compile %s: %s", pkg / rel, err)
+            stats += Stats(failed=1)
+            continue
+        index.update(rel, (pkg / rel).stat())
+        stats += Stats(compiled=1)
+    index.save()
+    return stats
+
+
+def luac(cfg: Config, dry_run: bool = False,
+         logger: logging.Logger | None = None) -> Stats:
+    """Compile every configured package directory"""
+    logger = logger or logging.getLogger(__name__)
+    luajit = find_luajit(cfg)
+    if luajit is None or not luajit.is_file():
+        raise FileNotFoundError(
+            f"luajit not found ({luajit}), install OpenResty or set luac.luajit")
+
+    stats = Stats()
+    with ThreadPoolExecutor(cfg.luac.jobs) as pool:
+        for pkg in cfg.luac.package_dirs:
+            if not pkg.is_dir():
+                logger.warning("Lua package directory %s does not exist", pkg)
+                continue
+            stats += compile_package(cfg, pkg, luajit, pool, dry_run, logger)
+    return stats
@@ -0,0 +1,129 @@
+import re
+import time
+import threading
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterable
+if TYPE_CHECKING:
+    from .context import Context
+else:
+    Context = None
+
+target_re = re.compile(r"^(\S+\.o)\s*:(?!=)")
+output_re = re.compile(r"(?:^|\s)-o\s+(\S+\.o)\b")
+checking_re = re.compile(r"^checking for (.+?)(?:\s*\.\.\..*)?$")
+
+
+def count_units(makefiles: Iterable[Path]) -> int:
+    """Count object targets in the given Makefiles, missing files count 0"""
+    units = set[str]()
+    for mk in makefiles:
+        try:
+            text = mk.read_text(errors="replace")
+        except OSError:
+            continue
+        for line in text.splitlines():
+            m = target_re.match(line)
+            if m:
+                units.add(f"{mk.parent}:{m.group(1)}")
+    return len(units)
+
+
+class ConfigureProgress:
+    """Shows the feature `configure` is currently probing"""
+
+    def __init__(self, ctx: Context, task, title: str):
+        self.ctx = ctx
+        self.task = task
+        self.title = title
+        self.checks = 0
+
+    def feed(self, line: str):
+        m = checking_re.match(line.strip())
+        if m is None:
+            return
+        self.checks += 1
+        self.ctx.progress.update(
+            self.task,
+            description=f"{self.title}: {m.group(1)[:40]} ({self.checks})")
+
+
+class MakeProgress:
+    """
+    Tracks compiled translation units in streamed `make` output
+
+    Compile times are estimated from when each unit's command shows up:
+     with `make -j N` a unit's slot is taken to be free again once
+     `N` more units have started. Good enough to tell cheap units
+     from expensive ones, not a profiler.
+    """
+
+    def __init__(self, ctx: Context, title: str, total: int, jobs: int):
+        self.ctx = ctx
+        self.title = title
+        self.total = total
+        self.jobs = max(jobs, 1)
+        self.task = ctx.progress.add_task(title, total=total or None)
+        self.started_at = time.monotonic()
+        self.starts = list[tuple[str, float]]()
+        self.durations = dict[str, float]()
+        self._lock = threading.Lock()
+
+    @property
+    def done(self) -> int:
+        return len(self.starts)
+
+    @property
+    def eta(self) -> float | None:
+        """Seconds until all units are compiled, `None` if unknown"""
+        if not self.done or self.done >= self.total:
+            return None
+        elapsed = time.monotonic() - self.started_at
+        return elapsed / self.done * (self.total - self.done)
+
+    def feed(self, line: str):
+        m = output_re.search(line)
+        if m is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self.starts.append((m.group(1), now))
+            if self.done > self.total:
+                # Makefiles generated mid-build may hold more units
+                self.total = self.done
+            last = None
+            if len(self.starts) > self.jobs:
+                unit, start = self.starts[-self.jobs - 1]
+                self.durations[unit] = now - start
+                last = (unit, now - start)
+
+        desc = f"{self.title} {self.done}/{self.total}"
+        if last is not None:
+            desc += f" {Path(last[0]).name} {last[1]:.1f}s"
+        eta = self.eta
+        if eta is not None:
+            desc += f" ETA {eta:.0f}s"
+        self.ctx.progress.update(
+            self.task, description=desc,
+            completed=self.done, total=self.total or None)
+
+    def slowest(self, n: int = 10) -> list[tuple[str, float]]:
+        return sorted(
+            self.durations.items(), key=lambda x: x[1], reverse=True)[:n]
+
+    def finish(self):
+        now = time.monotonic()
+        with self._lock:
+            # Units still in flight finished at most now
+            for unit, start in self.starts[-self.jobs:]:
+                self.durations.setdefault(unit, now - start)
+        elapsed = now - self.started_at
+        logger = self.ctx.logger
+        logger.info("%s: compiled %d units in %.1fs",
+                    self.title, self.done, elapsed)
+        self.ctx.metrics.incr("compile_seconds", elapsed)
+        self.ctx.metrics.incr("compiled_units", self.done)
+        for unit, dur in self.slowest():
+            logger.debug("%s: slow unit %s ~%.2fs", self.title, unit, dur)
+        self.ctx.progress.update(
+            self.task, description=self.title,
+            completed=self.done, total=self.done or 1)
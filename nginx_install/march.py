@@ -0,0 +1,222 @@
+"""
+CPU-target variants of the nginx binary
+
+With `core.march_variants`, nginx is built once per `-march` target
+ instead of for the build host only, and install picks the most specific
+ variant the host CPU can run, so the same artifacts serve a mixed fleet
+ without SIGILL. A short loopback bench of every variant the build host
+ runs shows whether the newer instructions actually pay off.
+"""
+from __future__ import annotations
+
+import re
+import time
+import random
+import socket
+import subprocess
+import http.client
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, NamedTuple
+
+_levels = [
+    ("x86-64", {"cmov", "cx8", "fpu", "fxsr", "mmx", "sse", "sse2"}),
+    ("x86-64-v2", {"cx16", "lahf_lm", "popcnt", "pni", "sse4_1", "sse4_2",
+                   "ssse3"}),
+    ("x86-64-v3", {"abm", "avx", "avx2", "bmi1", "bmi2", "f16c", "fma",
+                   "movbe", "xsave"}),
+    ("x86-64-v4", {"avx512bw", "avx512cd", "avx512dq", "avx512f",
+                   "avx512vl"}),
+]
+LEVELS = dict[str, frozenset[str]]()
+"""x86-64 psABI level -> `/proc/cpuinfo` flags it needs, cumulative"""
+for _name, _flags in _levels:
+    LEVELS[_name] = frozenset(_flags).union(*LEVELS.values())
+
+ELF_MAGIC = b"\x7fELF"
+march_re = re.compile(r"-march=\S+")
+macro_re = re.compile(r"^#define (__[A-Z0-9_]+__) 1$", re.M)
+
+
+def with_march(opts: Iterable[str], march: str) -> list[str]:
+    """`opts` with every `-march=` set to `march`, added if there is none"""
+    ret = [march_re.sub(f"-march={march}", o) for o in opts]
+    if not any(march_re.search(o) for o in ret):
+        ret.append(f"-march={march}")
+    return ret
+
+
+def host_flags(cpuinfo: Path = Path("/proc/cpuinfo")) -> frozenset[str]:
+    try:
+        text = cpuinfo.read_text()
+    except OSError:
+        return frozenset()
+    for line in text.splitlines():
+        key, _, value = line.partition(':')
+        if key.strip() == "flags":
+            return frozenset(value.split())
+    return frozenset()
+
+
+def target_features(march: str, cc: str = "cc") -> frozenset[str]:
+    """ISA macros such as `__AVX2__` that `cc` defines for `-march`"""
+    rs = subprocess.run(
+        [cc, f"-march={march}", "-dM", "-E", "-x", "c", "/dev/null"],
+        capture_output=True, text=True, check=True)
+    return frozenset(macro_re.findall(rs.stdout))
+
+
+def supports(march: str, flags: frozenset[str], cc: str = "cc") -> bool:
+    """
+    Whether the host runs code built for `march`
+
+    psABI levels are checked against `flags`, named targets such as
+     `skylake` by comparing their macros with `-march=native`'s.
+    """
+    if march in LEVELS:
+        return LEVELS[march] <= flags
+    try:
+        return target_features(march, cc) <= target_features("native", cc)
+    except (OSError, subprocess.CalledProcessError):
+        return False
+
+
+def staged_elf_files(root: Path) -> list[Path]:
+    """
+    Executables and shared objects a variant staged under `root`
+
+    Those are what the `-march` of a variant changes: nginx, dynamic
+     modules and for OpenResty LuaJIT and Lua C libraries. Symlinks to
+     them are left alone.
+    """
+    ret = list[Path]()
+    for p in sorted(root.rglob('*')):
+        if p.is_symlink() or not p.is_file():
+            continue
+        with open(p, "rb") as f:
+            if f.read(4) == ELF_MAGIC:
+                ret.append(p)
+    return ret
+
+
+def select(variants: list[str], flags: frozenset[str],
+           cc: str = "cc") -> str | None:
+    """The last of `variants` the host supports"""
+    for march in reversed(variants):
+        if supports(march, flags, cc):
+            return march
+    return None
+
+
+BENCH_CONF = """
+user root;
+worker_processes 1;
+pid nginx.pid;
+error_log error.log;
+events {{ worker_connections 64; }}
+http {{
+    access_log off;
+    gzip on;
+    gzip_comp_level 6;
+    gzip_min_length 0;
+    gzip_types *;
+    server {{
+        listen 127.0.0.1:{port};
+        root www;
+        location ~* ^/(?:static|assets)/([a-z0-9_-]+)\\.(?:txt|js)$ {{
+            try_files /body.txt =404;
+        }}
+    }}
+}}
+"""
+
+
+class Bench(NamedTuple):
+    march: str
+    requests: int
+    seconds: float
+
+    @property
+    def rps(self) -> float:
+        return self.requests / self.seconds if self.seconds else 0.0
+
+    def __str__(self) -> str:
+        return f"{self.march:12} {self.rps:9.1f} req/s"
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _body(size: int) -> str:
+    """Text that compresses like real markup, not like a repeated string"""
+    rng = random.Random(0)
+    words = [''.join(rng.choices("abcdefghijklmnopqrstuvwxyz", k=rng.randint(2, 9)))
+             for _ in range(2000)]
+    out = list[str]()
+    n = 0
+    while n < size:
+        w = rng.choice(words)
+        out.append(w)
+        n += len(w) + 1
+    return ' '.join(out)
+
+
+def _client(port: int, count: int) -> None:
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    try:
+        for i in range(count):
+            conn.request("GET", f"/static/file_{i % 50}.js",
+                         headers={"Accept-Encoding": "gzip"})
+            r = conn.getresponse()
+            r.read()
+            if r.status != 200:
+                raise RuntimeError(f"smoke bench got HTTP {r.status}")
+    finally:
+        conn.close()
+
+
+def smoke_bench(binary: Path, workdir: Path, march: str = '',
+                requests: int = 400, clients: int = 4) -> Bench:
+    """
+    Gzip a 256 KiB response behind a regex location with one worker
+
+    Both are CPU bound inside nginx and its libraries, which is where
+     the `-march` of a variant makes a difference.
+    """
+    workdir.mkdir(parents=True, exist_ok=True)
+    (workdir / "www").mkdir(exist_ok=True)
+    (workdir / "www" / "body.txt").write_text(_body(256 * 1024))
+    port = _free_port()
+    conf = workdir / "nginx.conf"
+    conf.write_text(BENCH_CONF.format(port=port))
+    proc = subprocess.Popen(
+        [str(binary), "-p", str(workdir), "-c", str(conf), "-e", "stderr",
+         "-g", "daemon off;"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    try:
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", port), 0.2).close()
+                break
+            except OSError:
+                if proc.poll() is not None or time.monotonic() > deadline:
+                    _, err = proc.communicate(timeout=5)
+                    raise RuntimeError(
+                        f"{binary} did not start: {err.decode().strip()}")
+                time.sleep(0.05)
+        _client(port, 20)  # warm up
+        per_client = requests // clients
+        start = time.perf_counter()
+        with ThreadPoolExecutor(clients) as pool:
+            list(pool.map(_client, [port] * clients, [per_client] * clients))
+        return Bench(march, per_client * clients, time.perf_counter() - start)
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
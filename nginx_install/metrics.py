@@ -0,0 +1,134 @@
+import os
+import json
+import time
+import platform
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Awaitable, TypeVar
+
+T = TypeVar("T")
+
+
+def _prom_escape(v: str) -> str:
+    return v.replace('\\', "\\\\").replace('"', '\\"').replace('\n', "\\n")
+
+
+class Metrics:
+    """
+    Structured measurements of a single run
+
+    Durations are in seconds. Counters may be bumped from
+     worker threads, e.g. by `Context.sync_run_cmd`.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.labels = dict[str, str](host=platform.node())
+        self.phases = dict[str, float]()
+        self.installers = dict[str, dict[str, float]]()
+        self.counters = dict[str, float]()
+        self.samples = list[dict[str, Any]]()
+        """Labelled values, e.g. per GeoIP2 edition sizes"""
+        self.outcome = "unknown"
+        self._lock = threading.Lock()
+
+    def incr(self, name: str, value: float = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set(self, name: str, value: float):
+        with self._lock:
+            self.counters[name] = value
+
+    def observe(self, name: str, value: float, **labels: str):
+        with self._lock:
+            self.samples.append({"name": name, "labels": labels, "value": value})
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0) + time.monotonic() - start
+
+    async def measure(self, installer: Any, phase: str, aw: Awaitable[T]) -> T:
+        """Await `aw`, recording its duration under `installer` and `phase`"""
+        start = time.monotonic()
+        try:
+            return await aw
+        finally:
+            key = getattr(installer, "classname", str(installer))
+            self.installers.setdefault(key, {})[phase] = time.monotonic() - start
+
+    def record(self) -> dict[str, Any]:
+        with self._lock:
+            counters = self.counters.copy()
+            samples = list(self.samples)
+        hits = counters.get("cache_hits", 0)
+        misses = counters.get("cache_misses", 0)
+        if hits + misses:
+            counters["cache_hit_ratio"] = hits / (hits + misses)
+        return {
+            "timestamp": self.started,
+            "duration": time.time() - self.started,
+            "outcome": self.outcome,
+            "labels": self.labels,
+            "phases": self.phases,
+            "installers": self.installers,
+            "counters": counters,
+            "samples": samples,
+        }
+
+    def write_jsonl(self, path: Path, record: dict[str, Any] | None = None):
+        record = self.record() if record is None else record
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, sort_keys=True) + '\n')
+
+    def write_prometheus(self, path: Path, record: dict[str, Any] | None = None):
+        """Write a node_exporter textfile collector file atomically"""
+        record = self.record() if record is None else record
+        base = ','.join(
+            f'{k}="{_prom_escape(str(v))}"' for k, v in record["labels"].items())
+        lines = list[str]()
+
+        def add(name: str, help_: str, samples: list[tuple[str, float]]):
+            lines.append(f"# HELP nginx_install_{name} {help_}")
+            lines.append(f"# TYPE nginx_install_{name} gauge")
+            for extra, value in samples:
+                labels = ','.join(filter(None, (base, extra)))
+                lines.append(f"nginx_install_{name}{{{labels}}} {value}")
+
+        add("last_run_timestamp_seconds", "Start time of the last run",
+            [('', record["timestamp"])])
+        add("last_run_duration_seconds", "Wall time of the last run",
+            [('', record["duration"])])
+        add("last_run_success", "Whether the last run succeeded",
+            [('', int(record["outcome"] == "success"))])
+        add("phase_duration_seconds", "Duration of each phase in the last run",
+            [(f'phase="{_prom_escape(p)}"', v)
+             for p, v in record["phases"].items()])
+        add("installer_duration_seconds",
+            "Duration of each installer stage in the last run",
+            [(f'installer="{_prom_escape(i)}",phase="{_prom_escape(p)}"', v)
+             for i, stages in record["installers"].items()
+             for p, v in stages.items()])
+        for name, value in sorted(record["counters"].items()):
+            add(name, f"{name.replace('_', ' ').capitalize()} in the last run",
+                [('', value)])
+        by_name = dict[str, list[tuple[str, float]]]()
+        for sample in record.get("samples", ()):
+            labels = ','.join(
+                f'{k}="{_prom_escape(str(v))}"'
+                for k, v in sample["labels"].items())
+            by_name.setdefault(sample["name"], []).append((labels, sample["value"]))
+        for name, samples in sorted(by_name.items()):
+            add(name, f"{name.replace('_', ' ').capitalize()} in the last run",
+                samples)
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}")
+        tmp.write_text('\n'.join(lines) + '\n', encoding="utf-8")
+        os.replace(tmp, path)
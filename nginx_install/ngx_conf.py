@@ -0,0 +1,515 @@
+"""
+Generate an `nginx.conf` tuned for the host and the configured build
+
+Every tuned directive is preceded by a comment explaining the value.
+"""
+from __future__ import annotations
+
+import os
+import sys
+import resource
+from typing import NamedTuple, TYPE_CHECKING
+from .plan import REPLACED_BY
+from .utils import MiB
+if TYPE_CHECKING:
+    from .config import Config
+
+COMPRESSIBLE_TYPES = (
+    "application/atom+xml application/javascript application/json "
+    "application/rss+xml application/vnd.ms-fontobject "
+    "application/x-font-opentype application/x-font-truetype "
+    "application/x-font-ttf application/x-javascript application/xhtml+xml "
+    "application/xml font/eot font/opentype font/otf font/truetype "
+    "image/svg+xml image/vnd.microsoft.icon image/x-icon image/x-win-bitmap "
+    "text/css text/javascript text/plain text/xml"
+).split()
+"""MIME types worth compressing, shared by `gzip_types` and `brotli_types`"""
+STATIC_TYPES = ("text/html", *COMPRESSIBLE_TYPES)
+"""Types to precompress: nginx always compresses `text/html` and warns
+if it is listed again, but `gzip_static` still needs the `.gz` on disk"""
+
+SSL_SESSIONS_PER_MIB = 4000
+"""nginx docs: one megabyte of `ssl_session_cache` stores about 4000 sessions"""
+CONN_MEMORY = 32 * 1024
+"""Rough worst-case memory of one busy connection with TLS and buffers"""
+
+
+def _read_int(path: str, default: int = 0) -> int:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return int(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return default
+
+
+class HostInfo(NamedTuple):
+    cpus: int
+    """CPUs this process may run on"""
+    cores: int
+    """Physical cores among them"""
+    packages: int
+    nofile_soft: int
+    nofile_hard: int
+    file_max: int
+    """`fs.file-max`"""
+    mem_total: int
+    """Bytes"""
+    nr_open: int = 1 << 20
+    """`fs.nr_open`, the most fds one process may be allowed"""
+
+    @classmethod
+    def detect(cls) -> HostInfo:
+        try:
+            cpu_ids = sorted(os.sched_getaffinity(0))
+        except AttributeError:
+            cpu_ids = list(range(os.cpu_count() or 1))
+
+        cores = set[tuple[int, int]]()
+        packages = set[int]()
+        for cpu in cpu_ids:
+            topo = f"/sys/devices/system/cpu/cpu{cpu}/topology"
+            pkg = _read_int(f"{topo}/physical_package_id")
+            packages.add(pkg)
+            cores.add((pkg, _read_int(f"{topo}/core_id", cpu)))
+
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        mem_total = 0
+        try:
+            with open("/proc/meminfo", encoding="utf-8") as f:
+                for line in f:
+                    if line.startswith("MemTotal:"):
+                        mem_total = int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            pass
+
+        return cls(
+            cpus=len(cpu_ids),
+            cores=len(cores) or len(cpu_ids),
+            packages=len(packages) or 1,
+            nofile_soft=soft,
+            nofile_hard=hard,
+            file_max=_read_int("/proc/sys/fs/file-max", 1 << 20),
+            mem_total=mem_total or 1024 * MiB,
+            nr_open=_read_int("/proc/sys/fs/nr_open", 1 << 20),
+        )
+
+
+class Tuning(NamedTuple):
+    worker_processes: int
+    worker_cpu_affinity: bool
+    worker_connections: int
+    worker_rlimit_nofile: int
+    ssl_session_cache: int
+    """MiB"""
+    backlog: int
+    why: dict[str, str]
+    """Directive -> explanation, emitted as comments"""
+
+    @property
+    def max_connections(self) -> int:
+        return self.worker_processes * self.worker_connections
+
+
+def tune(cfg: Config, host: HostInfo) -> Tuning:
+    conf = cfg.nginx_conf
+    why = dict[str, str]()
+
+    workers = conf.worker_processes or host.cpus
+    if conf.worker_processes:
+        why["worker_processes"] = "Set in config"
+    else:
+        why["worker_processes"] = (
+            f"One worker per usable CPU ({host.cpus}, {host.cores} physical "
+            f"cores in {host.packages} package(s))")
+
+    affinity = workers > 1 and workers == host.cpus
+    why["worker_cpu_affinity"] = (
+        "Pin each worker to its own CPU to keep caches warm"
+        + (", hyperthreads count as CPUs" if host.cpus > host.cores else ''))
+
+    if conf.worker_connections:
+        conns = conf.worker_connections
+        why["worker_connections"] = "Set in config"
+    else:
+        # Leave half of the system-wide fds to everything else and
+        # assume every connection may also hold an upstream fd
+        fd_budget = host.file_max // 2 // workers // 2
+        mem_budget = host.mem_total // workers // CONN_MEMORY
+        conns = min(fd_budget, mem_budget, 65535)
+        conns = max(conns // 1024 * 1024, 1024)
+        why["worker_connections"] = (
+            f"Per worker: min of fs.file-max budget ({fd_budget}), "
+            f"memory budget ({mem_budget} at ~{CONN_MEMORY // 1024}KiB each) "
+            "and 65535, rounded to 1024")
+
+    nofile = min(conns * 2, host.nr_open)
+    why["worker_rlimit_nofile"] = (
+        "Two fds per connection (client and upstream) within fs.nr_open, "
+        f"instead of the soft limit ({host.nofile_soft}); the master raises "
+        "it before workers drop privileges")
+    if nofile > host.nofile_hard:
+        why["worker_rlimit_nofile"] += (
+            f". Above the hard limit ({host.nofile_hard}), so only as root "
+            "or with the systemd unit's LimitNOFILE")
+
+    if conf.ssl_session_cache:
+        cache = conf.ssl_session_cache
+        why["ssl_session_cache"] = "Set in config"
+    else:
+        want = -(-workers * conns // SSL_SESSIONS_PER_MIB)
+        cap = max(10, host.mem_total // 100 // MiB)
+        cache = min(max(want, 10), cap)
+        why["ssl_session_cache"] = (
+            f"Room for every possible connection ({workers * conns}) at "
+            f"~{SSL_SESSIONS_PER_MIB} sessions per MiB, within 10MiB and 1% of RAM")
+
+    if conf.backlog:
+        backlog = conf.backlog
+        why["backlog"] = "Set in config"
+    else:
+        backlog = min(conns, 65535)
+        why["backlog"] = (
+            "A worker's worth of connections may wait to be "
+            "accepted, the kernel caps it at net.core.somaxconn")
+
+    return Tuning(workers, affinity, conns, nofile, cache, backlog, why)
+
+
+def _directive(name: str, value: object, why: str, indent: int) -> str:
+    pad = ' ' * indent
+    return f"{pad}# {why}\n{pad}{name} {value};\n"
+
+
+def _module_loading(cfg: Config) -> str:
+    ret = ''
+    for installer in cfg.installers:
+        if not installer.enabled:
+            continue
+        ngx_modulenames = getattr(installer, "ngx_modulenames", None)
+        if not (getattr(installer, "dynamic", False) and ngx_modulenames):
+            continue
+        if cfg.core.flavor == "openresty" and installer.classname in (
+                "HeadersMoreInstaller", "NginxDevKitInstaller"):
+            continue
+        for name in ngx_modulenames:
+            ret += f"load_module {cfg.core.modules_path.resolve() / name}.so;\n"
+    return ret
+
+
+def _aio(cfg: Config) -> str:
+    opts = cfg.core.configure_opts
+    if "--with-threads" in opts:
+        return _directive(
+            "aio", "threads",
+            "Built --with-threads: offload blocking disk reads to a thread "
+            "pool, works together with sendfile", 4)
+    if "--with-file-aio" in opts:
+        return (
+            _directive("aio", "on",
+                       "Built --with-file-aio: kernel AIO for large files", 4)
+            + _directive("directio", "8m",
+                         "Linux AIO only works with O_DIRECT reads", 4)
+        )
+    return ''
+
+
+def _installed(cfg: Config, classname: str) -> bool:
+    """Whether `classname` is enabled and not replaced by another installer"""
+    enabled = {i.classname for i in cfg.installers if i.enabled}
+    return classname in enabled and REPLACED_BY.get(classname) not in enabled
+
+
+def has_http3(cfg: Config) -> bool:
+    return (cfg.nginx_conf.http3
+            and "--with-http_v3_module" in cfg.core.configure_opts)
+
+
+def sysctls(cfg: Config, host: HostInfo | None = None) -> dict[str, int | str]:
+    """
+    Kernel settings the generated config relies on
+
+    Sizes and limits are minimums, `SysctlTuningInstaller` keeps a
+     current value that is already larger.
+    """
+    host = HostInfo.detect() if host is None else host
+    t = tune(cfg, host)
+    conf = cfg.nginx_conf
+    ret = dict[str, int | str]()
+    # The kernel silently caps listen backlogs at these
+    ret["net.core.somaxconn"] = t.backlog
+    ret["net.ipv4.tcp_max_syn_backlog"] = t.backlog
+    if conf.fastopen:
+        # Client and server
+        ret["net.ipv4.tcp_fastopen"] = 3
+    if has_http3(cfg):
+        # The kernel silently caps SO_RCVBUF/SO_SNDBUF at these
+        size = conf.udp_buffer_size
+        ret["net.core.rmem_max"] = size
+        ret["net.core.wmem_max"] = size
+    # Upstream connections each take an ephemeral port
+    ret["net.ipv4.ip_local_port_range"] = "1024 65535"
+    ports = sorted({p for p in (conf.http_port, conf.https_port) if p >= 1024})
+    if ports:
+        ret["net.ipv4.ip_local_reserved_ports"] = ','.join(map(str, ports))
+    # Every worker at worker_rlimit_nofile, with as much again for the rest
+    ret["fs.file-max"] = t.worker_processes * t.worker_rlimit_nofile * 2
+    return ret
+
+
+def sysctl_conf(cfg: Config, host: HostInfo | None = None) -> str:
+    """`/etc/sysctl.d` snippet of `sysctls`"""
+    return ''.join(f"{k} = {v}\n" for k, v in sysctls(cfg, host).items())
+
+
+def _http3(cfg: Config) -> tuple[str, str, str]:
+    """QUIC parts of the main context, http context and server block"""
+    conf = cfg.nginx_conf
+    if not has_http3(cfg):
+        return '', '', ''
+
+    main = ''
+    if conf.quic_bpf and sys.platform.startswith("linux"):
+        main = _directive(
+            "quic_bpf", "on",
+            "Steer QUIC packets to the worker owning the connection, "
+            "even after a reload", 0)
+
+    http = "\n    ##\n    # HTTP/3 Settings\n    ##\n\n"
+    http += _directive(
+        "quic_gso", "on" if conf.quic_gso else "off",
+        "Hand the kernel batches of UDP segments, fewer syscalls per packet"
+        if conf.quic_gso else "Set in config", 4)
+    http += _directive(
+        "quic_retry", "on" if conf.quic_retry else "off",
+        "Validate client addresses before handshakes, one more round trip"
+        if conf.quic_retry else
+        "Skip address validation, saves a round trip on every new connection", 4)
+    http += _directive(
+        "http3_stream_buffer_size", conf.http3_stream_buffer_size,
+        "Per stream read/write buffer, the 64k default limits throughput "
+        "on high bandwidth-delay paths", 4)
+    http += _directive(
+        "add_header", f"Alt-Svc 'h3=\":{conf.https_port}\"; "
+        f"ma={conf.alt_svc_max_age}' always",
+        "Advertise HTTP/3 so clients switch over on their next request", 4)
+
+    size = conf.udp_buffer_size
+    params = f"quic reuseport rcvbuf={size} sndbuf={size}"
+    server = (
+        "        # QUIC: reuseport keeps each client on one worker, socket buffers\n"
+        "        # absorb bursts and must stay within net.core.[rw]mem_max\n"
+        f"        listen {conf.https_port} {params};\n"
+        f"        listen [::]:{conf.https_port} {params};\n"
+    )
+    return main, http, server
+
+
+def generate(cfg: Config, host: HostInfo | None = None) -> str:
+    host = HostInfo.detect() if host is None else host
+    t = tune(cfg, host)
+    core = cfg.core
+    conf = cfg.nginx_conf
+    types = ' '.join(COMPRESSIBLE_TYPES)
+
+    main = _directive("worker_processes", t.worker_processes,
+                      t.why["worker_processes"], 0)
+    if t.worker_cpu_affinity:
+        main += _directive("worker_cpu_affinity", "auto",
+                           t.why["worker_cpu_affinity"], 0)
+    main += _directive("worker_rlimit_nofile", t.worker_rlimit_nofile,
+                       t.why["worker_rlimit_nofile"], 0)
+    quic_main, quic_http, quic_listen = _http3(cfg)
+    main += quic_main
+
+    events = _directive("worker_connections", t.worker_connections,
+                        t.why["worker_connections"], 4)
+    if sys.platform.startswith("linux"):
+        events += _directive("use", "epoll", "Best event method on Linux", 4)
+    events += _directive(
+        "multi_accept", "on", "Drain the accept queue in one go under bursts", 4)
+    events += _directive(
+        "accept_mutex", "off",
+        "With reuseport the kernel spreads connections, "
+        "a mutex would only add latency" if conf.reuseport else
+        "Let all workers accept, avoids latency spikes on busy hosts", 4)
+
+    reuseport = " reuseport" if conf.reuseport else ''
+    if conf.reuseport:
+        listen_why = "        # reuseport: one listen socket per worker, no thundering herd\n"
+    else:
+        listen_why = ''
+    listen_opts = f"{reuseport} backlog={t.backlog}"
+    listen_why += f"        # backlog: {t.why['backlog']}\n"
+    if conf.fastopen:
+        listen_opts += f" fastopen={conf.fastopen}"
+        listen_why += ("        # fastopen: repeat clients send the request "
+                       "in the SYN, saves a round trip\n")
+
+    ssl_cache = _directive(
+        "ssl_session_cache", f"shared:SSL:{t.ssl_session_cache}m",
+        t.why["ssl_session_cache"], 4)
+    dhparam = '' if conf.ssl_dhparam is None else f"    ssl_dhparam {conf.ssl_dhparam};\n"
+
+    ktls = ''
+    # BoringSSL and friends have no such option, `nginx -t` would fail
+    if _installed(cfg, "OpenSSLInstaller") and any(
+            i.classname == "OpenSSLInstaller" and getattr(i, "ktls", False)
+            for i in cfg.installers):
+        ktls = _directive(
+            "ssl_conf_command", "Options KTLS",
+            "OpenSSL built with enable-ktls: the kernel encrypts, "
+            "so sendfile also works for HTTPS", 4)
+
+    geoip2_cfg = ''
+    if _installed(cfg, "GeoIP2Installer"):
+        geoip2_cfg = GEOIP2_CFG
+    stub_status = ''
+    if conf.stub_status_path and \
+            "--with-http_stub_status_module" in core.configure_opts:
+        stub_status = STUB_STATUS_CFG.format(path=conf.stub_status_path)
+
+    brotli_cfg = ''
+    if _installed(cfg, "BrotliInstaller"):
+        brotli_cfg = BROTLI_CFG.format(types=types, conf=conf)
+
+    return TEMPLATE.format(
+        module_loading=_module_loading(cfg),
+        main=main,
+        events=events,
+        aio=_aio(cfg),
+        mime_types=core.config_prefix / "mime.types",
+        ssl_cache=ssl_cache,
+        dhparam=dhparam,
+        ktls=ktls,
+        http3=quic_http,
+        geoip2_cfg=geoip2_cfg,
+        access_log=core.http_log_path,
+        error_log=core.error_log_path,
+        types=types,
+        conf=conf,
+        brotli_cfg=brotli_cfg,
+        confd=core.config_prefix / "conf.d",
+        listen_why=listen_why,
+        listen_opts=listen_opts,
+        http_port=conf.http_port,
+        https_port=conf.https_port,
+        quic_listen=quic_listen,
+        stub_status=stub_status,
+        server_name=conf.server_name,
+        root=conf.root,
+        cert=conf.ssl_certificate,
+        key=conf.ssl_certificate_key,
+    )
+
+
+TEMPLATE = """
+{module_loading}
+{main}
+events {{
+{events}}}
+
+http {{
+
+    ##
+    # Basic Settings
+    ##
+
+    client_max_body_size 128m;
+    sendfile on;
+    tcp_nopush on;
+    tcp_nodelay on;
+    keepalive_timeout 65;
+    types_hash_max_size 2048;
+    server_tokens off;
+{aio}
+    # server_names_hash_bucket_size 64;
+    # server_name_in_redirect off;
+
+    include {mime_types};
+    default_type application/octet-stream;
+
+    ##
+    # SSL Settings
+    ##
+
+    ssl_protocols TLSv1.3 TLSv1.2;
+    # ssl_stapling on;
+    ssl_prefer_server_ciphers on;
+{dhparam}{ssl_cache}{ktls}    ssl_ciphers     HIGH:!aNULL:!eNULL:!EXPORT:!DES:!RC4:!MD5:!PSK:!aECDH:!EDH-DSS-DES-CBC3-SHA:!EDH-RSA-DES-CBC3-SHA:!KRB5-DES-CBC3-SHA;
+    add_header Strict-Transport-Security "max-age=63072000; includeSubdomains; preload";
+{http3}
+{geoip2_cfg}
+    ##
+    # Logging Settings
+    ##
+
+    access_log {access_log};
+    error_log {error_log};
+
+    ##
+    # Gzip Settings
+    ##
+    gzip on;
+    gzip_vary on;
+    gzip_proxied any;
+    gzip_comp_level {conf.gzip_comp_level};
+    gzip_min_length {conf.gzip_min_length};
+    gzip_buffers 16 16k;
+    gzip_http_version 1.1;
+    gzip_types {types};
+
+    #Brotli configs
+{brotli_cfg}
+    include {confd}/*.conf;
+    server {{
+{listen_why}        listen {http_port}{listen_opts};
+        listen [::]:{http_port}{listen_opts};
+        listen {https_port} ssl http2{listen_opts};
+        listen [::]:{https_port} ssl http2{listen_opts};
+{quic_listen}
+        server_name {server_name};
+        index index.html;
+        root {root};
+
+        ssl_certificate {cert};
+        # ssl_trusted_certificate {cert};
+        ssl_certificate_key {key};
+{stub_status}    }}
+}}
+"""
+
+GEOIP2_CFG = """
+    geoip2 /usr/local/share/GeoIP/GeoLite2-City.mmdb {
+        $geoip2_data_country_iso_code country iso_code;
+        $geoip2_data_continent_code   continent code;
+    }
+
+    map $geoip2_data_country_iso_code $allowed_country {
+        default yes;
+        CN yes;
+        HK yes;
+        TW yes;
+    }
+"""
+
+STUB_STATUS_CFG = """
+        # Connection and request counters for the install health gate
+        location = {path} {{
+            stub_status;
+            access_log off;
+            allow 127.0.0.1;
+            allow ::1;
+            deny all;
+        }}
+"""
+
+BROTLI_CFG = """
+    brotli_static on;
+    brotli on;
+    brotli_types {types};
+    brotli_buffers 32 16K;
+    brotli_comp_level {conf.brotli_comp_level};
+    brotli_window {conf.brotli_window};
+    brotli_min_length {conf.brotli_min_length};
+"""
@@ -0,0 +1,206 @@
+"""
+Compare the installed nginx with the config without building anything
+
+Used by the `plan` action and to short-circuit `install` when
+ the installed binary already matches, and so do the files `install`
+ generates besides it.
+"""
+from __future__ import annotations
+
+import re
+import shlex
+import subprocess
+from pathlib import Path
+from typing import NamedTuple, TYPE_CHECKING
+if TYPE_CHECKING:
+    from .config import Config
+
+version_re = re.compile(r"nginx version: (?:nginx|openresty)/(\S+)")
+exact_re = re.compile(r"^\d+\.\d+\.\d+(?:[.-]\d+)?$")
+path_suffix_re = re.compile(r"[-_]v?\d[\w.]*$")
+
+PATH_OPTS = (
+    "--add-module=",
+    "--add-dynamic-module=",
+    "--with-openssl=",
+    "--with-zlib=",
+    "--with-pcre=",
+)
+"""Options whose value is a source path, compared by directory name only,
+ version included unless the config leaves the version open"""
+VALUE_FREE_OPTS = ("--with-pcre-opt=",)
+"""Options compared by name only, `PCRE2Installer` copies `cc_opts` into it"""
+
+UNLISTED_OPTS = ("--with-luajit-xcflags=",)
+"""OpenResty `configure` options it consumes itself, absent from `nginx -V`"""
+
+REPLACED_BY = {
+    "OpenSSLInstaller": "TLSLibInstaller",
+    "ZlibCFInstaller": "ZlibNgInstaller",
+}
+"""Installers `NginxInstaller.prepare` disables when the other is enabled"""
+
+
+class Installed(NamedTuple):
+    version: str | None
+    configure_args: list[str]
+    modules: list[str]
+    """`*.so` names in `modules_path`"""
+
+
+class Change(NamedTuple):
+    sign: str
+    """`+` added, `-` removed, `~` changed"""
+    what: str
+
+    def __str__(self) -> str:
+        return f"  {self.sign} {self.what}"
+
+
+class Plan(NamedTuple):
+    changes: list[Change]
+    notes: list[str]
+    """Things that could not be compared, e.g. source patches"""
+
+
+def parse_nginx_v(text: str) -> tuple[str | None, list[str]]:
+    """Version and configure arguments from `nginx -V` output"""
+    version = None
+    args = list[str]()
+    for line in text.splitlines():
+        m = version_re.search(line)
+        if m:
+            version = m.group(1)
+        elif line.startswith("configure arguments:"):
+            args = shlex.split(line.partition(':')[2])
+    return version, args
+
+
+def read_installed(cfg: Config) -> Installed | None:
+    """Inspect the installed binary, `None` if there is none"""
+    core = cfg.core
+    if not core.sbin_path.exists():
+        return None
+    rs = subprocess.run(
+        [str(core.sbin_path), "-V"],
+        capture_output=True, text=True, timeout=10, check=False)
+    version, args = parse_nginx_v(rs.stderr + rs.stdout)
+    modules = []
+    if core.modules_path.is_dir():
+        modules = sorted(p.name for p in core.modules_path.glob("*.so"))
+    return Installed(version, args, modules)
+
+
+def normalize_opt(opt: str) -> str:
+    if opt.startswith(VALUE_FREE_OPTS):
+        return opt.partition('=')[0] + '='
+    if opt.startswith(PATH_OPTS):
+        name, _, value = opt.partition('=')
+        return f"{name}=.../{Path(value).name}"
+    return opt
+
+
+def unversioned(opt: str) -> str:
+    """A normalized path option without the version of its directory"""
+    return path_suffix_re.sub('', opt) if opt.startswith(PATH_OPTS) else opt
+
+
+async def wanted_version(cfg: Config) -> str:
+    """Resolve `core.nginx_version` the way `nginx -V` prints it"""
+    core = cfg.core
+    spec = core.nginx_version.strip()
+    if exact_re.match(spec):
+        return spec.replace('-', '.')
+
+    from .context import make_client
+    async with make_client(cfg) as client:
+        sheet = await core.get_versions(client)
+    return str(sheet.get_matching_version(spec)).replace('-', '.')
+
+
+def diff(cfg: Config, installed: Installed | None, version: str) -> Plan:
+    core = cfg.core
+    if core.march_variants:
+        from .march import host_flags, select
+        march = select(core.march_variants, host_flags())
+        if march is not None:
+            # Install put the variant for this CPU in place
+            core = core.for_march(march)
+    if installed is None:
+        return Plan([Change('+', f"nginx {version} at {core.sbin_path}")], [])
+
+    changes = list[Change]()
+    notes = list[str]()
+    if installed.version != version:
+        changes.append(Change('~', f"version {installed.version} -> {version}"))
+
+    enabled = {i.classname for i in cfg.installers if i.enabled}
+    installers = [i for i in cfg.installers
+                  if REPLACED_BY.get(i.classname) not in enabled]
+    extra_cc = list[str]()
+    extra_ld = list[str]()
+    for i in installers:
+        if i.enabled:
+            extra_cc.extend(i.expected_cc_opts())
+            extra_ld.extend(i.expected_ld_opts())
+    wanted = list(core.model_copy(update={
+        "cc_opts": [*core.cc_opts, *extra_cc],
+        "ld_opts": [*core.ld_opts, *extra_ld],
+    }).build_options)
+    known = set[str]()
+    known_so = set[str]()
+    wanted_so = set[str]()
+    for i in installers:
+        opts = i.expected_opts()
+        names = getattr(i, "ngx_modulenames", ())
+        known.update(normalize_opt(o) for o in opts or ())
+        known_so.update(f"{n}.so" for n in names)
+        if not i.enabled:
+            continue
+        if opts is None:
+            notes.append(f"{i} changes can't be verified from nginx -V")
+            continue
+        wanted.extend(opts)
+        if getattr(i, "dynamic", False):
+            wanted_so.update(f"{n}.so" for n in names)
+
+    if any(o.startswith(UNLISTED_OPTS) for o in wanted):
+        notes.append("LuaJIT build flags can't be verified from nginx -V")
+    want = {normalize_opt(o) for o in wanted if not o.startswith(UNLISTED_OPTS)}
+    # E.g. `--with-openssl=.../openssl` for the `latest` release matches
+    # whatever version was built
+    any_version = {o for o in want if o.startswith(PATH_OPTS) and unversioned(o) == o}
+    have = {normalize_opt(o) for o in installed.configure_args}
+    have = {unversioned(o) if unversioned(o) in any_version else o for o in have}
+    for opt in sorted(want - have):
+        changes.append(Change('+', opt))
+    for opt in sorted(have - want):
+        if core.flavor == "openresty" and (
+            # OpenResty adds its bundled modules and compiler flags itself
+            opt.startswith(("--with-cc-opt=", "--with-ld-opt="))
+            or (opt.startswith(PATH_OPTS) and opt not in known)
+        ):
+            continue
+        changes.append(Change('-', opt))
+
+    modules = set(installed.modules)
+    for so in sorted(wanted_so - modules):
+        changes.append(Change('+', f"module {so}"))
+    for so in sorted((modules & known_so) - wanted_so):
+        changes.append(Change('-', f"module {so}"))
+
+    return Plan(changes, notes)
+
+
+def drift(cfg: Config) -> list[Change]:
+    """What else `install` would change, see `BaseInstaller.drift`"""
+    enabled = {i.classname for i in cfg.installers if i.enabled}
+    installers = [cfg.core, *(
+        i for i in cfg.installers
+        if i.enabled and REPLACED_BY.get(i.classname) not in enabled)]
+    return [Change('~', what) for i in installers for what in i.drift(cfg)]
+
+
+async def make_plan(cfg: Config) -> Plan:
+    plan = diff(cfg, read_installed(cfg), await wanted_version(cfg))
+    return Plan([*plan.changes, *drift(cfg)], plan.notes)
@@ -0,0 +1,191 @@
+"""
+Write `.gz` and `.br` siblings for `gzip_static` and `brotli_static`
+
+Files are compressed in a process pool. An mtime/size index per web root
+ lets reruns skip files compressed before with the same levels, whose
+ outputs are still there, and remove outputs of deleted ones.
+"""
+from __future__ import annotations
+
+import os
+import gzip
+import hashlib
+import logging
+import mimetypes
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple, TYPE_CHECKING
+from .ngx_conf import STATIC_TYPES
+from .utils import FileIndex
+if TYPE_CHECKING:
+    from .config import Config
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+SUFFIXES = (".gz", ".br")
+_types = frozenset(STATIC_TYPES)
+
+
+class Stats(NamedTuple):
+    scanned: int = 0
+    compressed: int = 0
+    unchanged: int = 0
+    not_smaller: int = 0
+    removed: int = 0
+    bytes_in: int = 0
+    bytes_out: int = 0
+
+    def __add__(self, other):  # type: ignore[override]
+        return Stats(*(a + b for a, b in zip(self, other)))
+
+    def __str__(self) -> str:
+        return (
+            f"{self.scanned} eligible files: {self.compressed} compressed, "
+            f"{self.unchanged} unchanged, {self.not_smaller} not worth it, "
+            f"{self.removed} stale outputs removed, "
+            f"{self.bytes_in} bytes read, {self.bytes_out} written")
+
+
+def eligible(path: Path, min_size: int) -> bool:
+    if path.name.endswith(SUFFIXES) or path.name.startswith('.'):
+        return False
+    mime, encoding = mimetypes.guess_type(path.name, strict=False)
+    if encoding is not None or mime not in _types:
+        return False
+    try:
+        return path.stat().st_size >= min_size
+    except OSError:
+        return False
+
+
+def _write_atomic(dest: Path, data: bytes, src_st: os.stat_result):
+    tmp = dest.with_name(f".{dest.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.chmod(tmp, src_st.st_mode & 0o777)
+        # Same mtime as the source, so a stale sibling is easy to spot
+        os.utime(tmp, ns=(src_st.st_atime_ns, src_st.st_mtime_ns))
+        os.replace(tmp, dest)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+
+def compress_file(src: str, gzip_level: int,
+                  brotli_level: int | None) -> tuple[str, int, int, int, int]:
+    """
+    Compress one file, runs in a pool worker
+
+    Returns `(src, input size, bytes written, outputs skipped, written)`,
+     the last a bitmask of `SUFFIXES`. An output that would not be smaller
+     than `src` is removed instead of written.
+    """
+    path = Path(src)
+    st = path.stat()
+    data = path.read_bytes()
+    outputs = [(0, lambda: gzip.compress(data, gzip_level, mtime=0))]
+    if brotli is not None and brotli_level is not None:
+        outputs.append((1, lambda: brotli.compress(data, quality=brotli_level)))
+
+    written = skipped = mask = 0
+    for i, compress in outputs:
+        dest = path.with_name(path.name + SUFFIXES[i])
+        out = compress()
+        if len(out) >= len(data):
+            dest.unlink(missing_ok=True)
+            skipped += 1
+            continue
+        _write_atomic(dest, out, st)
+        written += len(out)
+        mask |= 1 << i
+    return src, len(data), written, skipped, mask
+
+
+def _outputs_exist(path: Path, mask: int) -> bool:
+    """Whether the outputs in the `compress_file` bitmask are still there"""
+    return all(path.with_name(path.name + suffix).is_file()
+               for i, suffix in enumerate(SUFFIXES) if mask & (1 << i))
+
+
+def index_path(cfg: Config, root: Path) -> Path:
+    digest = hashlib.sha256(str(root.resolve()).encode()).hexdigest()[:16]
+    return cfg.cache.dir / "precompress" / f"{digest}.json"
+
+
+def precompress_root(cfg: Config, root: Path, pool: ProcessPoolExecutor | None,
+                     dry_run: bool = False,
+                     logger: logging.Logger | None = None) -> Stats:
+    logger = logger or logging.getLogger(__name__)
+    pc = cfg.precompress
+    index = FileIndex(index_path(cfg, root))
+    brotli_level = pc.brotli_level if brotli is not None else None
+    # Indexed with each file, a change of either compresses it again
+    settings = (pc.gzip_level, -1 if brotli_level is None else brotli_level)
+
+    seen = set[str]()
+    todo = list[str]()
+    unchanged = 0
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            path = Path(dirpath) / name
+            if not eligible(path, pc.min_size):
+                continue
+            rel = str(path.relative_to(root))
+            seen.add(rel)
+            if index.changed(rel, path.stat(), *settings) \
+                    or not _outputs_exist(path, index.entries[rel][-1]):
+                todo.append(str(path))
+            else:
+                unchanged += 1
+
+    removed = 0
+    for rel in index.prune(seen):
+        for suffix in SUFFIXES:
+            out = root / (rel + suffix)
+            if out.exists():
+                logger.debug("Removing stale %s", out)
+                if not dry_run:
+                    out.unlink()
+                removed += 1
+
+    stats = Stats(scanned=len(seen), unchanged=unchanged, removed=removed)
+    if dry_run:
+        for src in todo:
+            logger.info("Would compress %s", src)
+        return stats
+
+    args = (todo, [pc.gzip_level] * len(todo), [brotli_level] * len(todo))
+    results = pool.map(compress_file, *args, chunksize=16) if pool \
+        else map(compress_file, *args)
+    for src, size, written, skipped, mask in results:
+        rel = str(Path(src).relative_to(root))
+        index.update(rel, Path(src).stat(), *settings, mask)
+        stats += Stats(compressed=1 if written else 0,
+                       not_smaller=1 if skipped else 0,
+                       bytes_in=size, bytes_out=written)
+    index.save()
+    return stats
+
+
+def precompress(cfg: Config, dry_run: bool = False,
+                logger: logging.Logger | None = None) -> Stats:
+    """Precompress every configured web root"""
+    logger = logger or logging.getLogger(__name__)
+    pc = cfg.precompress
+    roots = pc.roots or [cfg.nginx_conf.root]
+    if brotli is None:
+        logger.warning(
+            "Python module `brotli` not found, only writing .gz files")
+
+    stats = Stats()
+    with ProcessPoolExecutor(pc.jobs) as pool:
+        for root in roots:
+            if not root.is_dir():
+                logger.warning("Web root %s does not exist", root)
+                continue
+            stats += precompress_root(cfg, root, pool, dry_run, logger)
+    return stats
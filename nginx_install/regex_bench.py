@@ -0,0 +1,216 @@
+"""
+Replay the regexes of an nginx config against request URIs with PCRE2
+
+Regexes from `location ~`, `map`, `if`, `rewrite` and `server_name` are
+ matched against every URI, interpreted and JIT compiled, through the
+ same `libpcre2-8` API nginx uses. Times include the `ctypes` call
+ overhead, so the JIT speedup they show is a lower bound.
+"""
+from __future__ import annotations
+
+import re
+import time
+import ctypes
+import ctypes.util
+from glob import glob
+from pathlib import Path
+from typing import Iterator, NamedTuple
+
+PCRE2_CASELESS = 0x00000008
+PCRE2_JIT_COMPLETE = 0x00000001
+request_re = re.compile(r'"[A-Z]+ (\S+) HTTP/[\d.]+"')
+
+
+class Regex(NamedTuple):
+    pattern: str
+    caseless: bool
+    where: str
+    """`file:line` it was found at"""
+
+
+class Result(NamedTuple):
+    regex: Regex
+    matches: int
+    interp_seconds: float
+    jit_seconds: float | None
+    """`None` if the library was built without JIT"""
+
+    def __str__(self) -> str:
+        jit = "no JIT" if self.jit_seconds is None else \
+            f"{self.interp_seconds / self.jit_seconds:5.1f}x JIT"
+        flag = "~*" if self.regex.caseless else "~ "
+        return (f"{self.interp_seconds * 1000:9.2f} ms {jit} "
+                f"{self.matches:7} hits  {flag} {self.regex.pattern}  "
+                f"({self.regex.where})")
+
+
+def _tokens(text: str) -> Iterator[tuple[str, int]]:
+    """nginx config tokens with their line numbers, quotes removed"""
+    i, line, n = 0, 1, len(text)
+    while i < n:
+        c = text[i]
+        if c == '\n':
+            line += 1
+            i += 1
+        elif c.isspace():
+            i += 1
+        elif c == '#':
+            while i < n and text[i] != '\n':
+                i += 1
+        elif c in "{};":
+            yield c, line
+            i += 1
+        elif c in "\"'":
+            j = i + 1
+            while j < n and text[j] != c:
+                j += 2 if text[j] == '\\' else 1
+            yield text[i + 1:j], line
+            line += text.count('\n', i, j)
+            i = j + 1
+        else:
+            j = i
+            while j < n and not text[j].isspace() and text[j] not in "{};\"'":
+                j += 1
+            yield text[i:j], line
+            i = j
+
+
+def extract(conf: Path, _seen: set[Path] | None = None) -> list[Regex]:
+    """Regexes in `conf` and the files it includes"""
+    seen = set[Path]() if _seen is None else _seen
+    conf = conf.resolve()
+    if conf in seen or not conf.is_file():
+        return []
+    seen.add(conf)
+
+    ret = list[Regex]()
+    blocks = list[str]()
+    stmt = list[str]()
+    stmt_line = 0
+    for tok, line in _tokens(conf.read_text(errors="replace")):
+        if tok not in ('{', '}', ';'):
+            if not stmt:
+                stmt_line = line
+            stmt.append(tok)
+            continue
+        where = f"{conf}:{stmt_line}"
+        if stmt:
+            name, args = stmt[0], stmt[1:]
+            if name == "location" and len(args) >= 2 and args[0] in ("~", "~*"):
+                ret.append(Regex(args[1], args[0] == "~*", where))
+            elif name == "rewrite" and args:
+                ret.append(Regex(args[0], False, where))
+            elif name == "server_name":
+                ret.extend(Regex(a[1:], False, where)
+                           for a in args if a.startswith('~'))
+            elif name == "if":
+                for op, arg in zip(args, args[1:]):
+                    if op.lstrip('!') in ("~", "~*"):
+                        ret.append(Regex(
+                            arg.removesuffix(')'), op.endswith('*'), where))
+            elif blocks and blocks[-1] == "map" and name.startswith('~'):
+                caseless = name.startswith("~*")
+                ret.append(Regex(name[2 if caseless else 1:], caseless, where))
+            elif name == "include" and args:
+                pattern = args[0] if Path(args[0]).is_absolute() \
+                    else str(conf.parent / args[0])
+                for inc in sorted(glob(pattern)):
+                    ret.extend(extract(Path(inc), seen))
+        if tok == '{':
+            blocks.append(stmt[0] if stmt else '')
+        elif tok == '}' and blocks:
+            blocks.pop()
+        stmt = []
+    return ret
+
+
+def load_uris(path: Path) -> list[bytes]:
+    """URIs, one per line or as requests in an access log"""
+    uris = list[bytes]()
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            m = request_re.search(line)
+            uri = m.group(1) if m else line.strip()
+            if uri:
+                uris.append(uri.encode())
+    return uris
+
+
+class PCRE2:
+    """The few `libpcre2-8` calls nginx makes"""
+
+    def __init__(self, lib: str | Path | None = None):
+        lib = lib or ctypes.util.find_library("pcre2-8")
+        if lib is None:
+            raise FileNotFoundError("libpcre2-8 not found")
+        self.lib = ctypes.CDLL(str(lib))
+        L = self.lib
+        L.pcre2_compile_8.restype = ctypes.c_void_p
+        L.pcre2_compile_8.argtypes = [
+            ctypes.c_char_p, ctypes.c_size_t, ctypes.c_uint32,
+            ctypes.POINTER(ctypes.c_int), ctypes.POINTER(ctypes.c_size_t),
+            ctypes.c_void_p]
+        L.pcre2_jit_compile_8.argtypes = [ctypes.c_void_p, ctypes.c_uint32]
+        L.pcre2_match_data_create_from_pattern_8.restype = ctypes.c_void_p
+        L.pcre2_match_data_create_from_pattern_8.argtypes = [
+            ctypes.c_void_p, ctypes.c_void_p]
+        L.pcre2_match_8.argtypes = [
+            ctypes.c_void_p, ctypes.c_char_p, ctypes.c_size_t, ctypes.c_size_t,
+            ctypes.c_uint32, ctypes.c_void_p, ctypes.c_void_p]
+        L.pcre2_code_free_8.argtypes = [ctypes.c_void_p]
+        L.pcre2_match_data_free_8.argtypes = [ctypes.c_void_p]
+
+    def compile(self, regex: Regex) -> int:
+        err = ctypes.c_int()
+        offset = ctypes.c_size_t()
+        pat = regex.pattern.encode()
+        code = self.lib.pcre2_compile_8(
+            pat, len(pat), PCRE2_CASELESS if regex.caseless else 0,
+            ctypes.byref(err), ctypes.byref(offset), None)
+        if not code:
+            raise ValueError(
+                f"{regex.where}: bad regex {regex.pattern!r} at {offset.value}")
+        return code
+
+    def time_matches(self, code: int, uris: list[bytes]) -> tuple[int, float]:
+        """Hits and seconds to match every URI once"""
+        L = self.lib
+        md = L.pcre2_match_data_create_from_pattern_8(code, None)
+        match = L.pcre2_match_8
+        try:
+            hits = 0
+            start = time.perf_counter()
+            for u in uris:
+                if match(code, u, len(u), 0, 0, md, None) >= 0:
+                    hits += 1
+            return hits, time.perf_counter() - start
+        finally:
+            L.pcre2_match_data_free_8(md)
+
+    def run(self, regexes: list[Regex], uris: list[bytes]) -> list[Result]:
+        results = list[Result]()
+        for regex in regexes:
+            code = self.compile(regex)
+            try:
+                hits, interp = self.time_matches(code, uris)
+                jit = None
+                if self.lib.pcre2_jit_compile_8(code, PCRE2_JIT_COMPLETE) == 0:
+                    jit = self.time_matches(code, uris)[1]
+            finally:
+                self.lib.pcre2_code_free_8(code)
+            results.append(Result(regex, hits, interp, jit))
+        return results
+
+
+def summary(results: list[Result], uris: list[bytes]) -> list[str]:
+    matches = len(results) * len(uris)
+    interp = sum(r.interp_seconds for r in results)
+    ret = [f"{len(results)} regexes x {len(uris)} URIs: "
+           f"{matches / interp:,.0f} matches/s interpreted"]
+    if all(r.jit_seconds is not None for r in results) and results:
+        jit = sum(r.jit_seconds or 0 for r in results)
+        ret.append(f"{matches / jit:,.0f} matches/s with JIT "
+                   f"({interp / jit:.1f}x)")
+    else:
+        ret.append("libpcre2-8 was built without JIT")
+    return ret
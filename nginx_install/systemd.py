@@ -0,0 +1,153 @@
+"""
+Generate the systemd unit of nginx, tuned for the generated config
+
+The `[Service]` limits follow `ngx_conf.tune`, so workers can open as
+ many fds as `worker_connections` needs. By default they go to a drop-in
+ next to the unit instead of the unit itself. As in `nginx.conf`, every
+ setting is preceded by a comment explaining the value.
+"""
+from __future__ import annotations
+
+from pathlib import Path
+from typing import NamedTuple, TYPE_CHECKING
+from .ngx_conf import HostInfo, has_http3, tune
+if TYPE_CHECKING:
+    from .config import Config
+
+UNIT_NAME = "nginx.service"
+DROPIN_NAME = "50-nginx-install.conf"
+FD_HEADROOM = 1024
+"""fds beyond connections: logs, listen sockets, cache and temp files"""
+AIO_THREADS = 32
+"""Threads of nginx's default `thread_pool`, one pool per worker"""
+
+
+class Setting(NamedTuple):
+    name: str
+    value: object
+    why: str
+
+    def __str__(self) -> str:
+        return f"# {self.why}\n{self.name}={self.value}\n"
+
+
+def settings(cfg: Config, host: HostInfo) -> list[Setting]:
+    """`[Service]` settings from `cfg.systemd` and the host"""
+    sd = cfg.systemd
+    t = tune(cfg, host)
+    ret = list[Setting]()
+
+    if sd.limit_nofile:
+        ret.append(Setting("LimitNOFILE", sd.limit_nofile, "Set in config"))
+    else:
+        nofile = min(t.worker_rlimit_nofile + FD_HEADROOM, host.nr_open)
+        total = t.worker_processes * t.worker_rlimit_nofile
+        ret.append(Setting(
+            "LimitNOFILE", nofile,
+            f"worker_rlimit_nofile ({t.worker_rlimit_nofile}) plus "
+            f"{FD_HEADROOM} for logs and listeners, within fs.nr_open; "
+            f"{t.worker_processes} worker(s) may hold {total} fds in all"))
+
+    memlock = sd.limit_memlock
+    if memlock is None and cfg.nginx_conf.quic_bpf and has_http3(cfg):
+        ret.append(Setting("LimitMEMLOCK", "infinity",
+                           "quic_bpf: BPF maps count as locked memory"))
+    elif memlock is not None:
+        ret.append(Setting("LimitMEMLOCK", memlock, "Set in config"))
+
+    if sd.tasks_max is not None:
+        ret.append(Setting("TasksMax", sd.tasks_max, "Set in config"))
+    else:
+        threads = AIO_THREADS if "--with-threads" in cfg.core.configure_opts else 0
+        ret.append(Setting(
+            "TasksMax", t.worker_processes * (threads + 1) + 8,
+            f"{t.worker_processes} worker(s)"
+            + (f" with {threads} aio threads each" if threads else '')
+            + ", the master, cache manager and loader, and spares"))
+
+    for name, value in (
+        ("CPUAffinity", sd.cpu_affinity),
+        ("Nice", sd.nice),
+        ("IOSchedulingClass", sd.io_scheduling_class),
+        ("IOSchedulingPriority", sd.io_scheduling_priority),
+    ):
+        if value is not None:
+            ret.append(Setting(name, value, "Set in config"))
+    if sd.oom_score_adjust is not None:
+        ret.append(Setting(
+            "OOMScoreAdjust", sd.oom_score_adjust,
+            "Have the OOM killer pick other processes first"))
+    ret.extend(Setting(k, v, "Set in config") for k, v in sd.extra.items())
+    return ret
+
+
+def dropin(cfg: Config, host: HostInfo | None = None) -> str:
+    host = HostInfo.detect() if host is None else host
+    return ("# Generated by nginx_install from its `systemd` config\n"
+            "[Service]\n" + ''.join(map(str, settings(cfg, host))))
+
+
+def unit(cfg: Config, host: HostInfo | None = None) -> str:
+    """`NginxInstaller.get_init_script` with the settings in `[Service]`"""
+    host = HostInfo.detect() if host is None else host
+    base = cfg.core.get_init_script()
+    tuned = ''.join(map(str, settings(cfg, host)))
+    return base.replace("\n[Install]", f"{tuned}\n[Install]", 1)
+
+
+def paths(cfg: Config) -> tuple[Path, Path]:
+    """The unit and the drop-in"""
+    d = cfg.systemd.unit_dir
+    return d / UNIT_NAME, d / f"{UNIT_NAME}.d" / DROPIN_NAME
+
+
+def problems(cfg: Config, verify_output: str) -> list[str]:
+    """
+    Lines of `systemd-analyze verify` about the unit or the drop-in
+
+    Settings that fail to parse are only warned about and ignored,
+     the exit status stays 0.
+    """
+    ours = tuple(str(p) for p in paths(cfg))
+    return [line for line in verify_output.splitlines()
+            if line.startswith(ours)]
+
+
+def _read(path: Path) -> str | None:
+    try:
+        return path.read_text()
+    except OSError:
+        return None
+
+
+def stale(cfg: Config, host: HostInfo | None = None) -> list[Path]:
+    """The files `write` would change, for `plan`"""
+    unit_path, dropin_path = paths(cfg)
+    if cfg.systemd.dropin:
+        ret = [] if unit_path.exists() else [unit_path]
+        if _read(dropin_path) != dropin(cfg, host):
+            ret.append(dropin_path)
+        return ret
+    ret = [] if _read(unit_path) == unit(cfg, host) else [unit_path]
+    if dropin_path.exists():
+        ret.append(dropin_path)
+    return ret
+
+
+def write(cfg: Config, host: HostInfo | None = None) -> list[Path]:
+    """Write the unit, or the drop-in and a missing unit; return them"""
+    unit_path, dropin_path = paths(cfg)
+    written = list[Path]()
+    if cfg.systemd.dropin:
+        if not unit_path.exists():
+            unit_path.write_text(cfg.core.get_init_script())
+            written.append(unit_path)
+        dropin_path.parent.mkdir(parents=True, exist_ok=True)
+        dropin_path.write_text(dropin(cfg, host))
+        written.append(dropin_path)
+    else:
+        unit_path.write_text(unit(cfg, host))
+        # A stale drop-in would override the settings just written
+        dropin_path.unlink(missing_ok=True)
+        written.append(unit_path)
+    return written
@@ -1,11 +1,98 @@
-import yaml
-from pydantic import BaseModel
+from __future__ import annotations
+
+import os
+import json
+from pathlib import Path
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from pydantic import BaseModel
+
+MiB = 1 << 20
 
 
 def model_dump_yaml(m: BaseModel) -> str:
+    import yaml
     return yaml.dump(
         m.model_dump(mode="json"),
         allow_unicode=True,
         default_flow_style=False,
         sort_keys=False,
     )
+
+
+class FileIndex:
+    """
+    JSON index of `(mtime_ns, size)` per relative path
+
+    Lets incremental jobs skip files that have not changed since the last
+    run. Saved atomically, a missing or corrupt index counts as empty.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.entries = dict[str, list[int]]()
+        try:
+            self.entries = json.loads(path.read_text())
+        except (OSError, ValueError):
+            pass
+
+    @staticmethod
+    def _stamp(st: os.stat_result) -> list[int]:
+        return [st.st_mtime_ns, st.st_size]
+
+    def changed(self, rel: str, st: os.stat_result, *extra: int) -> bool:
+        """Whether `rel` or the `extra` values it was indexed with changed"""
+        want = [*self._stamp(st), *extra]
+        return self.entries.get(rel, [])[:len(want)] != want
+
+    def update(self, rel: str, st: os.stat_result, *extra: int):
+        """Index `rel`, with `extra` values such as the settings used"""
+        self.entries[rel] = [*self._stamp(st), *extra]
+
+    def prune(self, keep: set[str]) -> list[str]:
+        """Drop entries not in `keep`, return them"""
+        gone = [rel for rel in self.entries if rel not in keep]
+        for rel in gone:
+            del self.entries[rel]
+        return gone
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(f".{self.path.name}.{os.getpid()}")
+        tmp.write_text(json.dumps(self.entries, separators=(',', ':')))
+        os.replace(tmp, self.path)
+
+
+def replace_atomic(src: Path, dest: Path, mode: int = 0o644):
+    """
+    Copy `src` over `dest` so readers see either the old or the new file
+
+    The copy goes to a temp file next to `dest`, is fsynced and renamed
+     into place, then the directory entry is fsynced too.
+    """
+    import shutil
+    tmp = dest.with_name(f".{dest.name}.{os.getpid()}.tmp")
+    try:
+        with open(src, "rb") as fi, open(tmp, "wb") as fo:
+            shutil.copyfileobj(fi, fo, 1 << 20)
+            fo.flush()
+            os.fsync(fo.fileno())
+        os.chmod(tmp, mode)
+        os.replace(tmp, dest)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    fd = os.open(dest.parent, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def md5_file(path: Path) -> str:
+    import hashlib
+    h = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
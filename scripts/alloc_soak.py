@@ -0,0 +1,148 @@
+"""
+Soak nginx builds on loopback and compare worker RSS growth and latency
+
+Meant for builds differing only in `AllocatorInstaller` (or its absence,
+ i.e. glibc malloc). Each build serves random-size files through gzip and
+ a proxy hop with large `proxy_buffers`, the allocation patterns that
+ fragment long-lived workers.
+
+    python alloc_soak.py glibc=/opt/a/nginx jemalloc=/opt/b/nginx --minutes 10
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import signal
+import argparse
+import statistics
+import subprocess
+import tempfile
+import http.client
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+CONF = """
+worker_processes {workers};
+pid {prefix}/nginx.pid;
+error_log {prefix}/error.log;
+events {{ worker_connections 4096; }}
+http {{
+    access_log off;
+    gzip on;
+    gzip_comp_level 6;
+    gzip_min_length 0;
+    gzip_types *;
+    server {{
+        listen 127.0.0.1:{backend};
+        root {prefix}/www;
+    }}
+    server {{
+        listen 127.0.0.1:{port};
+        location / {{
+            proxy_pass http://127.0.0.1:{backend};
+            proxy_http_version 1.1;
+            proxy_set_header Connection "";
+            proxy_buffers 64 64k;
+            proxy_busy_buffers_size 512k;
+        }}
+    }}
+}}
+"""
+FILES = 200
+
+
+def worker_rss(master: int) -> int:
+    """Total RSS of `master`'s children in KiB"""
+    total = 0
+    children = Path(f"/proc/{master}/task/{master}/children").read_text().split()
+    for pid in children:
+        try:
+            for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+                if line.startswith("VmRSS:"):
+                    total += int(line.split()[1])
+        except OSError:
+            pass
+    return total
+
+
+def client(port: int, deadline: float, seed: int) -> list[float]:
+    """Request random files until `deadline`, return latencies in seconds"""
+    rng = random.Random(seed)
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    latencies = list[float]()
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        conn.request("GET", f"/{rng.randrange(FILES)}",
+                     headers={"Accept-Encoding": "gzip"})
+        conn.getresponse().read()
+        latencies.append(time.perf_counter() - start)
+    conn.close()
+    return latencies
+
+
+def soak(name: str, nginx: str, args) -> tuple[int, int, list[float]]:
+    prefix = Path(tempfile.mkdtemp(prefix=f"soak_{name}_"))
+    try:
+        www = prefix / "www"
+        www.mkdir()
+        rng = random.Random(0)
+        for i in range(FILES):
+            # Mixed sizes up to ~300KiB, compressible but not trivially
+            words = [rng.choice(("alpha", "beta", "gamma", str(i)))
+                     for _ in range(rng.randrange(10, 50_000))]
+            (www / str(i)).write_text(' '.join(words))
+        conf = prefix / "nginx.conf"
+        conf.write_text(CONF.format(
+            prefix=prefix, workers=args.workers,
+            port=args.port, backend=args.port + 1))
+        subprocess.run([nginx, "-p", str(prefix), "-c", str(conf)], check=True)
+        time.sleep(0.5)
+        master = int((prefix / "nginx.pid").read_text())
+        try:
+            deadline = time.monotonic() + args.minutes * 60
+            with ThreadPoolExecutor(args.clients) as pool:
+                # Warm up before the baseline RSS sample
+                list(pool.map(lambda s: client(args.port, time.monotonic() + 5, s),
+                              range(args.clients)))
+                start_rss = worker_rss(master)
+                results = pool.map(lambda s: client(args.port, deadline, s),
+                                   range(args.clients))
+                latencies = [t for r in results for t in r]
+            end_rss = worker_rss(master)
+        finally:
+            os.kill(master, signal.SIGQUIT)
+        return start_rss, end_rss, latencies
+    finally:
+        shutil.rmtree(prefix, ignore_errors=True)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    parser.add_argument("builds", nargs="+", help="name=path/to/nginx")
+    parser.add_argument("--port", type=int, default=18080,
+                        help="Front port, the backend uses the next one")
+    parser.add_argument("--minutes", type=float, default=5)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--clients", type=int, default=16)
+    args = parser.parse_args()
+
+    if not sys.platform.startswith("linux"):
+        sys.stderr.write("Worker RSS is read from /proc, Linux only\n")
+        return 1
+
+    print(f"{'build':10} {'RSS start':>10} {'RSS end':>10} {'growth':>8} "
+          f"{'p50 ms':>8} {'p99 ms':>8} {'req/s':>8}")
+    for spec in args.builds:
+        name, _, nginx = spec.partition('=')
+        start_rss, end_rss, lat = soak(name, nginx, args)
+        q = statistics.quantiles(lat, n=100)
+        print(f"{name:10} {start_rss // 1024:8}Mi {end_rss // 1024:8}Mi "
+              f"{(end_rss - start_rss) / start_rss:8.1%} "
+              f"{q[49] * 1000:8.2f} {q[98] * 1000:8.2f} "
+              f"{len(lat) / (args.minutes * 60):8.0f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
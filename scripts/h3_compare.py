@@ -0,0 +1,102 @@
+"""
+Compare HTTP/3 handshake time and throughput of nginx builds on loopback
+
+Each build (e.g. one per `TLSLibInstaller.library`) is started with a
+ minimal QUIC config in a temp prefix, then probed with `curl --http3-only`.
+
+    python h3_compare.py quictls=/opt/quictls/nginx boringssl=/opt/boring/nginx
+"""
+import os
+import sys
+import time
+import shutil
+import signal
+import argparse
+import statistics
+import subprocess
+import tempfile
+from pathlib import Path
+
+CONF = """
+worker_processes 1;
+pid {prefix}/nginx.pid;
+error_log {prefix}/error.log;
+events {{ worker_connections 1024; }}
+http {{
+    access_log off;
+    server {{
+        listen 127.0.0.1:{port} quic reuseport;
+        listen 127.0.0.1:{port} ssl;
+        http3 on;
+        ssl_certificate {prefix}/cert.pem;
+        ssl_certificate_key {prefix}/key.pem;
+        ssl_early_data on;
+        root {prefix}/www;
+    }}
+}}
+"""
+
+
+def curl_h3(url: str) -> tuple[float, float]:
+    """Handshake seconds and download bytes/s of one request"""
+    rs = subprocess.run(
+        ["curl", "--http3-only", "-sk", "-o", os.devnull,
+         "-w", "%{time_appconnect} %{speed_download}", url],
+        capture_output=True, text=True, check=True, timeout=120)
+    handshake, speed = rs.stdout.split()
+    return float(handshake), float(speed)
+
+
+def run_build(name: str, nginx: str, port: int, rounds: int, size_mib: int):
+    prefix = Path(tempfile.mkdtemp(prefix=f"h3_{name}_"))
+    try:
+        (prefix / "www").mkdir()
+        with open(prefix / "www" / "blob", "wb") as f:
+            f.write(os.urandom(size_mib << 20))
+        (prefix / "www" / "index.html").write_text("ok\n")
+        subprocess.run(
+            ["openssl", "req", "-x509", "-newkey", "ec", "-pkeyopt",
+             "ec_paramgen_curve:prime256v1", "-nodes", "-subj", "/CN=localhost",
+             "-days", "1", "-keyout", str(prefix / "key.pem"),
+             "-out", str(prefix / "cert.pem")],
+            check=True, capture_output=True)
+        conf = prefix / "nginx.conf"
+        conf.write_text(CONF.format(prefix=prefix, port=port))
+        subprocess.run([nginx, "-p", str(prefix), "-c", str(conf)], check=True)
+        time.sleep(0.5)
+        try:
+            base = f"https://localhost:{port}"
+            handshakes = [curl_h3(f"{base}/index.html")[0] for _ in range(rounds)]
+            speeds = [curl_h3(f"{base}/blob")[1] for _ in range(max(rounds // 10, 3))]
+        finally:
+            pid = int((prefix / "nginx.pid").read_text())
+            os.kill(pid, signal.SIGQUIT)
+        return statistics.median(handshakes), statistics.median(speeds)
+    finally:
+        shutil.rmtree(prefix, ignore_errors=True)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    parser.add_argument("builds", nargs="+", help="name=path/to/nginx")
+    parser.add_argument("--port", type=int, default=8443)
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--size", type=int, default=64, help="MiB to download")
+    args = parser.parse_args()
+
+    rs = subprocess.run(["curl", "--version"], capture_output=True, text=True)
+    if "HTTP3" not in rs.stdout:
+        sys.stderr.write("curl was built without HTTP/3 support\n")
+        return 1
+
+    print(f"{'build':12} {'handshake ms':>12} {'MB/s':>10}")
+    for spec in args.builds:
+        name, _, nginx = spec.partition('=')
+        handshake, speed = run_build(
+            name, nginx, args.port, args.rounds, args.size)
+        print(f"{name:12} {handshake * 1000:12.2f} {speed / 1e6:10.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+import os
+import json
+import time
+import subprocess
+import pytest
+from pathlib import Path
+
+BASELINES_PATH = Path(__file__).parent / "baselines.json"
+THRESHOLD = float(os.environ.get("NGINX_INSTALL_BENCH_THRESHOLD", "3.0"))
+"""Fail when a hot path gets this many times slower than its baseline"""
+
+
+def _calibrate() -> float:
+    """Time of a fixed pure-Python workload, used to normalise results"""
+    best = float("inf")
+    for _ in range(5):
+        start = time.perf_counter()
+        sum(i * i for i in range(200_000))
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+@pytest.fixture(autouse=True)
+def _opt_in(request):
+    """Timings vary with the machine and its load, so run only on request"""
+    config = request.config
+    if not (config.getoption("--benchmarks")
+            or config.getoption("--update-baselines")):
+        pytest.skip("benchmarks run with --benchmarks")
+
+
+@pytest.fixture(scope="session")
+def baselines(request):
+    data = json.loads(BASELINES_PATH.read_text()) if BASELINES_PATH.exists() else {}
+    yield data
+    if request.config.getoption("--update-baselines"):
+        BASELINES_PATH.write_text(json.dumps(data, indent=2, sort_keys=True) + '\n')
+
+
+@pytest.fixture(scope="session")
+def calibration() -> float:
+    return _calibrate()
+
+
+@pytest.fixture(scope="session")
+def spawn_calibration() -> float:
+    """Best time of 10 bare `true` subprocesses, for process-bound paths"""
+    best = float("inf")
+    for _ in range(5):
+        start = time.perf_counter()
+        for _ in range(10):
+            subprocess.run(["true"], check=True)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+@pytest.fixture
+def bench(request, baselines, calibration):
+    """
+    Time `fn` (best of `rounds`) relative to the calibration workload
+     and compare it with the stored baseline for this test
+    """
+    update = request.config.getoption("--update-baselines")
+
+    def run(fn, *, rounds: int = 5, name: str | None = None,
+            unit: float | None = None) -> float:
+        """`unit` replaces the calibration workload, e.g. `spawn_calibration`"""
+        name = name or request.node.name
+        fn()  # warm up
+        best = float("inf")
+        for _ in range(rounds):
+            start = time.perf_counter()
+            fn()
+            best = min(best, time.perf_counter() - start)
+        ratio = best / (calibration if unit is None else unit)
+
+        if update:
+            baselines[name] = round(ratio, 4)
+        elif name not in baselines:
+            pytest.fail(f"No baseline for {name}, run with --update-baselines")
+        elif ratio > baselines[name] * THRESHOLD:
+            pytest.fail(
+                f"{name} regressed: {ratio:.3f} vs baseline {baselines[name]:.3f} "
+                f"calibration units ({best * 1000:.2f} ms)")
+        return best
+
+    return run
@@ -0,0 +1,126 @@
+"""
+Offline benchmarks of the installer's own hot paths
+
+Results are compared with `baselines.json`, refresh it with
+ `pytest tests/benchmarks --update-baselines` after intended changes.
+Skipped unless pytest runs with `--benchmarks`.
+"""
+import asyncio
+import httpx
+import pytest
+from pathlib import Path
+from getpass import getuser
+from nginx_install.config import Config
+from nginx_install.context import Context
+from nginx_install.installers import from_dict, NginxInstaller
+from nginx_install.utils import MiB
+
+DATA = Path(__file__).parent / "data"
+NGINX_PAGE = (DATA / "nginx_download.html").read_bytes()
+OPENRESTY_PAGE = (DATA / "openresty_download.html").read_bytes()
+
+
+def git_installers(n: int) -> list[dict]:
+    return [
+        {
+            "classname": "GeneralGitInstaller",
+            "enabled": True,
+            "name": f"module-{i}",
+            "url": f"https://example.com/module-{i}.git",
+            "post_cmds": ["./autogen.sh"],
+            "ngx_modulenames": [f"ngx_http_module_{i}"],
+        }
+        for i in range(n)
+    ]
+
+
+def make_ctx(tmp_path: Path, cfg: Config | None = None, dry_run: bool = False):
+    cfg = Config() if cfg is None else cfg
+    cfg.cache.enabled = False
+    build_dir = tmp_path / "build"
+    build_dir.mkdir(exist_ok=True)
+    return Context(cfg, build_dir, dry_run, False, True, getuser())
+
+
+def test_config_validate_many_git_installers(bench):
+    data = Config().model_dump(mode="json")
+    data["installers"] = git_installers(200)
+
+    def run():
+        # `check_installers` replaces dicts in place
+        d = {**data, "installers": [i.copy() for i in data["installers"]]}
+        Config.model_validate(d)
+    bench(run)
+
+
+def test_from_dict_dispatch(bench):
+    dicts = [i.model_dump(mode="json") for i in Config().installers] * 50
+
+    def run():
+        for d in dicts:
+            from_dict(d)
+    bench(run)
+
+
+def test_version_sheet_parsing(bench):
+    def handler(request: httpx.Request):
+        page = NGINX_PAGE if request.url.host == "nginx.org" else OPENRESTY_PAGE
+        return httpx.Response(200, content=page)
+
+    async def parse():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as c:
+            vanilla = await NginxInstaller.get_vanilla_versions(c)
+            openresty = await NginxInstaller.get_openresty_versions(c)
+        assert str(vanilla.mainline) == "1.27.2"
+        assert str(openresty.latest) == "1.25.3-2"
+    bench(lambda: asyncio.run(parse()))
+
+
+def test_run_cmd_overhead(bench, spawn_calibration, tmp_path, fake_bin):
+    ctx = make_ctx(tmp_path)
+
+    def run():
+        for _ in range(10):
+            ctx.sync_run_cmd("true").raise_for_returncode()
+            ctx.sync_run_cmd(["true"], shell=False).raise_for_returncode()
+    # Mostly `sudo` and shell processes, so relative to spawning one
+    bench(run, unit=spawn_calibration)
+
+
+def test_download_throughput(bench, tmp_path, stand_in):
+    stand_in.routes["/blob"] = b"\xa5" * (32 * MiB)
+    ctx = make_ctx(tmp_path)
+    dest = tmp_path / "blob"
+
+    async def download():
+        async with httpx.AsyncClient(transport=stand_in.transport()) as c:
+            ctx.client = c
+            await ctx.download("https://example.com/blob", dest)
+        assert dest.stat().st_size == 32 * MiB
+    bench(lambda: asyncio.run(download()), rounds=3)
+
+
+def test_dry_run_install_pipeline(bench, tmp_path, stand_in, fake_bin):
+    stand_in.routes["/en/download.html"] = NGINX_PAGE
+    stand_in.routes["/download/nginx-1.27.2.tar.gz"] = b"\0" * MiB
+
+    data = Config().model_dump(mode="json")
+    data["core"].update(
+        nginx_version="mainline",
+        modules_path=str(tmp_path / "modules"),
+        error_log_path=str(tmp_path / "log" / "error.log"),
+        http_log_path=str(tmp_path / "log" / "access.log"),
+    )
+    data["installers"] = git_installers(5)
+
+    async def pipeline():
+        cfg = Config.model_validate(data)
+        ctx = make_ctx(tmp_path, cfg, dry_run=True)
+        installers = cfg.installers
+        async with httpx.AsyncClient(transport=stand_in.transport()) as c:
+            ctx.client = c
+            for stage in ("prepare", "build", "install"):
+                await getattr(cfg.core, stage)(ctx)
+                await asyncio.gather(*(getattr(i, stage)(ctx) for i in installers))
+        assert "--add-module=../module-0" in cfg.core.configure_opts
+    bench(lambda: asyncio.run(pipeline()), rounds=3)
@@ -1,9 +1,145 @@
 import pytest
 import os.path
+import threading
+import httpx
 from itertools import product
 from functools import partial
+from pathlib import Path
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+def pytest_addoption(parser):
+    parser.addoption("--benchmarks", action="store_true",
+                     help="Run the timing-sensitive tests/benchmarks")
+    parser.addoption("--update-baselines", action="store_true",
+                     help="Record benchmark results as the new baselines")
 
 
 @pytest.fixture(params=["core", "full"])
 async def conf(request):
     yield request.param
+
+
+class StandInServer(ThreadingHTTPServer):
+    """
+    Local HTTP stand-in serving `routes` (path -> bytes)
+
+    A route with a query string matches only that exact query, a plain
+     path matches any query.
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        self.routes = dict[str, bytes]()
+        self.headers = dict[str, dict[str, str]]()
+        self.requests = list[tuple[str, str, dict[str, str]]]()
+        super().__init__(("127.0.0.1", 0), _StandInHandler)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def transport(self) -> "StandInTransport":
+        return StandInTransport(self.base_url)
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    server: StandInServer
+
+    def _respond(self, body: bool):
+        path = self.path
+        if path not in self.server.routes:
+            path = path.split('?', 1)[0]
+        self.server.requests.append(
+            (self.command, self.path, dict(self.headers.items())))
+        data = self.server.routes.get(path)
+        if data is None:
+            self.send_error(404)
+            return
+        headers = self.server.headers.get(path, {})
+        since = self.headers.get("If-Modified-Since")
+        if since is not None and since == headers.get("Last-Modified"):
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.end_headers()
+        if body:
+            self.wfile.write(data)
+
+    def do_GET(self):
+        self._respond(True)
+
+    def do_HEAD(self):
+        self._respond(False)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandInTransport(httpx.AsyncHTTPTransport):
+    """Sends every request to the stand-in server, keeping the path"""
+
+    def __init__(self, base_url: str):
+        super().__init__()
+        self.base = httpx.URL(base_url)
+
+    async def handle_async_request(self, request):
+        request.url = request.url.copy_with(
+            scheme=self.base.scheme, host=self.base.host, port=self.base.port)
+        return await super().handle_async_request(request)
+
+
+@pytest.fixture
+def stand_in():
+    server = StandInServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+FAKE_BINS = {
+    # Drop `-u user -E` and run the rest as the current user
+    "sudo": """#!/bin/sh
+while [ $# -gt 0 ]; do
+    case "$1" in
+        -u) shift 2 ;;
+        -E) shift ;;
+        *) break ;;
+    esac
+done
+exec "$@"
+""",
+    "git": """#!/bin/sh
+if [ "$1" = clone ]; then mkdir -p "$3"; fi
+exit 0
+""",
+    "cc": """#!/bin/sh
+echo "cc (fake) 0.0.0"
+""",
+}
+
+
+def fake_tool(fake_bin: Path, name: str, script: str):
+    """Add a `/bin/sh` script `name` to `fake_bin`"""
+    p = fake_bin / name
+    p.write_text(f"#!/bin/sh\n{script}\n")
+    p.chmod(0o755)
+
+
+@pytest.fixture
+def fake_bin(tmp_path, monkeypatch) -> Path:
+    """Directory of fake `sudo`, `git` and `cc` put first in `PATH`"""
+    d = tmp_path / "fake_bin"
+    d.mkdir()
+    for name, script in FAKE_BINS.items():
+        p = d / name
+        p.write_text(script)
+        p.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{d}{os.pathsep}{os.environ['PATH']}")
+    return d
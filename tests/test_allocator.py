@@ -0,0 +1,37 @@
+from getpass import getuser
+from pathlib import Path
+import pytest
+from nginx_install.config import Config
+from nginx_install.context import Context
+from nginx_install.installers import AllocatorInstaller
+from tests.conftest import fake_tool
+
+
+def make_ctx(tmp_path: Path) -> Context:
+    cfg = Config()
+    cfg.cache.enabled = False
+    build_dir = tmp_path / "build"
+    build_dir.mkdir(exist_ok=True)
+    return Context(cfg, build_dir, False, False, True, getuser())
+
+
+async def test_prepare_and_verify(tmp_path, fake_bin):
+    fake_tool(fake_bin, "apt-get", 'echo "$@" >> "$(dirname "$0")/apt.log"')
+    ctx = make_ctx(tmp_path)
+    alloc = AllocatorInstaller(enabled=True, system=True)
+    await alloc.prepare(ctx)
+    assert (fake_bin / "apt.log").read_text() == "install -y libjemalloc-dev\n"
+    assert "--with-ld-opt=-ljemalloc" in ctx.core.build_options
+
+    nginx = fake_bin / "nginx"
+    fake_tool(fake_bin, "nginx",
+              'echo "configure arguments: --with-ld-opt=-ljemalloc" >&2')
+    fake_tool(fake_bin, "ldd", 'echo "libjemalloc.so.2 => /lib/libjemalloc.so.2"')
+    await alloc.verify(ctx, nginx)
+
+    fake_tool(fake_bin, "ldd", 'echo "libc.so.6 => /lib/libc.so.6"')
+    with pytest.raises(RuntimeError, match="does not link libjemalloc"):
+        await alloc.verify(ctx, nginx)
+
+    assert AllocatorInstaller(library="mimalloc").expected_ld_opts() == [
+        "-L/usr/local/lib", "-lmimalloc"]
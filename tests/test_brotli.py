@@ -0,0 +1,26 @@
+from getpass import getuser
+from nginx_install.config import Config
+from nginx_install.context import Context
+from nginx_install.installers import BrotliInstaller
+from tests.conftest import fake_tool
+
+
+async def test_native_build(tmp_path, fake_bin):
+    fake_tool(fake_bin, "apt-get", "exit 1")
+    fake_tool(fake_bin, "git", 'if [ "$1" = clone ]; then mkdir -p "$3"; fi\n'
+              'if [ "$1" = submodule ]; then mkdir -p deps/brotli; fi')
+    fake_tool(fake_bin, "cmake", 'echo "$@" >> cmake.log; mkdir -p out; '
+              "touch out/libbrotlienc.a out/libbrotlicommon.a")
+    cfg = Config()
+    cfg.cache.enabled = False
+    build_dir = tmp_path / "build"
+    build_dir.mkdir()
+    ctx = Context(cfg, build_dir, False, False, True, getuser())
+
+    await BrotliInstaller(enabled=True, native=True).prepare(ctx)
+    src = build_dir / "ngx_brotli" / "deps" / "brotli"
+    configure, build = (src / "cmake.log").read_text().splitlines()
+    assert "-DBUILD_SHARED_LIBS=OFF" in configure
+    assert f"-DCMAKE_C_FLAGS={' '.join(cfg.core.cc_opts)}" in configure
+    assert build.endswith("--target brotlienc")
+    assert "--add-module=../ngx_brotli" in cfg.core.configure_opts
@@ -0,0 +1,112 @@
+import os
+from getpass import getuser
+from pathlib import Path
+from nginx_install.build_cache import BuildCache, STAMP_NAME
+from nginx_install.config import Config
+from nginx_install.context import Context
+
+
+def make_ctx(tmp_path: Path, build: str = "build") -> Context:
+    cfg = Config()
+    cfg.cache.dir = tmp_path / "cache"
+    build_dir = tmp_path / build
+    build_dir.mkdir()
+    return Context(cfg, build_dir, False, False, True, getuser())
+
+
+def configured_tree(path: Path) -> Path:
+    """A tree like autotools leaves it, with its own path in the Makefile"""
+    path.mkdir()
+    (path / "Makefile").write_text(f"abs_top_builddir = {path.absolute()}\n")
+    return path
+
+
+async def test_key(tmp_path: Path, fake_bin: Path):
+    ctx = make_ctx(tmp_path)
+    key = await ctx.cache.key("zlib-ng", "2.2.2")
+    assert key == await ctx.cache.key("zlib-ng", "2.2.2")
+    assert key != await ctx.cache.key("zlib-ng", "2.2.3")
+    # Parts are separated, not just concatenated
+    assert await ctx.cache.key("ab", "c") != await ctx.cache.key("a", "bc")
+
+    (fake_bin / "cc").write_text('#!/bin/sh\necho "cc (fake) 0.0.1"\n')
+    other = make_ctx(tmp_path, "other")
+    assert await other.cache.key("zlib-ng", "2.2.2") != key
+
+
+async def test_store_restore(tmp_path: Path, fake_bin: Path):
+    ctx = make_ctx(tmp_path)
+    cache = ctx.cache
+    tree = configured_tree(ctx.build_dir / "libmaxminddb-1.11.0")
+    key = await cache.key("libmaxminddb", "1.11.0")
+    assert not cache.is_configured(tree, key)
+    cache.mark_configured(tree, key)
+    assert cache.is_configured(tree, key)
+    assert not cache.is_configured(tree, key + "0")
+    await cache.store_tree("libmaxminddb", key, tree)
+
+    # Back in the same place, e.g. with a fixed `build_dir`
+    makefile = (tree / "Makefile").read_text()
+    (tree / "Makefile").unlink()
+    assert await cache.restore_tree("libmaxminddb", key, tree)
+    assert (tree / "Makefile").read_text() == makefile
+    assert cache.is_configured(tree, key)
+    assert ctx.metrics.counters["cache_hits"] == 1
+
+    # Its Makefile would point into the old `build_dir`
+    other = make_ctx(tmp_path, "other")
+    dest = other.build_dir / tree.name
+    assert not await other.cache.restore_tree("libmaxminddb", key, dest)
+    assert not dest.exists()
+    assert other.metrics.counters["cache_misses"] == 1
+
+
+async def test_relocatable(tmp_path: Path, fake_bin: Path):
+    ctx = make_ctx(tmp_path)
+    src = ctx.build_dir / "openssl-3.4.0"
+    src.mkdir()
+    (src / "Configure").write_text("#!/usr/bin/env perl\n")
+    key = await ctx.cache.key("openssl", "3.4.0", "source")
+    await ctx.cache.store_tree("openssl", key, src, relocatable=True)
+
+    other = make_ctx(tmp_path, "other")
+    dest = other.build_dir / src.name
+    assert await other.cache.restore_tree("openssl", key, dest, relocatable=True)
+    assert (dest / "Configure").is_file()
+    assert not (dest / STAMP_NAME).exists()
+
+
+async def test_temporary_build_dir(tmp_path: Path, fake_bin: Path):
+    ctx = make_ctx(tmp_path)
+    temp = BuildCache(ctx, ctx.cfg.cache.dir, fixed_build_dir=False)
+    tree = configured_tree(ctx.build_dir / "zlib-ng-2.2.2")
+    key = await temp.key("zlib-ng", "2.2.2")
+    # Never back in the same place, so not worth a copy
+    await temp.store_tree("zlib-ng", key, tree)
+    assert not (ctx.cfg.cache.dir / "trees").exists()
+    await ctx.cache.store_tree("zlib-ng", key, tree)
+    assert not await temp.restore_tree("zlib-ng", key, tree)
+
+    await temp.store_tree("zlib-ng-src", key, tree, relocatable=True)
+    assert await temp.restore_tree("zlib-ng-src", key, tree, relocatable=True)
+
+
+async def test_prune_and_disabled(tmp_path: Path, fake_bin: Path):
+    ctx = make_ctx(tmp_path)
+    tree = configured_tree(ctx.build_dir / "zlib-ng")
+    keys = [await ctx.cache.key("zlib-ng", str(v)) for v in range(5)]
+    d = ctx.cfg.cache.dir / "trees" / "zlib-ng"
+    for i, key in enumerate(keys):
+        await ctx.cache.store_tree("zlib-ng", key, tree)
+        # Distinct mtimes, oldest first
+        os.utime(d / BuildCache.entry(key, tree), (i, i))
+    entries = list(d.iterdir())
+    assert len(entries) == BuildCache.keep
+    assert not await ctx.cache.restore_tree("zlib-ng", keys[0], tree)
+    assert await ctx.cache.restore_tree("zlib-ng", keys[-1], tree)
+
+    off = BuildCache(ctx, tmp_path / "off", enabled=False)
+    await off.store_tree("zlib-ng", keys[0], tree)
+    assert not (tmp_path / "off").exists()
+    assert not await off.restore_tree("zlib-ng", keys[0], tree)
+    assert await off.autoconf_cache_file("zlib-ng") is None
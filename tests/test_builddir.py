@@ -0,0 +1,92 @@
+import tempfile
+from getpass import getuser
+from pathlib import Path
+import pytest
+from nginx_install import builddir
+from nginx_install.config import Config
+from nginx_install.context import Context
+from nginx_install.utils import MiB
+from tests.conftest import fake_tool
+
+
+@pytest.fixture
+def cfg(tmp_path, monkeypatch) -> Config:
+    """tmpfs placement with plenty of RAM and `tmpfs_root` on a tmpfs"""
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    monkeypatch.setattr(builddir, "mem_available", lambda: 64 * 1024 * MiB)
+    monkeypatch.setattr(builddir, "fs_type", lambda path: "tmpfs")
+    monkeypatch.setattr(builddir, "fs_free", lambda path: 64 * 1024 * MiB)
+    cfg = Config()
+    cfg.build.placement = "tmpfs"
+    cfg.build.tmpfs_root = tmp_path / "shm"
+    cfg.build.tmpfs_root.mkdir()
+    return cfg
+
+
+def test_disk(cfg: Config, tmp_path: Path):
+    cfg.build.placement = "disk"
+    bd = builddir.make_build_dir(cfg)
+    assert bd.placement == "disk" and not bd.tmpfs
+    assert bd.path.is_dir() and bd.path.parent == tmp_path
+
+
+def test_existing_tmpfs(cfg: Config):
+    bd = builddir.make_build_dir(cfg)
+    assert bd.tmpfs and bd.mountpoint is None
+    assert bd.path.parent == cfg.build.tmpfs_root
+    assert str(cfg.build.tmpfs_root) in bd.note
+
+
+def test_short_of_ram(cfg: Config, monkeypatch):
+    need = builddir.estimate_build_size(cfg) * builddir.TMPFS_HEADROOM
+    spare = int(need) // 2
+    monkeypatch.setattr(builddir, "mem_available",
+                        lambda: cfg.build.ram_reserve * MiB + spare)
+    bd = builddir.make_build_dir(cfg)
+    assert bd.placement == "disk"
+    assert bd.note.startswith("Need ") and f"only {spare // MiB} MiB" in bd.note
+
+
+def test_tmpfs_too_small(cfg: Config, fake_bin: Path, monkeypatch):
+    monkeypatch.setattr(builddir, "fs_free", lambda path: MiB)
+    bd = builddir.make_build_dir(cfg, dry_run=True)
+    assert bd.placement == "disk" and "dry run" in bd.note
+
+    fake_tool(fake_bin, "mount", 'echo "mount: permission denied" >&2; exit 32')
+    bd = builddir.make_build_dir(cfg)
+    assert bd.placement == "disk"
+    assert bd.note == "Failed to mount tmpfs: mount: permission denied, using disk"
+    # The mountpoint is removed again
+    assert not any(bd.path.parent.glob("nginx_install-*"))
+
+    fake_tool(fake_bin, "mount", 'echo "$@" > "$(dirname "$0")/mount.log"')
+    fake_tool(fake_bin, "umount", 'echo "$@" > "$(dirname "$0")/umount.log"')
+    bd = builddir.make_build_dir(cfg)
+    assert bd.tmpfs and bd.path == bd.mountpoint / "build"
+    args = (fake_bin / "mount.log").read_text().split()
+    assert args[:3] == ["-t", "tmpfs", "-o"] and args[-1] == str(bd.mountpoint)
+    mountpoint = bd.mountpoint
+    bd.release()
+    assert (fake_bin / "umount.log").read_text().split() == ["-l", str(mountpoint)]
+    assert bd.mountpoint is None
+
+
+async def test_save_artifacts(tmp_path: Path, fake_bin: Path):
+    cfg = Config()
+    cfg.cache.enabled = False
+    build_dir = tmp_path / "build"
+    build_dir.mkdir()
+    ctx = Context(cfg, build_dir, False, False, True, getuser())
+    objs = ctx.nginx_src_dir / "objs"
+    objs.mkdir(parents=True)
+    for name in ("nginx", "ngx_http_brotli_filter_module.so", "nginx.o"):
+        (objs / name).write_text(name)
+    staged = build_dir / "variants" / "x86-64-v3" / "usr" / "sbin"
+    staged.mkdir(parents=True)
+    (staged / "nginx").write_text("v3")
+
+    dest = tmp_path / "artifacts"
+    await builddir.save_artifacts(ctx, dest)
+    assert sorted(p.name for p in dest.iterdir()) == [
+        "logs", "nginx", "ngx_http_brotli_filter_module.so", "variants"]
+    assert (dest / "variants" / "x86-64-v3" / "usr" / "sbin" / "nginx").is_file()
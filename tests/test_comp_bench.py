@@ -0,0 +1,60 @@
+import os
+import ctypes.util
+from pathlib import Path
+import pytest
+from nginx_install import comp_bench
+from nginx_install.config import Config
+from nginx_install.ngx_conf import generate, HostInfo
+
+
+def test_advise_and_apply(tmp_path: Path):
+    (tmp_path / "app.js").write_text("function f(a) { return a + 1; }\n" * 300)
+    (tmp_path / "index.html").write_text("<li><a href=/a>item</a></li>\n" * 300)
+    (tmp_path / "token.txt").write_bytes(os.urandom(400))
+    (tmp_path / "logo.png").write_bytes(b"\x89PNG" * 100)
+    bodies = comp_bench.load_sample(tmp_path)
+    assert len(bodies) == 3
+
+    results = comp_bench.run(bodies)
+    gz = [r for r in results if r.codec == "gzip"]
+    assert len(gz) == 9 * len(comp_bench.GZIP_WINDOWS)
+    assert all(0 < r.ratio < 1 for r in gz)
+
+    advice = comp_bench.advise(bodies, results)
+    assert 1 <= advice.gzip_comp_level <= 9
+    # The short random token does not compress at all
+    assert advice.gzip_min_length == 401
+
+    cfg = Config()
+    comp_bench.apply(cfg, advice)
+    text = generate(cfg, HostInfo.detect())
+    assert f"gzip_comp_level {advice.gzip_comp_level};" in text
+    assert f"gzip_min_length {advice.gzip_min_length};" in text
+
+
+@pytest.mark.skipif(ctypes.util.find_library("z") is None, reason="no libz.so")
+def test_compare_zlibs():
+    bodies = [b"function f(a) { return a + 1; }\n" * 300]
+    results = comp_bench.run(bodies, {"sys": Path(ctypes.util.find_library("z"))})
+    sys_results = [r for r in results if r.codec == "gzip-sys"]
+    assert [r.level for r in sys_results] == list(range(1, 10))
+
+    rows = comp_bench.compare_zlibs(results, 9)
+    assert [r.split()[0] for r in rows] == ["gzip", "gzip-sys"]
+    assert rows[0].endswith(" 1.00x")
+
+
+@pytest.mark.skipif(ctypes.util.find_library("brotlienc") is None,
+                    reason="no libbrotlienc.so")
+def test_compare_brotlis():
+    bodies = [b"function f(a) { return a + 1; }\n" * 300]
+    lib = Path(ctypes.util.find_library("brotlienc"))
+    results = comp_bench.run(bodies, brotli_libs={"a": lib, "b": lib})
+    a = [r for r in results if r.codec == "brotli-a"]
+    assert [r.level for r in a] == list(comp_bench.BROTLI_LIB_LEVELS)
+    assert all(r.window == "4m" and 0 < r.ratio < 1 for r in a)
+
+    rows = comp_bench.compare_brotlis(results)
+    assert len(rows) == 2 * len(comp_bench.BROTLI_LIB_LEVELS)
+    assert rows[0].startswith("brotli-a") and rows[0].endswith(" 1.00x")
+    assert comp_bench._lgwin("4m") == 22 and comp_bench._lgwin("512k") == 19
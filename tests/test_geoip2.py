@@ -0,0 +1,166 @@
+import io
+import os
+import sys
+import asyncio
+import subprocess
+import tarfile
+import hashlib
+from getpass import getuser
+from pathlib import Path
+import httpx
+import pytest
+from nginx_install.config import Config
+from nginx_install.context import Context
+from nginx_install.installers import GeoIP2Installer
+from nginx_install.installers.geoip2 import MMDB_METADATA_MARKER
+from tests.conftest import fake_tool
+
+EDITIONS = ["GeoLite2-ASN", "GeoLite2-City"]
+
+
+def edition_tar(eid: str, content: bytes) -> bytes:
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w:gz") as tar:
+        info = tarfile.TarInfo(f"{eid}_20261013/{eid}.mmdb")
+        info.size = len(content)
+        tar.addfile(info, io.BytesIO(content))
+    return buf.getvalue()
+
+
+def mmdb(content: bytes) -> bytes:
+    return content + MMDB_METADATA_MARKER + b"\0" * 16
+
+
+def publish(stand_in, eid: str, content: bytes, last_modified: str | None = None):
+    data = edition_tar(eid, content)
+    url = GeoIP2Installer._edition_url(eid, "key", "tar.gz")
+    path = url.removeprefix("https://download.maxmind.com")
+    stand_in.routes[path] = data
+    stand_in.routes[path + ".md5"] = hashlib.md5(data).hexdigest().encode()
+    if last_modified is not None:
+        stand_in.headers[path] = {"Last-Modified": last_modified}
+
+
+def make_ctx(tmp_path: Path) -> tuple[Context, GeoIP2Installer]:
+    cfg = Config()
+    cfg.cache.enabled = False
+    cfg.core.pid_path = tmp_path / "nginx.pid"
+    build_dir = tmp_path / "build"
+    build_dir.mkdir(exist_ok=True)
+    geoip = GeoIP2Installer(edition_ids=EDITIONS,
+                            database_dir=tmp_path / "GeoIP")
+    return Context(cfg, build_dir, False, False, True, getuser()), geoip
+
+
+def updater(stand_in, ctx: Context, geoip: GeoIP2Installer):
+    async def update() -> list[str]:
+        async with httpx.AsyncClient(transport=stand_in.transport()) as c:
+            ctx.client = c
+            return await geoip.update_databases(ctx, "key", reload=True)
+    return lambda: asyncio.run(update())
+
+
+def test_update_databases(tmp_path, stand_in, fake_bin):
+    for eid in EDITIONS:
+        publish(stand_in, eid, mmdb(f"{eid} v1".encode()))
+    ctx, geoip = make_ctx(tmp_path)
+    update = updater(stand_in, ctx, geoip)
+
+    assert sorted(update()) == EDITIONS
+    city = geoip.database_dir / "GeoLite2-City.mmdb"
+    assert city.read_bytes() == mmdb(b"GeoLite2-City v1")
+    assert not list(geoip.database_dir.glob(".*.tmp"))
+
+    stand_in.requests.clear()
+    assert update() == []
+    # Only the MD5 of each edition was fetched
+    assert all(p.endswith(".md5") for _, p, _ in stand_in.requests)
+
+    publish(stand_in, "GeoLite2-City", mmdb(b"GeoLite2-City v2"))
+    assert update() == ["GeoLite2-City"]
+    assert city.read_bytes() == mmdb(b"GeoLite2-City v2")
+
+
+def test_conditional_update(tmp_path, stand_in, fake_bin):
+    stamp = "Tue, 13 Oct 2026 12:00:00 GMT"
+    for eid in EDITIONS:
+        publish(stand_in, eid, mmdb(f"{eid} v1".encode()), stamp)
+    ctx, geoip = make_ctx(tmp_path)
+    update = updater(stand_in, ctx, geoip)
+    assert sorted(update()) == EDITIONS
+    sizes = {s["labels"]["edition"]: s["value"] for s in ctx.metrics.samples
+             if s["name"] == "geoip_download_bytes"}
+    assert sorted(sizes) == EDITIONS and all(sizes.values())
+
+    stand_in.requests.clear()
+    assert update() == []
+    # One conditional request per unchanged edition
+    assert len(stand_in.requests) == len(EDITIONS)
+    assert all(h.get("If-Modified-Since") == stamp
+               for _, _, h in stand_in.requests)
+
+    # A broken database never replaces the live one
+    city = geoip.database_dir / "GeoLite2-City.mmdb"
+    publish(stand_in, "GeoLite2-City", b"not a database",
+            "Wed, 14 Oct 2026 12:00:00 GMT")
+    with pytest.raises(ValueError):
+        update()
+    assert city.read_bytes() == mmdb(b"GeoLite2-City v1")
+
+
+def test_build_maxminddb_skips_or_reuses(tmp_path, stand_in, fake_bin):
+    stand_in.routes["/maxmind/libmaxminddb/releases/latest"] = \
+        b"<html><body><h1>1.11.0</h1></body></html>"
+    fake_tool(fake_bin, "ldconfig", "exit 0")
+    fake_tool(fake_bin, "pkg-config", "echo 1.11.0")
+    ctx, geoip = make_ctx(tmp_path)
+
+    async def build():
+        async with httpx.AsyncClient(transport=stand_in.transport()) as c:
+            ctx.client = c
+            await geoip._build_maxminddb(ctx)
+
+    asyncio.run(build())
+    assert [p for _, p, _ in stand_in.requests] == [
+        "/maxmind/libmaxminddb/releases/latest"]
+
+    # An older install is upgraded from the tree cached by an earlier
+    # run in the same `build_dir`
+    fake_tool(fake_bin, "pkg-config", "echo 1.10.0")
+    ctx.cache.enabled = True
+    ctx.cache.root = tmp_path / "cache"
+    tree = ctx.build_dir / "libmaxminddb-1.11.0"
+    tree.mkdir()
+    (tree / "Makefile").write_text("install:\n\ttouch installed\n")
+
+    async def build_cached():
+        key = await ctx.cache.key(
+            "libmaxminddb", "1.11.0", "False", *geoip.configure_opts)
+        await ctx.cache.store_tree("libmaxminddb", key, tree)
+        await build()
+
+    stand_in.requests.clear()
+    asyncio.run(build_cached())
+    assert (ctx.build_dir / "libmaxminddb-1.11.0" / "installed").exists()
+    assert not any(p.endswith(".tar.gz") for _, p, _ in stand_in.requests)
+
+
+@pytest.mark.skipif(os.geteuid() != 0, reason="the CLI re-execs with sudo")
+def test_geoip_update_removes_build_dir(tmp_path: Path, fake_bin: Path):
+    from nginx_install.utils import model_dump_yaml
+    cfg = Config()
+    cfg.metrics.enabled = False
+    cfg.cache.enabled = False
+    config_path = tmp_path / "config.yaml"
+    config_path.write_text(model_dump_yaml(cfg))
+    tmp = tmp_path / "tmp"
+    tmp.mkdir()
+
+    # Fails early as GeoIP2Installer is not enabled, after making build_dir
+    rs = subprocess.run(
+        [sys.executable, "-m", "nginx_install", "geoip-update", "-q",
+         "-c", str(config_path)],
+        capture_output=True, text=True, env={**os.environ, "TMPDIR": str(tmp)},
+        check=False)
+    assert rs.returncode == 1 and "not enabled" in rs.stderr
+    assert list(tmp.iterdir()) == []
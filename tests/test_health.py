@@ -0,0 +1,259 @@
+import os
+import sys
+import time
+import signal
+import asyncio
+import subprocess
+from getpass import getuser
+from pathlib import Path
+import httpx
+import pytest
+from nginx_install import health
+from nginx_install.config import Config
+from nginx_install.context import Context
+
+STUB_STATUS = b"""\
+Active connections: 3
+server accepts handled requests
+ 120 120 4567
+Reading: 0 Writing: 1 Waiting: 2
+"""
+
+# `fake_master.py pid_path log delay [new]`, an nginx master as far as its
+# pid file and signals go: `USR2` starts a new one `delay` seconds late
+FAKE_MASTER = """\
+import os, sys, time, signal, subprocess
+pid_path, log, delay = sys.argv[1], sys.argv[2], float(sys.argv[3])
+oldbin = pid_path + ".oldbin"
+me = os.getpid()
+
+
+def on_signal(signum, frame):
+    if signum == signal.SIGCHLD:
+        os.waitpid(-1, os.WNOHANG)
+        if os.path.exists(oldbin):
+            os.replace(oldbin, pid_path)
+        return
+    with open(log, "a") as f:
+        f.write(f"{me} {signal.Signals(signum).name}\\n")
+    if signum == signal.SIGUSR2:
+        os.replace(pid_path, oldbin)
+        subprocess.Popen([sys.executable, *sys.argv[:4], "new"])
+    elif signum == signal.SIGQUIT:
+        if open(pid_path).read().split()[0] == str(me):
+            os.unlink(pid_path)
+        sys.exit(0)
+
+
+for s in ("USR2", "WINCH", "HUP", "QUIT", "CHLD"):
+    signal.signal(getattr(signal, "SIG" + s), on_signal)
+if sys.argv[4:]:
+    time.sleep(delay)
+with open(pid_path, "w") as f:
+    f.write(f"{me}\\n")
+while True:
+    signal.pause()
+"""
+
+
+def window(requests=0, probes=0, errors=0, latencies=(), seconds=10.0):
+    return health.Window(seconds, requests, probes, errors, list(latencies))
+
+
+def test_parse_stub_status():
+    st = health.parse_stub_status(STUB_STATUS.decode())
+    assert st == health.StubStatus(3, 120, 120, 4567)
+    with pytest.raises(ValueError, match="Not a stub_status page"):
+        health.parse_stub_status("<html>404</html>")
+
+
+def test_urls():
+    cfg = Config()
+    cfg.core.configure_opts.append("--with-http_stub_status_module")
+    status, probes = health.urls(cfg)
+    port = cfg.nginx_conf.http_port
+    assert status == f"http://127.0.0.1:{port}/nginx_status"
+    assert probes == [f"http://127.0.0.1:{port}/"]
+    cfg.nginx_conf.stub_status_path = None
+    assert health.urls(cfg)[0] is None
+
+
+def test_compare():
+    cfg = Config()
+    before = window(1000, 10, 0, [0.010] * 10)
+    assert health.compare(before, window(950, 10, 0, [0.012] * 10), cfg) == []
+
+    slower = health.compare(before, window(1000, 10, 0, [0.030] * 10), cfg)
+    assert len(slower) == 1 and slower[0].startswith("p99 latency")
+    # Within latency_slack, whatever the ratio
+    fast = window(1000, 10, 0, [0.001] * 10)
+    assert health.compare(fast, window(1000, 10, 0, [0.004] * 10), cfg) == []
+
+    failing = health.compare(before, window(1000, 10, 3, [0.010] * 7), cfg)
+    assert len(failing) == 1 and failing[0].startswith("probe error rate")
+    dropped = health.compare(before, window(500, 10, 0, [0.010] * 10), cfg)
+    assert len(dropped) == 1 and dropped[0].startswith("throughput")
+    # Too little traffic before to judge throughput
+    idle = window(20, 10, 0, [0.010] * 10)
+    assert health.compare(idle, window(0, 10, 0, [0.010] * 10), cfg) == []
+
+
+async def test_sample(stand_in):
+    stand_in.routes["/"] = b"ok"
+    stand_in.routes["/nginx_status"] = STUB_STATUS
+    base = stand_in.base_url
+    async with httpx.AsyncClient(trust_env=False) as client:
+        w = await health.sample(client, base + "/nginx_status",
+                                [base + "/", base + "/missing"], 0.3, 0.1)
+    assert w.probes >= 4 and w.errors == w.probes // 2
+    assert len(w.latencies) == w.probes
+    # The stand-in's counters never move
+    assert w.requests == 0 and w.rps == 0
+    assert "probes failed" in str(w)
+
+
+def test_backup_restore(tmp_path: Path):
+    cfg = Config()
+    cfg.core.sbin_path = tmp_path / "sbin" / "nginx"
+    cfg.core.modules_path = tmp_path / "modules"
+    cfg.health.backup_dir = tmp_path / "previous"
+    assert not health.backup(cfg)
+    assert not health.restore(cfg)
+
+    cfg.core.sbin_path.parent.mkdir()
+    cfg.core.modules_path.mkdir()
+    cfg.core.sbin_path.write_text("old nginx")
+    (cfg.core.modules_path / "ngx_brotli.so").write_text("old module")
+    assert health.backup(cfg)
+
+    cfg.core.sbin_path.write_text("new nginx")
+    (cfg.core.modules_path / "ngx_brotli.so").write_text("new module")
+    (cfg.core.modules_path / "ngx_http_geoip2_module.so").write_text("added")
+    assert health.restore(cfg)
+    assert cfg.core.sbin_path.read_text() == "old nginx"
+    assert cfg.core.sbin_path.stat().st_mode & 0o777 == 0o755
+    assert (cfg.core.modules_path / "ngx_brotli.so").read_text() == "old module"
+    assert not (cfg.core.modules_path / "ngx_http_geoip2_module.so").exists()
+
+
+def test_read_pid(tmp_path: Path):
+    pid_path = tmp_path / "nginx.pid"
+    assert health.read_pid(pid_path) is None
+    pid_path.write_text(f"{os.getpid()}\n")
+    assert health.read_pid(pid_path) == os.getpid()
+    pid_path.write_text("garbage")
+    assert health.read_pid(pid_path) is None
+
+
+class FakeMaster:
+    def __init__(self, tmp_path: Path, cfg: Config, delay: float = 0):
+        script = tmp_path / "fake_master.py"
+        script.write_text(FAKE_MASTER)
+        self.log = tmp_path / "signals.log"
+        self.log.touch()
+        self.cfg = cfg
+        self.proc = subprocess.Popen(
+            [sys.executable, str(script), str(cfg.core.pid_path),
+             str(self.log), str(delay)])
+
+    async def pid(self, not_: int | None = None) -> int:
+        deadline = time.monotonic() + 5
+        while (pid := health.read_pid(self.cfg.core.pid_path)) in (None, not_):
+            assert time.monotonic() < deadline, "no master started"
+            await asyncio.sleep(0.05)
+        return pid
+
+    async def signals(self, count: int) -> list[str]:
+        """The first `count` signals received, as `<pid> <name>`"""
+        deadline = time.monotonic() + 5
+        while len(lines := self.log.read_text().splitlines()) < count:
+            assert time.monotonic() < deadline, f"only got {lines}"
+            await asyncio.sleep(0.05)
+        return lines
+
+    def kill(self):
+        pids = {int(line.split()[0])
+                for line in self.log.read_text().splitlines()}
+        pids.add(health.read_pid(self.cfg.core.pid_path) or self.proc.pid)
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        self.proc.kill()
+        self.proc.wait()
+
+
+@pytest.fixture
+def master_cfg(tmp_path: Path, stand_in):
+    stand_in.routes["/"] = b"ok"
+    stand_in.routes["/nginx_status"] = STUB_STATUS
+    cfg = Config()
+    cfg.cache.enabled = False
+    cfg.core.pid_path = tmp_path / "nginx.pid"
+    cfg.core.sbin_path = tmp_path / "sbin" / "nginx"
+    cfg.core.modules_path = tmp_path / "modules"
+    cfg.health.backup_dir = tmp_path / "previous"
+    cfg.health.stub_status_url = stand_in.base_url + "/nginx_status"
+    cfg.health.probes = [stand_in.base_url + "/"]
+    cfg.health.window = 0.2
+    cfg.health.interval = 0.1
+    cfg.core.sbin_path.parent.mkdir()
+    cfg.core.modules_path.mkdir()
+    cfg.core.sbin_path.write_text("old nginx")
+    health.backup(cfg)
+    cfg.core.sbin_path.write_text("new nginx")
+    (cfg.core.modules_path / "ngx_http_geoip2_module.so").write_text("added")
+    return cfg
+
+
+async def test_gate(tmp_path: Path, master_cfg: Config):
+    ctx = Context(master_cfg, tmp_path, False, False, True, getuser())
+    master = FakeMaster(tmp_path, master_cfg)
+    try:
+        old = await master.pid()
+        assert await health.gate(ctx)
+        new = await master.pid(old)
+        assert await master.signals(3) == [
+            f"{old} SIGUSR2", f"{old} SIGWINCH", f"{old} SIGQUIT"]
+        assert master.proc.wait(5) == 0
+        assert health.read_pid(master_cfg.core.pid_path) == new
+        assert master_cfg.core.sbin_path.read_text() == "new nginx"
+    finally:
+        master.kill()
+
+
+async def test_gate_rollback(tmp_path: Path, master_cfg: Config,
+                             monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(health, "compare", lambda *_: ["throughput 9 -> 1"])
+    ctx = Context(master_cfg, tmp_path, False, False, True, getuser())
+    master = FakeMaster(tmp_path, master_cfg)
+    try:
+        old = await master.pid()
+        assert not await health.gate(ctx)
+        lines = await master.signals(4)
+        new = int(lines[-1].split()[0])
+        assert lines == [f"{old} SIGUSR2", f"{old} SIGWINCH",
+                         f"{old} SIGHUP", f"{new} SIGQUIT"]
+        # The old master takes its pid file back once the new one quits
+        assert await master.pid(new) == old
+        assert master_cfg.core.sbin_path.read_text() == "old nginx"
+        assert not list(master_cfg.core.modules_path.iterdir())
+    finally:
+        master.kill()
+
+
+async def test_late_master(tmp_path: Path, master_cfg: Config):
+    master = FakeMaster(tmp_path, master_cfg, delay=1)
+    try:
+        old = await master.pid()
+        with pytest.raises(RuntimeError, match="No new master"):
+            await health._upgrade(master_cfg, old, timeout=0.2)
+        late = await health._abort_upgrade(master_cfg, old, timeout=5)
+        assert late is not None and late != old
+        # The old workers were never stopped, so no `WINCH` or `HUP`
+        assert await master.signals(2) == [f"{old} SIGUSR2", f"{late} SIGQUIT"]
+        assert await master.pid(late) == old
+        assert master_cfg.core.sbin_path.read_text() == "old nginx"
+    finally:
+        master.kill()
@@ -0,0 +1,71 @@
+import sys
+import subprocess
+
+HEAVY = {"httpx", "rich", "bs4", "lxml", "semantic_version", "vermils"}
+
+RUN_CLI = (
+    "import sys, runpy\n"
+    "sys.argv = ['nginx_install', {flag!r}]\n"
+    "try:\n"
+    "    runpy.run_module('nginx_install', run_name='__main__')\n"
+    "except SystemExit:\n"
+    "    pass\n"
+)
+
+
+def run_python(*args: str) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, *args], capture_output=True, text=True, check=False)
+
+
+def total_import_time(*args: str) -> int:
+    """Sum of self import times in µs reported by `python -X importtime`"""
+    total = 0
+    for line in run_python("-X", "importtime", *args).stderr.splitlines():
+        if line.startswith("import time:") and "cumulative" not in line:
+            total += int(line.split('|')[0].split(':')[1])
+    return total
+
+
+def loaded_modules(code: str) -> set[str]:
+    """`sys.modules` after running `code`, lazy `import_module` calls included"""
+    rs = run_python("-c", code + "\nimport sys\nprint(*sys.modules, sep='\\n')")
+    return set(rs.stdout.split())
+
+
+def top_level(mods: set[str]) -> set[str]:
+    return {m.split('.')[0] for m in mods}
+
+
+def test_cli_help_is_light():
+    for flag in ("--help", "-V"):
+        mods = loaded_modules(RUN_CLI.format(flag=flag))
+        assert "argparse" in mods
+        heavy = top_level(mods) & (HEAVY | {"pydantic", "yaml"})
+        assert not heavy, f"{flag} imports {heavy}"
+
+
+def test_cli_help_import_time():
+    eager = total_import_time("-c", (
+        "import nginx_install.config, nginx_install.context, httpx, bs4, "
+        "lxml.etree, rich.progress, semantic_version, vermils.io"))
+    lazy = min(total_import_time("-m", "nginx_install", "--help")
+               for _ in range(3))
+    assert lazy < eager / 2, f"--help imports take {lazy}µs, eager {eager}µs"
+
+
+def test_config_skips_http_and_parsers():
+    mods = loaded_modules("import nginx_install.config")
+    assert "nginx_install.config" in mods
+    heavy = top_level(mods) & HEAVY
+    assert not heavy, f"Config imports {heavy}"
+
+
+def test_config_loads_named_installers_only():
+    mods = loaded_modules(
+        "from nginx_install.config import Config\n"
+        "Config.model_validate({'installers': "
+        "[{'classname': 'BrotliInstaller', 'enabled': False}]})")
+    assert "nginx_install.installers.brotli" in mods
+    assert "nginx_install.installers.geoip2" not in mods
+    assert "nginx_install.installers.openssl" not in mods
@@ -0,0 +1,73 @@
+from getpass import getuser
+from pathlib import Path
+import pytest
+from nginx_install.config import Config
+from nginx_install.context import Context
+from nginx_install.luac import compile_package, find_luajit
+from tests.conftest import fake_tool
+
+# `luajit -b -t raw -s|-g src dest`
+LUAJIT = """\
+grep -q "syntax error" "$5" && { echo "$5: syntax error" >&2; exit 1; }
+{ echo "BC $4"; cat "$5"; } > "$6"
+"""
+
+
+def test_compile_package(tmp_path: Path, fake_bin: Path):
+    fake_tool(fake_bin, "luajit", LUAJIT)
+    cfg = Config()
+    cfg.cache.dir = tmp_path / "cache"
+    cfg.core.config_prefix = tmp_path / "etc"
+    cfg.luac.out_dir = tmp_path / "bc"
+    luajit = find_luajit(cfg)
+    assert luajit == fake_bin / "luajit"
+
+    pkg = tmp_path / "app"
+    (pkg / "lib").mkdir(parents=True)
+    (pkg / "init.lua").write_text("return {}\n")
+    mod = pkg / "lib" / "util.lua"
+    mod.write_text("local M = {}\nreturn M\n")
+    (pkg / "README.md").write_text("not Lua")
+
+    stats = compile_package(cfg, pkg, luajit, None)
+    assert (stats.scanned, stats.compiled) == (2, 2)
+    out = tmp_path / "bc" / "app"
+    assert (out / "lib" / "util.lua").read_text() == "BC -s\nlocal M = {}\nreturn M\n"
+    assert not (out / "README.md").exists()
+    assert not list(out.rglob(".*.tmp"))
+
+    stats = compile_package(cfg, pkg, luajit, None)
+    assert stats.unchanged == 2 and stats.compiled == 0
+
+    mod.write_text("syntax error here\n")
+    stats = compile_package(cfg, pkg, luajit, None)
+    assert stats.failed == 1 and stats.unchanged == 1
+    # A failed file is retried until it compiles
+    assert compile_package(cfg, pkg, luajit, None).failed == 1
+    mod.write_text("return 42\n")
+    assert compile_package(cfg, pkg, luajit, None).compiled == 1
+    # Unchanged files are compiled again with line numbers
+    cfg.luac.debug_info = True
+    assert compile_package(cfg, pkg, luajit, None).compiled == 2
+    assert (out / "lib" / "util.lua").read_text() == "BC -g\nreturn 42\n"
+    assert (out / "init.lua").read_text().startswith("BC -g\n")
+
+    mod.unlink()
+    stats = compile_package(cfg, pkg, luajit, None, dry_run=True)
+    assert stats.removed == 1 and (out / "lib" / "util.lua").exists()
+    stats = compile_package(cfg, pkg, luajit, None)
+    assert stats.removed == 1 and not (out / "lib" / "util.lua").exists()
+
+
+async def test_verify_pcre_jit(tmp_path: Path, fake_bin: Path):
+    cfg = Config()
+    cfg.cache.enabled = False
+    ctx = Context(cfg, tmp_path, False, False, True, getuser())
+    nginx = fake_bin / "nginx"
+    fake_tool(fake_bin, "nginx", 'grep -q "pcre_jit on" "$8"')
+    await cfg.core.verify_pcre_jit(ctx, nginx)
+
+    fake_tool(fake_bin, "nginx", 'echo "nginx: [warn] PCRE2 library does '
+              'not support JIT in pcre-jit-check/nginx.conf:3" >&2')
+    with pytest.raises(RuntimeError, match="PCRE JIT is not available"):
+        await cfg.core.verify_pcre_jit(ctx, nginx)
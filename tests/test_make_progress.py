@@ -0,0 +1,40 @@
+import logging
+from types import SimpleNamespace
+from rich.progress import Progress
+from nginx_install.make_progress import MakeProgress, count_units
+from nginx_install.metrics import Metrics
+
+MAKEFILE = """
+CC =	cc
+objs/nginx:	objs/src/core/nginx.o \\
+	objs/src/core/ngx_log.o
+
+objs/src/core/nginx.o:	$(CORE_DEPS) \\
+	src/core/nginx.c
+	$(CC) -c $(CFLAGS) $(CORE_INCS) \\
+		-o objs/src/core/nginx.o \\
+		src/core/nginx.c
+
+objs/src/core/ngx_log.o:	$(CORE_DEPS) \\
+	src/core/ngx_log.c
+"""
+
+
+def test_make_progress(tmp_path):
+    mk = tmp_path / "Makefile"
+    mk.write_text(MAKEFILE)
+    assert count_units([mk, tmp_path / "missing"]) == 2
+
+    ctx = SimpleNamespace(
+        progress=Progress(), logger=logging.getLogger(), metrics=Metrics())
+    mp = MakeProgress(ctx, "Compile", count_units([mk]), jobs=1)
+    mp.feed("cc -c -pipe -O3 -I src/core \\\n")
+    mp.feed("\t\t-o objs/src/core/nginx.o \\\n")
+    mp.feed("\t\t-o objs/src/core/ngx_log.o \\\n")
+    mp.feed("\t\t-o objs/src/core/extra.o \\\n")
+    assert mp.done == 3
+    assert mp.total == 3
+    assert "objs/src/core/nginx.o" in mp.durations
+    mp.finish()
+    assert len(mp.slowest()) == 3
+    assert ctx.metrics.counters["compiled_units"] == 3
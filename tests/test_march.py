@@ -0,0 +1,99 @@
+import shutil
+from getpass import getuser
+from pathlib import Path
+import pytest
+from nginx_install import march
+from nginx_install.config import Config
+from nginx_install.context import Context
+from tests.test_ngx_conf import nginx_bin
+
+CPUINFO = """\
+processor\t: 0
+model name\t: Some CPU
+flags\t\t: fpu cx8 cmov mmx fxsr sse sse2 pni ssse3 cx16 sse4_1 sse4_2 \
+popcnt lahf_lm avx avx2 bmi1 bmi2 f16c fma abm movbe xsave
+"""
+
+
+def test_select(tmp_path: Path):
+    (tmp_path / "cpuinfo").write_text(CPUINFO)
+    flags = march.host_flags(tmp_path / "cpuinfo")
+    assert "avx2" in flags
+    assert march.host_flags(tmp_path / "missing") == frozenset()
+
+    levels = ["x86-64-v2", "x86-64-v3", "x86-64-v4"]
+    assert march.select(levels, flags) == "x86-64-v3"
+    assert march.select(levels, flags - {"movbe"}) == "x86-64-v2"
+    assert march.select(levels[1:], frozenset({"sse2"})) is None
+
+    assert march.with_march(["-O3", "-march=native"], "x86-64-v3") == [
+        "-O3", "-march=x86-64-v3"]
+    assert march.with_march(["-O3"], "skylake") == ["-O3", "-march=skylake"]
+
+
+@pytest.mark.skipif(shutil.which("cc") is None, reason="no C compiler")
+def test_supports_named():
+    assert "__SSE2__" in march.target_features("x86-64")
+    assert march.supports("k8", frozenset(), "cc")
+    assert not march.supports("no-such-cpu", frozenset(), "cc")
+
+
+def test_for_march():
+    cfg = Config()
+    core = cfg.core
+    core.flavor = "openresty"
+    core.configure_opts.append(f"--with-pcre-opt={' '.join(core.cc_opts)}")
+    core.march_variants = ["x86-64-v2", "x86-64-v3"]
+    v3 = core.for_march("x86-64-v3")
+    opts = v3.build_options
+    assert not any("-march=native" in o for o in opts)
+    assert "--with-luajit-xcflags=-DLUAJIT_ENABLE_GC64 -march=x86-64-v3" in opts
+    assert "-march=x86-64-v2" in core.portable_cc_opts
+    assert "-march=native" in core.cc_opts
+
+
+@pytest.mark.skipif(nginx_bin() is None, reason="no nginx binary to run")
+def test_smoke_bench(tmp_path: Path):
+    bench = march.smoke_bench(Path(nginx_bin()), tmp_path, "native", requests=40)
+    assert bench.requests == 40 and bench.rps > 0
+
+
+def stage(root: Path, path: Path, data: bytes) -> Path:
+    p = root / path.relative_to('/')
+    p.parent.mkdir(parents=True, exist_ok=True)
+    p.write_bytes(data)
+    return p
+
+
+async def test_install_variant(tmp_path: Path, monkeypatch):
+    cfg = Config()
+    cfg.cache.enabled = False
+    ctx = Context(cfg, tmp_path / "build", False, False, True, getuser())
+    core = cfg.core
+    core.sbin_path = tmp_path / "sbin" / "nginx"
+    core.modules_path = tmp_path / "modules"
+    core.march_variants = ["x86-64-v2", "x86-64-v3"]
+    monkeypatch.setattr(march, "host_flags", lambda: march.LEVELS["x86-64-v2"])
+
+    assert core.runnable_binary(ctx) is None
+    for m in core.march_variants:
+        root = core.variant_root(ctx, m)
+        stage(root, core.sbin_path, march.ELF_MAGIC + m.encode())
+        stage(root, core.modules_path / "ngx_brotli.so", march.ELF_MAGIC + m.encode())
+        stage(root, tmp_path / "conf" / "mime.types", b"types {}")
+        (root / core.modules_path.relative_to('/') / "ngx_brotli.so.1").symlink_to(
+            "ngx_brotli.so")
+    v2 = core.variant_root(ctx, "x86-64-v2")
+    assert march.staged_elf_files(v2) == [
+        v2 / core.modules_path.relative_to('/') / "ngx_brotli.so",
+        core.variant_binary(ctx, "x86-64-v2")]
+    assert core.runnable_binary(ctx) == core.variant_binary(ctx, "x86-64-v2")
+
+    # As `make install` left them: built for the last variant
+    stage(Path('/'), core.sbin_path, b"v3")
+    stage(Path('/'), core.modules_path / "ngx_brotli.so", b"v3")
+    await core.install_variant(ctx)
+    assert core.sbin_path.read_bytes().endswith(b"x86-64-v2")
+    assert (core.modules_path / "ngx_brotli.so").read_bytes().endswith(b"x86-64-v2")
+    assert not (tmp_path / "conf").exists()
+    assert ctx.metrics.labels["march"] == "x86-64-v2"
@@ -0,0 +1,81 @@
+import json
+import time
+from pathlib import Path
+from types import SimpleNamespace
+import pytest
+from nginx_install.metrics import Metrics
+
+
+async def test_phase_and_measure():
+    m = Metrics()
+    with m.phase("prepare"):
+        time.sleep(0.01)
+    with m.phase("prepare"):
+        pass
+    assert m.phases["prepare"] >= 0.01
+
+    async def step() -> int:
+        return 42
+
+    core = SimpleNamespace(classname="NginxInstaller")
+    assert await m.measure(core, "build", step()) == 42
+
+    async def fail():
+        raise RuntimeError("make failed")
+
+    with pytest.raises(RuntimeError):
+        await m.measure("BrotliInstaller", "prepare", fail())
+    assert set(m.installers) == {"NginxInstaller", "BrotliInstaller"}
+    assert "build" in m.installers["NginxInstaller"]
+    assert "prepare" in m.installers["BrotliInstaller"]
+
+
+def metrics() -> Metrics:
+    m = Metrics()
+    m.labels = {"host": 'web"1'}
+    m.outcome = "success"
+    m.phases["build"] = 12.5
+    m.installers["NginxInstaller"] = {"build": 10.0}
+    m.incr("cache_hits")
+    m.incr("cache_hits")
+    m.incr("cache_misses")
+    m.set("binary_size_bytes", 4096)
+    m.observe("geoip2_bytes", 100, edition="GeoLite2-City")
+    m.observe("geoip2_bytes", 50, edition="GeoLite2-ASN")
+    return m
+
+
+def test_jsonl(tmp_path: Path):
+    path = tmp_path / "log" / "metrics.jsonl"
+    m = metrics()
+    m.write_jsonl(path)
+    m.outcome = "failed"
+    m.write_jsonl(path)
+    first, second = map(json.loads, path.read_text().splitlines())
+    assert first["outcome"] == "success" and second["outcome"] == "failed"
+    counters = first["counters"]
+    assert counters["cache_hits"] == 2 and counters["binary_size_bytes"] == 4096
+    assert counters["cache_hit_ratio"] == pytest.approx(2 / 3)
+    assert first["phases"] == {"build": 12.5}
+    assert first["installers"] == {"NginxInstaller": {"build": 10.0}}
+    assert {"name": "geoip2_bytes", "labels": {"edition": "GeoLite2-ASN"},
+            "value": 50} in first["samples"]
+
+
+def test_prometheus(tmp_path: Path):
+    path = tmp_path / "nginx_install.prom"
+    metrics().write_prometheus(path)
+    lines = path.read_text().splitlines()
+    host = 'host="web\\"1"'
+    assert "# TYPE nginx_install_last_run_success gauge" in lines
+    assert f"nginx_install_last_run_success{{{host}}} 1" in lines
+    assert f'nginx_install_phase_duration_seconds{{{host},phase="build"}} 12.5' \
+        in lines
+    assert ("nginx_install_installer_duration_seconds"
+            f'{{{host},installer="NginxInstaller",phase="build"}} 10.0') in lines
+    assert f"nginx_install_binary_size_bytes{{{host}}} 4096" in lines
+    assert f'nginx_install_geoip2_bytes{{{host},edition="GeoLite2-City"}} 100' \
+        in lines
+    # One HELP/TYPE per metric, however many samples
+    assert lines.count("# TYPE nginx_install_geoip2_bytes gauge") == 1
+    assert not list(tmp_path.glob(".*"))
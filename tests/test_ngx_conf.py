@@ -0,0 +1,186 @@
+import os
+import shutil
+import signal
+import subprocess
+from pathlib import Path
+import pytest
+from nginx_install.config import Config
+from nginx_install.ngx_conf import HostInfo, generate, sysctl_conf, tune
+from nginx_install.utils import MiB
+
+host = HostInfo(cpus=8, cores=4, packages=1, nofile_soft=1024,
+                nofile_hard=524288, file_max=9223372036854775807,
+                mem_total=16384 * MiB)
+
+
+def test_tune():
+    cfg = Config()
+    t = tune(cfg, host)
+    assert t.worker_processes == 8
+    assert t.worker_cpu_affinity
+    assert t.worker_connections == 64512
+    assert t.worker_rlimit_nofile == 2 * 64512
+    assert t.ssl_session_cache == 130
+    assert t.backlog == 64512
+
+    small = host._replace(cpus=1, cores=1, file_max=8192, mem_total=512 * MiB)
+    t = tune(cfg, small)
+    assert not t.worker_cpu_affinity
+    assert t.worker_connections == 2048
+    assert t.ssl_session_cache == 10
+
+    cfg.nginx_conf.worker_connections = 4096
+    assert tune(cfg, host).worker_connections == 4096
+
+    assert "hard limit" not in tune(cfg, host).why["worker_rlimit_nofile"]
+    t = tune(cfg, host._replace(nofile_hard=4096, nr_open=6000))
+    assert t.worker_rlimit_nofile == 6000
+    assert "Above the hard limit (4096)" in t.why["worker_rlimit_nofile"]
+
+
+def test_generate_opts():
+    cfg = Config()
+    cfg.core.configure_opts.remove("--with-threads")
+    text = generate(cfg, host)
+    assert "aio on;" in text and "directio" in text
+    assert "worker_rlimit_nofile 129024;" in text
+    assert "listen 443 ssl http2 reuseport backlog=64512 fastopen=256;" in text
+
+    cfg.core.configure_opts.append("--with-threads")
+    cfg.nginx_conf.reuseport = False
+    text = generate(cfg, host)
+    assert "aio threads;" in text
+    cfg.nginx_conf.backlog = 1024
+    cfg.nginx_conf.fastopen = None
+    text = generate(cfg, host)
+    assert "listen 443 ssl http2 backlog=1024;" in text
+    assert "listen 80 backlog=1024;" in text
+    # QUIC needs it regardless to keep each client on one worker
+    assert "listen 443 quic reuseport" in text
+    assert "ssl_conf_command" not in text
+
+    openssl = next(i for i in cfg.installers if i.classname == "OpenSSLInstaller")
+    openssl.enabled = openssl.ktls = True
+    assert "ssl_conf_command Options KTLS;" in generate(cfg, host)
+    assert openssl.openssl_opts("3.1.7") == ["enable-ktls", "no-tests"]
+
+    tls_lib = next(i for i in cfg.installers if i.classname == "TLSLibInstaller")
+    tls_lib.enabled = True
+    assert "ssl_conf_command" not in generate(cfg, host)
+
+
+def test_generate_http3():
+    cfg = Config()
+    cfg.nginx_conf.https_port = 8443
+    text = generate(cfg, host)
+    size = cfg.nginx_conf.udp_buffer_size
+    assert f"listen [::]:8443 quic reuseport rcvbuf={size} sndbuf={size};" in text
+    assert "quic_gso on;" in text and "quic_retry off;" in text
+    assert "http3_stream_buffer_size 1m;" in text
+    assert """add_header Alt-Svc 'h3=":8443"; ma=86400' always;""" in text
+    assert "quic_bpf" not in text
+    assert sysctl_conf(cfg, host) == (
+        "net.core.somaxconn = 64512\n"
+        "net.ipv4.tcp_max_syn_backlog = 64512\n"
+        "net.ipv4.tcp_fastopen = 3\n"
+        f"net.core.rmem_max = {size}\nnet.core.wmem_max = {size}\n"
+        "net.ipv4.ip_local_port_range = 1024 65535\n"
+        "net.ipv4.ip_local_reserved_ports = 8443\n"
+        f"fs.file-max = {8 * 2 * 64512 * 2}\n")
+
+    cfg.nginx_conf.quic_bpf = True
+    assert "\nquic_bpf on;" in generate(cfg, host)
+
+    cfg.core.configure_opts.remove("--with-http_v3_module")
+    text = generate(cfg, host)
+    assert "quic" not in text and "Alt-Svc" not in text
+    assert "rmem_max" not in sysctl_conf(cfg, host)
+
+
+def nginx_bin() -> str | None:
+    return os.environ.get("NGINX_BIN") or shutil.which("nginx")
+
+
+def curl_has_http3() -> bool:
+    if shutil.which("curl") is None:
+        return False
+    rs = subprocess.run(["curl", "--version"], capture_output=True, text=True,
+                        check=False)
+    return "HTTP3" in rs.stdout
+
+
+def local_config(tmp_path: Path, cfg: Config | None = None) -> tuple[Config, Path]:
+    """Config serving `tmp_path` with a self-signed cert, and its nginx.conf"""
+    cfg = Config() if cfg is None else cfg
+    core = cfg.core
+    core.config_prefix = tmp_path
+    core.error_log_path = tmp_path / "error.log"
+    core.http_log_path = tmp_path / "access.log"
+    (tmp_path / "mime.types").write_text("types { text/html html; }\n")
+    (tmp_path / "conf.d").mkdir()
+    conf = cfg.nginx_conf
+    conf.root = tmp_path
+    conf.ssl_certificate = tmp_path / "cert.pem"
+    conf.ssl_certificate_key = tmp_path / "key.pem"
+    conf.ssl_dhparam = None
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes",
+         "-subj", "/CN=localhost", "-days", "1",
+         "-keyout", str(conf.ssl_certificate_key),
+         "-out", str(conf.ssl_certificate)],
+        check=True, capture_output=True)
+    for i in cfg.installers:
+        # Modules the binary under test may not have been built with
+        i.enabled = False
+
+    nginx_conf = tmp_path / "nginx.conf"
+    nginx_conf.write_text(
+        f"pid {tmp_path / 'nginx.pid'};\n" + generate(cfg, HostInfo.detect()))
+    return cfg, nginx_conf
+
+
+@pytest.mark.skipif(nginx_bin() is None, reason="no nginx binary to check with")
+@pytest.mark.skipif(shutil.which("openssl") is None, reason="no openssl")
+def test_nginx_t(tmp_path: Path):
+    cfg, nginx_conf = local_config(tmp_path)
+    core = cfg.core
+    rs = subprocess.run(
+        [nginx_bin(), "-t", "-p", str(tmp_path), "-c", str(nginx_conf),
+         "-e", str(core.error_log_path)],
+        capture_output=True, text=True, check=False)
+    assert rs.returncode == 0, rs.stderr
+
+
+@pytest.mark.skipif(nginx_bin() is None, reason="no nginx binary to run")
+@pytest.mark.skipif(shutil.which("openssl") is None, reason="no openssl")
+@pytest.mark.skipif(not curl_has_http3(), reason="curl lacks HTTP/3")
+def test_http3_smoke(tmp_path: Path):
+    rs = subprocess.run([nginx_bin(), "-V"], capture_output=True, text=True,
+                        check=False)
+    if "--with-http_v3_module" not in rs.stderr:
+        pytest.skip("nginx was built without HTTP/3")
+
+    cfg = Config()
+    cfg.nginx_conf.http_port = 18080
+    cfg.nginx_conf.https_port = 18443
+    cfg.nginx_conf.worker_processes = 2
+    # Unprivileged sockets may not exceed the current net.core.[rw]mem_max
+    cfg.nginx_conf.udp_buffer_size = 212992
+    cfg, nginx_conf = local_config(tmp_path, cfg)
+    (tmp_path / "index.html").write_text("hello h3\n")
+
+    core = cfg.core
+    subprocess.run(
+        [nginx_bin(), "-p", str(tmp_path), "-c", str(nginx_conf),
+         "-e", str(core.error_log_path)],
+        check=True, capture_output=True)
+    try:
+        rs = subprocess.run(
+            ["curl", "--http3-only", "-sk", "--max-time", "10",
+             "-w", "%{http_version}", "https://localhost:18443/"],
+            capture_output=True, text=True, check=False)
+    finally:
+        pid = int((tmp_path / "nginx.pid").read_text())
+        os.kill(pid, signal.SIGQUIT)
+    assert rs.returncode == 0, (tmp_path / "error.log").read_text()
+    assert rs.stdout == "hello h3\n3"
@@ -0,0 +1,93 @@
+import io
+import tarfile
+from getpass import getuser
+from pathlib import Path
+import httpx
+import pytest
+from nginx_install.config import Config
+from nginx_install.context import Context
+from nginx_install.installers import PCRE2Installer
+from tests.conftest import fake_tool
+
+DOWNLOAD_PAGE = b"""\
+<html><body>
+<h4>Mainline version</h4>
+<table><tr><td><a href="/download/nginx-1.27.2.tar.gz">nginx-1.27.2</a></td></tr></table>
+<h4>Stable version</h4>
+<table><tr><td><a href="/download/nginx-1.26.2.tar.gz">nginx-1.26.2</a></td></tr></table>
+<h4>Legacy versions</h4>
+<table><tr><td><a href="/download/nginx-1.24.0.tar.gz">nginx-1.24.0</a></td></tr></table>
+</body></html>
+"""
+
+
+def source_tar(v: str) -> bytes:
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w:gz") as tar:
+        info = tarfile.TarInfo(f"pcre2-{v}/configure")
+        tar.addfile(info, io.BytesIO())
+    return buf.getvalue()
+
+
+def make_ctx(tmp_path: Path) -> Context:
+    cfg = Config()
+    cfg.cache.enabled = False
+    build_dir = tmp_path / "build"
+    build_dir.mkdir()
+    return Context(cfg, build_dir, False, False, True, getuser())
+
+
+async def test_prepare(tmp_path, stand_in, fake_bin):
+    stand_in.routes[
+        "/PCRE2Project/pcre2/releases/download/pcre2-10.44/pcre2-10.44.tar.gz"
+    ] = source_tar("10.44")
+    ctx = make_ctx(tmp_path)
+    core = ctx.core
+    assert "--with-pcre-jit" in core.configure_opts
+    async with httpx.AsyncClient(transport=stand_in.transport()) as c:
+        ctx.client = c
+        await PCRE2Installer(enabled=True).prepare(ctx)
+
+    assert (ctx.build_dir / "pcre2-10.44" / "configure").is_file()
+    assert "--with-pcre=../pcre2-10.44" in core.configure_opts
+    assert core.configure_opts.count("--with-pcre-jit") == 1
+    pcre_opt = f"--with-pcre-opt={' '.join(core.cc_opts)}"
+    assert "-march=native" in pcre_opt and pcre_opt in core.configure_opts
+
+    # Each CPU variant compiles PCRE2 for its own `-march` too
+    v3 = core.for_march("x86-64-v3")
+    opt = next(o for o in v3.configure_opts if o.startswith("--with-pcre-opt="))
+    assert "-march=x86-64-v3" in opt and "-march=native" not in opt
+
+
+async def test_prepare_adds_jit(tmp_path, stand_in, fake_bin):
+    stand_in.routes[
+        "/PCRE2Project/pcre2/releases/download/pcre2-10.44/pcre2-10.44.tar.gz"
+    ] = source_tar("10.44")
+    ctx = make_ctx(tmp_path)
+    ctx.core.configure_opts.remove("--with-pcre-jit")
+    async with httpx.AsyncClient(transport=stand_in.transport()) as c:
+        ctx.client = c
+        await PCRE2Installer(enabled=True).prepare(ctx)
+    assert ctx.core.configure_opts.count("--with-pcre-jit") == 1
+
+
+@pytest.mark.parametrize("pcre2", [True, False])
+async def test_core_packages(tmp_path, stand_in, fake_bin, pcre2):
+    fake_tool(fake_bin, "apt-get",
+              'echo "$@" >> "$(dirname "$0")/apt-get.log"')
+    stand_in.routes["/en/download.html"] = DOWNLOAD_PAGE
+    ctx = make_ctx(tmp_path)
+    for i in ctx.cfg.installers:
+        if i.classname == "PCRE2Installer":
+            i.enabled = pcre2
+    async with httpx.AsyncClient(transport=stand_in.transport()) as c:
+        ctx.client = c
+        # Stops at the nginx download, after installing the packages
+        with pytest.raises(httpx.HTTPStatusError):
+            await ctx.core.prepare(ctx)
+
+    install = (fake_bin / "apt-get.log").read_text().splitlines()[-1].split()
+    assert install[:2] == ["install", "-y"] and "zlib1g-dev" in install
+    # Only the PCRE2 sources are compiled in, PCRE1 stays off the host
+    assert ("libpcre3" in install) == ("libpcre3-dev" in install) == (not pcre2)
@@ -0,0 +1,177 @@
+import shlex
+from pathlib import Path
+from nginx_install import systemd
+from nginx_install.config import Config
+from nginx_install.luac import luac
+from nginx_install.plan import (
+    Installed, diff, drift, normalize_opt, parse_nginx_v)
+from tests.conftest import fake_tool
+from tests.test_luac import LUAJIT
+
+
+def nginx_v(args: list[str], version: str = "1.27.2") -> str:
+    return (
+        f"nginx version: nginx/{version}\n"
+        "built by gcc 13.2.0 (Ubuntu 13.2.0-23ubuntu4)\n"
+        "built with OpenSSL 3.3.2 3 Sep 2024\n"
+        "TLS SNI support enabled\n"
+        f"configure arguments: {' '.join(shlex.quote(a) for a in args)}\n"
+    )
+
+
+def make_config() -> Config:
+    cfg = Config()
+    cfg.core.nginx_version = "1.27.2"
+    for i in cfg.installers:
+        if i.classname in ("BrotliInstaller", "OpenSSLInstaller"):
+            i.enabled = True
+    return cfg
+
+
+def test_parse_nginx_v():
+    version, args = parse_nginx_v(nginx_v(["--with-cc-opt=-O3 -g", "--with-threads"]))
+    assert version == "1.27.2"
+    assert args == ["--with-cc-opt=-O3 -g", "--with-threads"]
+    assert normalize_opt("--with-openssl=../openssl-3.3.2") == \
+        "--with-openssl=.../openssl-3.3.2"
+    assert normalize_opt("--with-pcre-opt=-O3 -g") == "--with-pcre-opt="
+
+
+def test_diff():
+    cfg = make_config()
+    built = [*cfg.core.build_options,
+             "--add-module=../ngx_brotli", "--with-openssl=../openssl-3.3.1",
+             "--with-openssl-opt=no-tests no-docs"]
+    version, args = parse_nginx_v(nginx_v(built))
+    installed = Installed(version, args, [])
+    plan = diff(cfg, installed, "1.27.2")
+    assert plan.changes == []
+
+    plan = diff(cfg, installed, "1.27.3")
+    assert [c.sign for c in plan.changes] == ['~']
+
+    cfg.core.configure_opts.remove("--with-http_v3_module")
+    next(i for i in cfg.installers if i.classname == "BrotliInstaller").dynamic = True
+    plan = diff(cfg, installed, "1.27.2")
+    assert {str(c).strip() for c in plan.changes} == {
+        "+ --add-dynamic-module=.../ngx_brotli",
+        "- --add-module=.../ngx_brotli",
+        "- --with-http_v3_module",
+        "+ module ngx_http_brotli_filter_module.so",
+        "+ module ngx_http_brotli_static_module.so",
+    }
+
+    assert diff(cfg, None, "1.27.2").changes[0].sign == '+'
+
+
+def test_diff_pinned_versions():
+    cfg = make_config()
+    by_name = {i.classname: i for i in cfg.installers}
+    by_name["OpenSSLInstaller"].version = "3.3.2"
+    by_name["PCRE2Installer"].enabled = True
+    by_name["ZlibNgInstaller"].enabled = True
+    built = [*cfg.core.build_options, "--add-module=../ngx_brotli",
+             "--with-openssl=../openssl-3.3.2",
+             "--with-openssl-opt=no-tests no-docs",
+             f"--with-pcre=../pcre2-{by_name['PCRE2Installer'].version}",
+             "--with-pcre-opt=-O3", "--with-pcre-jit",
+             f"--with-zlib=../zlib-ng-{by_name['ZlibNgInstaller'].version}"]
+    version, args = parse_nginx_v(nginx_v(built))
+    installed = Installed(version, args, [])
+    assert diff(cfg, installed, "1.27.2").changes == []
+
+    by_name["OpenSSLInstaller"].version = "3.4.0"
+    by_name["PCRE2Installer"].version = "10.45"
+    by_name["ZlibNgInstaller"].version = "2.2.4"
+    assert {str(c).strip() for c in diff(cfg, installed, "1.27.2").changes} \
+        >= {"+ --with-openssl=.../openssl-3.4.0",
+            "- --with-openssl=.../openssl-3.3.2",
+            "+ --with-pcre=.../pcre2-10.45",
+            "+ --with-zlib=.../zlib-ng-2.2.4"}
+
+    # `latest` matches whatever release was built
+    by_name["OpenSSLInstaller"].version = "latest"
+    assert not any("openssl" in c.what for c in diff(
+        cfg, installed, "1.27.2").changes)
+
+
+def test_diff_tls_lib():
+    cfg = make_config()
+    tls = next(i for i in cfg.installers if i.classname == "TLSLibInstaller")
+    tls.enabled = True
+    tls.library = "boringssl"
+    opts = cfg.core.model_copy(update={
+        "cc_opts": [*cfg.core.cc_opts, "-I../boringssl/include"],
+        "ld_opts": ["-L../boringssl/build", "-L../boringssl/build/ssl",
+                    "-L../boringssl/build/crypto", "-lstdc++"],
+    }).build_options
+    assert sum(o.startswith("--with-ld-opt=") for o in opts) == 1
+    assert sum(o.startswith("--with-cc-opt=") for o in opts) == 1
+    built = [*opts, "--add-module=../ngx_brotli"]
+    version, args = parse_nginx_v(nginx_v(built))
+    # The enabled OpenSSLInstaller is dropped in favour of TLSLibInstaller
+    assert diff(cfg, Installed(version, args, []), "1.27.2").changes == []
+    # A pinned ref is built in its own dir, so it shows in the flags
+    tls.version = "0.20250114"
+    assert diff(cfg, Installed(version, args, []), "1.27.2").changes != []
+    tls.version = ""
+
+    tls.library = "quictls"
+    assert {str(c).strip() for c in diff(
+        cfg, Installed(version, args, []), "1.27.2").changes} == {
+        "+ --with-openssl=.../quictls",
+        "+ --with-openssl-opt=no-tests",
+        "- --with-ld-opt=-L../boringssl/build -L../boringssl/build/ssl "
+        "-L../boringssl/build/crypto -lstdc++",
+        f"- --with-cc-opt={' '.join(cfg.core.cc_opts)} -I../boringssl/include",
+        f"+ --with-cc-opt={' '.join(cfg.core.cc_opts)}",
+    }
+
+
+def test_diff_openresty_luajit():
+    cfg = make_config()
+    cfg.core.flavor = "openresty"
+    opts = cfg.core.build_options
+    assert "--with-luajit-xcflags=-DLUAJIT_ENABLE_GC64 -march=native" in opts
+    # OpenResty does not pass the LuaJIT flags on to nginx's configure
+    built = [o for o in opts if not o.startswith("--with-luajit-xcflags=")]
+    built += ["--add-module=../ngx_brotli", "--with-openssl=../openssl-3.3.1",
+              "--with-openssl-opt=no-tests no-docs"]
+    version, args = parse_nginx_v(nginx_v(built))
+    plan = diff(cfg, Installed(version, args, []), "1.27.2")
+    assert plan.changes == []
+    assert any("LuaJIT" in n for n in plan.notes)
+
+
+def test_drift(tmp_path: Path, fake_bin: Path):
+    cfg = make_config()
+    cfg.systemd.unit_dir = tmp_path / "systemd"
+    cfg.systemd.unit_dir.mkdir()
+    unit_path, dropin_path = systemd.paths(cfg)
+    assert {c.what for c in drift(cfg)} == {
+        f"systemd {unit_path}", f"systemd {dropin_path}"}
+    systemd.write(cfg)
+    assert drift(cfg) == []
+
+    # The limits follow the nginx config, the binary doesn't
+    cfg.nginx_conf.worker_connections = 1024
+    assert [str(c) for c in drift(cfg)] == [f"  ~ systemd {dropin_path}"]
+    systemd.write(cfg)
+
+    fake_tool(fake_bin, "luajit", LUAJIT)
+    cfg.core.flavor = "openresty"
+    cfg.cache.dir = tmp_path / "cache"
+    cfg.luac.luajit = fake_bin / "luajit"
+    cfg.luac.out_dir = tmp_path / "bc"
+    pkg = tmp_path / "app"
+    pkg.mkdir()
+    (pkg / "init.lua").write_text("return {}\n")
+    cfg.luac.package_dirs = [pkg]
+    assert [c.what for c in drift(cfg)] == [f"Lua bytecode in {tmp_path / 'bc'}"]
+    luac(cfg)
+    assert drift(cfg) == []
+    cfg.luac.debug_info = True
+    assert len(drift(cfg)) == 1
+    luac(cfg)
+    (pkg / "init.lua").unlink()
+    assert len(drift(cfg)) == 1
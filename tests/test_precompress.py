@@ -0,0 +1,95 @@
+import os
+import gzip
+from types import SimpleNamespace
+from pathlib import Path
+import pytest
+from nginx_install import precompress
+from nginx_install.config import Config
+from nginx_install.precompress import eligible, precompress_root
+
+
+def make_config(tmp_path: Path) -> Config:
+    cfg = Config()
+    cfg.cache.dir = tmp_path / "cache"
+    cfg.precompress.min_size = 64
+    return cfg
+
+
+def test_precompress_root(tmp_path: Path):
+    cfg = make_config(tmp_path)
+    root = tmp_path / "www"
+    (root / "css").mkdir(parents=True)
+    css = root / "css" / "site.css"
+    css.write_text("body { color: red; }\n" * 200)
+    (root / "tiny.txt").write_text("hi")
+    noise = root / "noise.txt"
+    noise.write_bytes(os.urandom(4096))
+    (root / "photo.png").write_bytes(b"\x89PNG" + b"\0" * 4096)
+
+    stats = precompress_root(cfg, root, None)
+    assert stats.scanned == 2
+    assert stats.compressed == 1 and stats.not_smaller == 1
+    gz = root / "css" / "site.css.gz"
+    assert gzip.decompress(gz.read_bytes()) == css.read_bytes()
+    assert gz.stat().st_mtime_ns == css.stat().st_mtime_ns
+    assert not (root / "noise.txt.gz").exists()
+    assert not (root / "photo.png.gz").exists()
+    assert not list(root.rglob(".*.tmp"))
+
+    stats = precompress_root(cfg, root, None)
+    assert stats.unchanged == 2 and stats.compressed == 0
+
+    css.write_text("a { color: blue; }\n" * 300)
+    stats = precompress_root(cfg, root, None)
+    assert stats.compressed == 1 and stats.unchanged == 1
+    assert gzip.decompress(gz.read_bytes()) == css.read_bytes()
+
+    css.unlink()
+    stats = precompress_root(cfg, root, None, dry_run=True)
+    assert stats.removed >= 1 and gz.exists()
+    stats = precompress_root(cfg, root, None)
+    assert stats.removed >= 1 and not gz.exists()
+
+
+def test_html(tmp_path: Path):
+    cfg = make_config(tmp_path)
+    root = tmp_path / "www"
+    root.mkdir()
+    page = root / "index.html"
+    page.write_text("<p>Hello, world</p>\n" * 200)
+    assert eligible(page, 64)
+    assert not eligible(root / "missing.html", 0)
+
+    stats = precompress_root(cfg, root, None)
+    assert stats.compressed == 1
+    assert gzip.decompress((root / "index.html.gz").read_bytes()) == \
+        page.read_bytes()
+
+
+def test_rerun_when_settings_or_outputs_change(tmp_path: Path,
+                                              monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(precompress, "brotli", None)
+    cfg = make_config(tmp_path)
+    root = tmp_path / "www"
+    root.mkdir()
+    css = root / "site.css"
+    css.write_text("body { color: red; }\n" * 200)
+    gz = root / "site.css.gz"
+    assert precompress_root(cfg, root, None).compressed == 1
+    assert precompress_root(cfg, root, None).unchanged == 1
+
+    cfg.precompress.gzip_level = 1
+    assert precompress_root(cfg, root, None).compressed == 1
+    assert gzip.decompress(gz.read_bytes()) == css.read_bytes()
+    assert precompress_root(cfg, root, None).unchanged == 1
+
+    gz.unlink()
+    assert precompress_root(cfg, root, None).compressed == 1
+    assert gz.is_file()
+
+    # Installing `brotli` later adds the .br siblings
+    monkeypatch.setattr(precompress, "brotli", SimpleNamespace(
+        compress=lambda data, quality: b"br"))
+    assert precompress_root(cfg, root, None).compressed == 1
+    assert (root / "site.css.br").read_bytes() == b"br"
+    assert precompress_root(cfg, root, None).unchanged == 1
@@ -0,0 +1,58 @@
+import ctypes.util
+from pathlib import Path
+import pytest
+from nginx_install import regex_bench
+
+CONF = """
+http {
+    map $http_user_agent $bot {
+        default 0;
+        ~*(bot|crawler) 1;   # comment with ~ and { }
+    }
+    include conf.d/*.conf;
+}
+"""
+SITE = """
+server {
+    server_name example.com ~^www\\d+\\.example\\.com$;
+    location ~ \\.php$ { return 404; }
+    location ~* "^/static/.+\\.(css|js)$" { expires 1y; }
+    if ($request_uri ~ "^/old/") { rewrite ^/old/(.*)$ /new/$1 permanent; }
+}
+"""
+
+
+def test_extract(tmp_path: Path):
+    (tmp_path / "nginx.conf").write_text(CONF)
+    (tmp_path / "conf.d").mkdir()
+    (tmp_path / "conf.d" / "site.conf").write_text(SITE)
+    regexes = regex_bench.extract(tmp_path / "nginx.conf")
+    assert [(r.pattern, r.caseless) for r in regexes] == [
+        ("(bot|crawler)", True),
+        (r"^www\d+\.example\.com$", False),
+        (r"\.php$", False),
+        (r"^/static/.+\.(css|js)$", True),
+        ("^/old/", False),
+        ("^/old/(.*)$", False),
+    ]
+    assert regexes[2].where.endswith("site.conf:4")
+
+    log = tmp_path / "access.log"
+    log.write_text(
+        '127.0.0.1 - - [19/Oct/2026:10:00:00 +0000] "GET /index.php HTTP/1.1" 200 5 "-" "-"\n'
+        "/STATIC/app.JS\n\n")
+    assert regex_bench.load_uris(log) == [b"/index.php", b"/STATIC/app.JS"]
+
+
+@pytest.mark.skipif(ctypes.util.find_library("pcre2-8") is None,
+                    reason="no libpcre2-8")
+def test_run():
+    regexes = [regex_bench.Regex(r"\.php$", False, "t:1"),
+               regex_bench.Regex(r"^/static/.+\.(css|js)$", True, "t:2")]
+    uris = [b"/index.php", b"/STATIC/app.JS", b"/"] * 100
+    results = regex_bench.PCRE2().run(regexes, uris)
+    assert [r.matches for r in results] == [100, 100]
+    assert "matches/s interpreted" in regex_bench.summary(results, uris)[0]
+
+    with pytest.raises(ValueError, match="bad regex"):
+        regex_bench.PCRE2().run([regex_bench.Regex("(", False, "t:3")], uris)
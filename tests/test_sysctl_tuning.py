@@ -0,0 +1,86 @@
+from getpass import getuser
+from pathlib import Path
+import pytest
+from nginx_install import systemd
+from nginx_install.config import Config
+from nginx_install.context import Context
+from nginx_install.installers import SysctlTuningInstaller, sysctl_tuning
+from nginx_install.plan import make_plan
+from tests.conftest import fake_tool
+from tests.test_ngx_conf import host
+from tests.test_plan import nginx_v
+
+
+def fake_proc_sys(root: Path, values: dict[str, str]) -> Path:
+    for key, value in values.items():
+        p = root / key.replace('.', '/')
+        p.parent.mkdir(parents=True, exist_ok=True)
+        p.write_text(value + '\n')
+    return root
+
+
+def test_rows(tmp_path: Path):
+    proc_sys = fake_proc_sys(tmp_path, {
+        "net.core.somaxconn": "4096",
+        "net.core.rmem_max": str(64 << 20),
+        "net.ipv4.tcp_fastopen": "1",
+        "net.ipv4.ip_local_port_range": "32768\t60999",
+    })
+    sysctl = SysctlTuningInstaller(enabled=True, extra={"vm.swappiness": 10})
+    rows = {r.key: r for r in sysctl.rows(Config(), host, proc_sys)}
+    assert str(rows["net.core.somaxconn"]) == "  ~ net.core.somaxconn: 4096 -> 64512"
+    # Already larger than the 8MiB QUIC buffers, kept
+    assert not rows["net.core.rmem_max"].changed
+    assert rows["net.ipv4.tcp_fastopen"].value == "3"
+    assert rows["net.ipv4.ip_local_port_range"].current == "32768 60999"
+    assert rows["net.ipv4.ip_local_port_range"].value == "1024 65535"
+    assert rows["vm.swappiness"] == ("vm.swappiness", None, "10")
+    assert "net.core.somaxconn = 64512\n" in sysctl.render(list(rows.values()))
+
+
+async def test_install_uninstall(tmp_path: Path, fake_bin: Path):
+    fake_tool(fake_bin, "sysctl", 'echo "sysctl: permission denied" >&2; exit 1')
+    cfg = Config()
+    cfg.cache.enabled = False
+    ctx = Context(cfg, tmp_path, False, False, True, getuser())
+    sysctl = SysctlTuningInstaller(enabled=True, path=tmp_path / "90-nginx.conf")
+    # A failure to apply live is only a warning
+    await sysctl.install(ctx)
+    text = sysctl.path.read_text()
+    assert text.startswith("# Generated") and "net.core.somaxconn = " in text
+    await sysctl.uninstall(ctx)
+    assert not sysctl.path.exists()
+
+
+async def test_plan(tmp_path: Path, fake_bin: Path,
+                    monkeypatch: pytest.MonkeyPatch):
+    live = dict[str, str]()
+    monkeypatch.setattr(sysctl_tuning, "read_sysctl",
+                        lambda key, proc_sys=None: live.get(key))
+    fake_tool(fake_bin, "sysctl", "exit 0")
+    sysctl = SysctlTuningInstaller(enabled=True, path=tmp_path / "90-nginx.conf")
+    cfg = Config()
+    cfg.cache.enabled = False
+    cfg.core.nginx_version = "1.27.2"
+    cfg.installers = [sysctl]
+    cfg.systemd.unit_dir = tmp_path
+    systemd.write(cfg)
+    # The installed binary already matches the config
+    cfg.core.sbin_path = fake_bin / "nginx"
+    fake_tool(fake_bin, "nginx",
+              f"cat >&2 <<'EOF'\n{nginx_v(cfg.core.build_options)}EOF")
+
+    # So only the profile keeps `install` from stopping early
+    plan = await make_plan(cfg)
+    assert plan.changes[0].what == f"sysctl profile {sysctl.path}"
+    assert len(plan.changes) == 1 + len(sysctl.rows(cfg))
+
+    ctx = Context(cfg, tmp_path, False, False, True, getuser())
+    await sysctl.install(ctx)
+    assert sysctl.path.read_text() == sysctl.render(sysctl.rows(cfg))
+    live.update((r.key, r.value) for r in sysctl.rows(cfg))
+    assert (await make_plan(cfg)).changes == []
+
+    sysctl.path.write_text("# edited\n")
+    assert [c.what for c in (await make_plan(cfg)).changes] == [
+        f"sysctl profile {sysctl.path}"]
@@ -0,0 +1,78 @@
+import shutil
+import subprocess
+from pathlib import Path
+import pytest
+from nginx_install import systemd
+from nginx_install.config import Config
+from tests.test_ngx_conf import host
+
+
+def make_config(tmp_path: Path) -> Config:
+    cfg = Config()
+    cfg.systemd.unit_dir = tmp_path
+    cfg.core.sbin_path = Path(shutil.which("true") or "/bin/true")
+    return cfg
+
+
+def test_settings(tmp_path: Path):
+    cfg = make_config(tmp_path)
+    text = systemd.dropin(cfg, host)
+    assert text.startswith("# Generated")
+    # 8 workers of 64512 connections, two fds each, plus headroom
+    assert "LimitNOFILE=130048\n" in text
+    assert "TasksMax=272\n" in text
+    assert "OOMScoreAdjust=-500\n" in text
+    assert "LimitMEMLOCK" not in text and "Nice" not in text
+
+    cfg.nginx_conf.quic_bpf = True
+    cfg.systemd.nice = -5
+    cfg.systemd.extra = {"LimitCORE": "infinity"}
+    text = systemd.dropin(cfg, host._replace(nr_open=65536))
+    assert "LimitNOFILE=65536\n" in text
+    assert "LimitMEMLOCK=infinity\n" in text
+    assert "Nice=-5\n" in text and "LimitCORE=infinity\n" in text
+
+    unit = systemd.unit(cfg, host)
+    service, install = unit.split("[Install]")
+    assert "Nice=-5\n" in service and "ExecStart=" in service
+    assert "WantedBy=multi-user.target" in install
+
+
+def test_write(tmp_path: Path):
+    cfg = make_config(tmp_path)
+    unit_path, dropin_path = systemd.paths(cfg)
+    assert systemd.stale(cfg, host) == [unit_path, dropin_path]
+    assert systemd.write(cfg, host) == [unit_path, dropin_path]
+    assert systemd.stale(cfg, host) == []
+    assert "LimitNOFILE" not in unit_path.read_text()
+
+    # Local edits of the unit are kept, the drop-in is rewritten
+    unit_path.write_text(unit_path.read_text() + "# local\n")
+    cfg.systemd.nice = 5
+    assert systemd.write(cfg, host) == [dropin_path]
+    assert unit_path.read_text().endswith("# local\n")
+    assert "Nice=5" in dropin_path.read_text()
+
+    cfg.systemd.dropin = False
+    assert systemd.stale(cfg, host) == [unit_path, dropin_path]
+    assert systemd.write(cfg, host) == [unit_path]
+    assert systemd.stale(cfg, host) == []
+    assert "Nice=5" in unit_path.read_text() and not dropin_path.exists()
+
+
+@pytest.mark.skipif(shutil.which("systemd-analyze") is None,
+                    reason="no systemd-analyze")
+def test_verify(tmp_path: Path):
+    cfg = make_config(tmp_path)
+    systemd.write(cfg, host)
+    unit_path, dropin_path = systemd.paths(cfg)
+
+    def verify() -> list[str]:
+        rs = subprocess.run(["systemd-analyze", "verify", str(unit_path)],
+                            capture_output=True, text=True, check=False)
+        return systemd.problems(cfg, rs.stdout + rs.stderr)
+
+    assert verify() == []
+    cfg.systemd.extra = {"Nice": "very"}
+    systemd.write(cfg, host)
+    assert verify()[0].startswith(f"{dropin_path}:")
@@ -0,0 +1,97 @@
+import io
+import tarfile
+from getpass import getuser
+from multiprocessing import cpu_count
+from pathlib import Path
+import httpx
+import pytest
+from nginx_install.config import Config
+from nginx_install.context import Context
+from nginx_install.installers import TLSLibInstaller
+from tests.conftest import fake_tool
+
+CONFIGURE = b'#!/bin/sh\necho configure "$@" >> build.log\n'
+
+
+def libressl_tar(v: str) -> bytes:
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w:gz") as tar:
+        info = tarfile.TarInfo(f"libressl-{v}/configure")
+        info.size = len(CONFIGURE)
+        info.mode = 0o755
+        tar.addfile(info, io.BytesIO(CONFIGURE))
+    return buf.getvalue()
+
+
+def make_ctx(tmp_path: Path) -> Context:
+    cfg = Config()
+    cfg.cache.enabled = False
+    build_dir = tmp_path / "build"
+    build_dir.mkdir()
+    return Context(cfg, build_dir, False, False, True, getuser())
+
+
+@pytest.mark.parametrize("library, version, dir_name, include, libs", [
+    ("boringssl", "0.20250114", "boringssl-0.20250114", "include",
+     ["build", "build/ssl", "build/crypto"]),
+    ("aws-lc", "", "aws-lc", "include", ["build/ssl", "build/crypto"]),
+    ("libressl", "", "libressl-4.0.0", ".openssl/include", [".openssl/lib"]),
+])
+async def test_prepare(tmp_path, stand_in, fake_bin, library, version,
+                       dir_name, include, libs):
+    fake_tool(fake_bin, "cmake", 'echo cmake "$@" >> build.log')
+    fake_tool(fake_bin, "make", 'echo make "$@" >> build.log')
+    stand_in.routes["/pub/OpenBSD/LibreSSL/libressl-4.0.0.tar.gz"] = \
+        libressl_tar("4.0.0")
+    ctx = make_ctx(tmp_path)
+    tls = TLSLibInstaller(enabled=True, library=library, version=version)
+    async with httpx.AsyncClient(transport=stand_in.transport()) as c:
+        ctx.client = c
+        await tls.prepare(ctx)
+
+    src = ctx.build_dir / dir_name
+    log = (src / "build.log").read_text().splitlines()
+    assert f"-j {cpu_count()}" in log[1]
+    if library == "libressl":
+        assert log[0].startswith("configure --disable-shared")
+        assert log[2] == "make install"
+    else:
+        assert log[0].startswith("cmake -B build -DCMAKE_BUILD_TYPE=Release")
+        assert log[1].endswith("ssl crypto")
+
+    # Relative to where nginx's configure runs, pointing into the tree
+    def target(opt: str) -> Path:
+        return (ctx.nginx_src_dir / opt[2:]).resolve()
+
+    added_cc = ctx.core.cc_opts[len(Config().core.cc_opts):]
+    assert [target(o) for o in added_cc] == [src / include]
+    lib_dirs = [target(o) for o in ctx.core.ld_opts if o.startswith("-L")]
+    assert lib_dirs == [src / d for d in libs]
+    assert ("-lstdc++" in ctx.core.ld_opts) == (library == "boringssl")
+    assert not any(o.startswith("--with-openssl")
+                   for o in ctx.core.configure_opts)
+
+
+async def test_prepare_quictls(tmp_path, fake_bin):
+    ctx = make_ctx(tmp_path)
+    tls = TLSLibInstaller(enabled=True, library="quictls")
+    await tls.prepare(ctx)
+    # Built by nginx like OpenSSL
+    assert not (ctx.build_dir / "quictls" / "build.log").exists()
+    assert ctx.core.configure_opts[-2:] == [
+        "--with-openssl=../quictls", "--with-openssl-opt=no-tests"]
+    assert ctx.core.ld_opts == Config().core.ld_opts
+
+
+async def test_replaces_openssl(tmp_path, stand_in, fake_bin):
+    ctx = make_ctx(tmp_path)
+    for i in ctx.cfg.installers:
+        if i.classname in ("OpenSSLInstaller", "TLSLibInstaller"):
+            i.enabled = True
+    async with httpx.AsyncClient(transport=stand_in.transport()) as c:
+        ctx.client = c
+        # Stops at the nginx version lookup, after picking the installers
+        with pytest.raises(httpx.HTTPStatusError):
+            await ctx.core.prepare(ctx)
+    names = [i.classname for i in ctx.cfg.installers if i.enabled]
+    assert "TLSLibInstaller" in names and "OpenSSLInstaller" not in names
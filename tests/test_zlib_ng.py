@@ -0,0 +1,52 @@
+import io
+import tarfile
+from getpass import getuser
+import httpx
+from nginx_install.config import Config
+from nginx_install.context import Context
+from nginx_install.installers import ZlibNgInstaller
+from nginx_install.plan import Installed, diff
+
+# Records its arguments so the test can see what nginx's bare call turns into
+CONFIGURE = b'#!/bin/sh\necho "$@" >> "$(dirname "$0")/configure.log"\n'
+
+
+def source_tar(v: str) -> bytes:
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w:gz") as tar:
+        info = tarfile.TarInfo(f"zlib-ng-{v}/configure")
+        info.size = len(CONFIGURE)
+        info.mode = 0o755
+        tar.addfile(info, io.BytesIO(CONFIGURE))
+    return buf.getvalue()
+
+
+async def test_prepare_keeps_zlib_compat(tmp_path, stand_in, fake_bin):
+    ng = ZlibNgInstaller(enabled=True, version="2.2.2")
+    stand_in.routes["/zlib-ng/zlib-ng/archive/refs/tags/2.2.2.tar.gz"] = \
+        source_tar("2.2.2")
+    cfg = Config()
+    cfg.cache.enabled = False
+    build_dir = tmp_path / "build"
+    build_dir.mkdir()
+    ctx = Context(cfg, build_dir, False, False, True, getuser())
+    async with httpx.AsyncClient(transport=stand_in.transport()) as c:
+        ctx.client = c
+        await ng.prepare(ctx)
+
+    src = build_dir / "zlib-ng-2.2.2"
+    assert "--with-zlib=../zlib-ng-2.2.2" in ctx.core.configure_opts
+    # What nginx's `--with-zlib` make rule runs
+    rs = await ctx.run_cmd("./configure", cwd=src)
+    rs.raise_for_returncode()
+    assert (src / "configure.log").read_text() == "--zlib-compat\n" * 2
+
+
+def test_plan_replaces_zlib_cf():
+    cfg = Config()
+    cfg.core.nginx_version = "1.27.2"
+    for i in cfg.installers:
+        if i.classname in ("ZlibCFInstaller", "ZlibNgInstaller"):
+            i.enabled = True
+    built = [*cfg.core.build_options, "--with-zlib=../zlib-ng-2.2.2"]
+    assert diff(cfg, Installed("1.27.2", built, []), "1.27.2").changes == []